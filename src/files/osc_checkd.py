@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""Persistent runner serving the python NRPE plugins over a unix socket.
+
+The plugins in the nagios plugins directory forward their command line to this
+daemon (see `osc_checkd_client`). The daemon executes the plugin in-process, so the
+OpenStack SDK is imported only once and the authenticated sessions created by
+`openstack.connect` and `os_client_config` are reused between checks until they
+reach `--session-max-age`.
+
+Checks are executed one at a time, because plugins rely on process wide state
+(`sys.argv`, `os.environ` and stdout). A request waits for the running check at
+most `--queue-timeout` seconds and its check may take at most the timeout sent by
+the client, otherwise the client is told to run the check locally. A check which
+exceeds the timeout cannot be interrupted, it finishes in the background and its
+result is dropped. Requests whose client disconnected while waiting are dropped.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import runpy
+import select
+import signal
+import socketserver
+import sys
+import threading
+import time
+
+APP = "osc-checkd"
+LOG = logging.getLogger(name=APP)
+PLUGINS_DIR = "/usr/local/lib/nagios/plugins/"
+SOCKET_PATH = "/run/nagios/osc-checkd.sock"
+SESSION_MAX_AGE = 3600
+# seconds a request waits for the check in progress before it is run by the client
+QUEUE_TIMEOUT = 5
+# seconds a check may take, if the client does not send its own timeout
+RUN_TIMEOUT = 25
+NAGIOS_STATUS_UNKNOWN = 3
+
+
+class SessionCache:
+    """Cache of OpenStack connections and session clients.
+
+    The cache key consists of the factory name, its arguments and all `OS_*`
+    environment variables, so a different novarc will never reuse a session.
+    """
+
+    def __init__(self, max_age=SESSION_MAX_AGE):
+        """Set initial values."""
+        self.max_age = max_age
+        self._sessions = {}
+
+    def _key(self, name, args, kwargs):
+        env = tuple(sorted((k, v) for k, v in os.environ.items() if k.startswith("OS_")))
+        return name, repr(args), repr(sorted(kwargs.items())), env
+
+    def wrap(self, name, factory):
+        """Return memoized version of session factory."""
+
+        def _cached_factory(*args, **kwargs):
+            key = self._key(name, args, kwargs)
+            created, session = self._sessions.get(key, (None, None))
+            if created is None or time.monotonic() - created > self.max_age:
+                LOG.debug("creating new %s session", name)
+                session = factory(*args, **kwargs)
+                self._sessions[key] = (time.monotonic(), session)
+
+            return session
+
+        return _cached_factory
+
+    def install(self):
+        """Replace SDK session factories with cached ones."""
+        try:
+            import openstack
+
+            openstack.connect = self.wrap("openstack.connect", openstack.connect)
+        except ImportError:
+            LOG.warning("openstacksdk is not available, sessions will not be cached")
+
+        try:
+            import os_client_config
+
+            for name in ("session_client", "make_rest_client"):
+                factory = getattr(os_client_config, name)
+                setattr(os_client_config, name, self.wrap("os_client_config." + name, factory))
+        except ImportError:
+            LOG.warning("os_client_config is not available, sessions will not be cached")
+
+    def clear(self):
+        """Drop all cached sessions."""
+        self._sessions.clear()
+
+
+def run_plugin(plugins_dir, plugin, argv):
+    """Run plugin in-process and return its output and exit code.
+
+    :param plugins_dir: directory with nagios plugins
+    :type plugins_dir: str
+    :param plugin: plugin file name, e.g. check_resources.py
+    :type plugin: str
+    :param argv: plugin arguments
+    :type argv: List[str]
+    :returns: plugin output and exit code
+    :rtype: Tuple[str, int]
+    """
+    path = os.path.join(plugins_dir, plugin)
+    # API call statistics and run duration are reported by each check separately
+    for name in ("osc_api_stats", "osc_metrics"):
+        module = sys.modules.get(name)
+        if module is not None:
+            module.reset()
+
+    stdout = io.StringIO()
+    saved_argv = sys.argv
+    sys.argv = [path, *argv]
+    try:
+        with contextlib.redirect_stdout(stdout):
+            runpy.run_path(path, run_name="__main__")
+        status = 0
+    except SystemExit as error:
+        if error.code is None or isinstance(error.code, int):
+            status = error.code or 0
+        else:
+            # `sys.exit("message")` prints the message and exits with 1
+            stdout.write("{}\n".format(error.code))
+            status = 1
+    except Exception as error:
+        LOG.exception("plugin %s failed", plugin)
+        stdout.write("UNKNOWN: {} failed in osc-checkd: {}\n".format(plugin, error))
+        status = NAGIOS_STATUS_UNKNOWN
+    finally:
+        sys.argv = saved_argv
+
+    return stdout.getvalue(), status
+
+
+class CheckRequestHandler(socketserver.StreamRequestHandler):
+    """Handle one check request."""
+
+    def handle(self):
+        received = time.monotonic()
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+            plugin, argv = request["plugin"], [str(arg) for arg in request["argv"]]
+            timeout = float(request.get("timeout", RUN_TIMEOUT))
+        except (ValueError, KeyError, TypeError) as error:
+            self._respond({"error": "invalid request: {}".format(error)})
+            return
+
+        if plugin not in self.server.plugins:
+            self._respond({"error": "plugin {} is not served".format(plugin)})
+            return
+
+        command = " ".join([plugin, *argv])
+        if not self.server.lock.acquire(timeout=min(self.server.queue_timeout, timeout)):
+            LOG.warning("%s is not run, another check is in progress", command)
+            self._respond({"error": "another check is in progress"})
+            return
+
+        if self._disconnected():
+            self.server.lock.release()
+            LOG.warning("%s is dropped, its client disconnected", command)
+            return
+
+        result = []
+        worker = threading.Thread(target=self._run, args=(plugin, argv, command, result))
+        worker.start()
+        # the worker releases the lock when the check finishes
+        worker.join(timeout - (time.monotonic() - received))
+        if not result:
+            LOG.warning("%s did not finish in %.0fs, it is run by the client", command, timeout)
+            self._respond({"error": "check did not finish in {:.0f}s".format(timeout)})
+            return
+
+        output, status = result[0]
+        self._respond({"output": output, "status": status})
+
+    def _run(self, plugin, argv, command, result):
+        try:
+            started = time.monotonic()
+            result.append(run_plugin(self.server.plugins_dir, plugin, argv))
+            LOG.info(
+                "%s finished with %s in %.2fs", command, result[0][1], time.monotonic() - started
+            )
+        finally:
+            self.server.lock.release()
+
+    def _disconnected(self):
+        """Check if the client closed the connection, e.g. after its timeout."""
+        poll = select.poll()
+        poll.register(self.connection, select.POLLHUP)
+        return bool(poll.poll(0))
+
+    def _respond(self, response):
+        try:
+            self.wfile.write(json.dumps(response).encode("utf-8"))
+        except OSError as error:
+            LOG.warning("response was not sent: %s", error)
+
+
+class CheckServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server running the checks."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, plugins_dir, queue_timeout=QUEUE_TIMEOUT):
+        """Bind the socket and collect the plugins which can be served."""
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        super().__init__(socket_path, CheckRequestHandler)
+        os.chmod(socket_path, 0o660)
+        self.plugins_dir = plugins_dir
+        self.queue_timeout = queue_timeout
+        self.lock = threading.Lock()
+        self.plugins = {
+            name
+            for name in os.listdir(plugins_dir)
+            if name.startswith("check_") and name.endswith(".py")
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve python nagios plugins over a unix socket",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--socket", default=SOCKET_PATH, help="unix socket path")
+    parser.add_argument("--plugins-dir", default=PLUGINS_DIR, help="nagios plugins directory")
+    parser.add_argument(
+        "--session-max-age",
+        type=int,
+        default=SESSION_MAX_AGE,
+        help="seconds after which cached OpenStack sessions are recreated",
+    )
+    parser.add_argument(
+        "--queue-timeout",
+        type=float,
+        default=QUEUE_TIMEOUT,
+        help="seconds a request waits for the check in progress before it runs locally",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="print verbose log")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level="DEBUG" if args.verbose else "INFO",
+        format="%(name)s - %(asctime)s - %(levelname)s: %(message)s",
+    )
+
+    # plugins import their shared modules from the plugins directory
+    sys.path.insert(0, args.plugins_dir)
+    import osc_checkd_client
+
+    osc_checkd_client.IN_DAEMON = True
+    sessions = SessionCache(max_age=args.session_max_age)
+    sessions.install()
+
+    server = CheckServer(args.socket, args.plugins_dir, args.queue_timeout)
+    signal.signal(signal.SIGHUP, lambda *_: sessions.clear())
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    LOG.info("serving %s on %s", ", ".join(sorted(server.plugins)), args.socket)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
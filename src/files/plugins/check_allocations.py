@@ -20,6 +20,22 @@ NAGIOS_STATUS = {
 }
 
 STATUS_FILE = "/var/lib/nagios/allocations.out"
+# maximum age of the status in seconds, two starts of the job every 5 minutes
+MAX_AGE = 600
+
+
+def max_age(saved_state):
+    """Get maximum age of the status saved by the run with given interval and duration.
+
+    The next run starts one interval after the saved one and its start can be skipped
+    while a longer run is in progress, so the status is stale after two intervals
+    and the duration of the run.
+    """
+    run = (saved_state or {}).get("run") or {}
+    if not run.get("interval"):
+        return MAX_AGE
+
+    return max(MAX_AGE, int(2 * run["interval"] + run.get("duration", 0)))
 
 
 def main():
@@ -27,16 +43,20 @@ def main():
         print("UNKNOWN: {} does not exist".format(STATUS_FILE))
         sys.exit(NAGIOS_STATUS_UNKNOWN)
 
-    try_check(check_file_freshness, STATUS_FILE)
-
     with open(STATUS_FILE, "r") as f:
         try:
-            saved_state = json.loads(f.read())
-            print(saved_state["message"])
-            sys.exit(saved_state["status"])
-        except json.decoder.JSONDecodeError as error:
-            print("UNKNOWN: error[{}]".format(str(error)))
-            sys.exit(NAGIOS_STATUS_UNKNOWN)
+            saved_state, error = json.loads(f.read()), None
+        except json.decoder.JSONDecodeError as decode_error:
+            saved_state, error = None, decode_error
+
+    try_check(check_file_freshness, STATUS_FILE, max_age(saved_state))
+
+    if error is not None:
+        print("UNKNOWN: error[{}]".format(str(error)))
+        sys.exit(NAGIOS_STATUS_UNKNOWN)
+
+    print(saved_state["message"])
+    sys.exit(saved_state["status"])
 
 
 if __name__ == "__main__":
@@ -2,11 +2,16 @@
 """Perform cinder services nagios checks."""
 
 import argparse
-import os
-import subprocess
 
 import nagios_plugin3
-import os_client_config
+from osc_api_stats import attach_api_stats
+from osc_checkd_client import delegate_to_daemon
+from osc_lazy import lazy_import
+from osc_metrics import report
+from osc_novarc import set_openstack_credentials
+from osc_token_cache import attach_token_cache
+
+os_client_config = lazy_import("os_client_config")
 
 
 def check_status(service):
@@ -34,7 +39,7 @@ def check_cinder_services(args, cinder):
     services = cinder.get("/os-services").json()["services"]
     if not services:
         output = "UNKNOWN: No cinder services found"
-        raise nagios_plugin3.UnknownError(output)
+        raise nagios_plugin3.UnknownError(report("cinder_services", output))
 
     msgs = {"DISABLED": [], "DOWN": []}
     ok = 0
@@ -48,24 +53,26 @@ def check_cinder_services(args, cinder):
 
         msgs[status].append(msg)
 
+    resources = {"up": ok, "down": len(msgs["DOWN"]), "disabled": len(msgs["DISABLED"])}
     if ok == 0:
         output = "CRITICAL: No cinder services found healthy"
-        raise nagios_plugin3.CriticalError(output)
+        raise nagios_plugin3.CriticalError(report("cinder_services", output, resources=resources))
 
     if msgs["DOWN"]:
         output = "CRITICAL: {}".format(", ".join(sorted(msgs["DOWN"])))
         if msgs["DISABLED"]:
             output += "; Disabled: {}".format(", ".join(sorted(msgs["DISABLED"])))
-        raise nagios_plugin3.CriticalError(output)
+        raise nagios_plugin3.CriticalError(report("cinder_services", output, resources=resources))
 
     if msgs["DISABLED"]:
         output = "WARNING: Disabled: {}".format(", ".join(sorted(msgs["DISABLED"])))
-        raise nagios_plugin3.WarnError(output)
+        raise nagios_plugin3.WarnError(report("cinder_services", output, resources=resources))
 
-    print("OK: All cinder services happy")
+    print(report("cinder_services", "OK: All cinder services happy", resources=resources))
 
 
 if __name__ == "__main__":
+    delegate_to_daemon()
     parser = argparse.ArgumentParser(description="Check Cinder status")
     parser.add_argument(
         "--env",
@@ -82,11 +89,8 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     # grab environment vars
-    command = ["/bin/bash", "-c", "source {} && env".format(args.env)]
-    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-    for line in proc.stdout:
-        (key, _, value) = line.partition(b"=")
-        os.environ[key.decode("utf-8")] = value.rstrip().decode("utf-8")
-    proc.communicate()
-    cinder = os_client_config.session_client("volume", cloud="envvars")
+    set_openstack_credentials(args.env)
+    cinder = attach_api_stats(
+        attach_token_cache(os_client_config.session_client("volume", cloud="envvars"))
+    )
     nagios_plugin3.try_check(check_cinder_services, args, cinder)
@@ -5,14 +5,21 @@ import argparse
 import collections
 import datetime
 import ipaddress
-import os
 import re
-import subprocess
+import time
 
 import nagios_plugin3
-import os_client_config
-import requests
-
+from osc_api_stats import STATS, attach_api_stats
+from osc_checkd_client import delegate_to_daemon
+from osc_lazy import lazy_import
+from osc_metrics import report
+from osc_novarc import set_openstack_credentials
+from osc_output import BudgetedOutput
+from osc_rate_limit import LIMITER
+from osc_token_cache import attach_token_cache
+
+os_client_config = lazy_import("os_client_config")
+requests = lazy_import("requests")
 DEFAULT_IGNORED = r""
 Alarm = collections.namedtuple("Alarm", "ts, desc")
 
@@ -74,7 +81,12 @@ def parse_contrail_alarms(data, ignored=DEFAULT_IGNORED):
         "total_alarms[{}], unacked_or_sev_gt_0[{}], total_ignored[{}], "
         "ignoring r'{}'\n".format(len(full), total_crit_count, len(ignoring), ignored)
     )
-    msg += "\n".join(_.desc for _ in sorted(important))
+    output = BudgetedOutput()
+    for alarm in important:
+        severity = 2 if alarm.desc.startswith("CRITICAL") else 1
+        output.add(severity, alarm.desc, order=alarm)
+    output.reserve(len(msg.encode("utf-8")))
+    msg += "\n".join(output.lines(reverse=False, by_severity=False))
     return msg
 
 
@@ -89,12 +101,20 @@ def check_contrail_alarms(contrail_vip, token, **kwargs):
     """
     url = "http://{}:8081/analytics/alarms".format(contrail_vip)
     headers = {"X-Auth-Token": token}
-    try:
-        r = requests.get(url=url, headers=headers)
-    except requests.exceptions.ConnectionError as error:
-        raise nagios_plugin3.CriticalError(
-            "CRITICAL: contrail analytics API error: {}".format(error)
-        )
+    # contrail analytics is not called through the keystoneauth session
+    with LIMITER.limit("contrail") as waited:
+        if waited is not None:
+            STATS.record_wait("contrail", waited)
+
+        start = time.monotonic()
+        try:
+            r = requests.get(url=url, headers=headers)
+        except requests.exceptions.ConnectionError as error:
+            raise nagios_plugin3.CriticalError(
+                "CRITICAL: contrail analytics API error: {}".format(error)
+            )
+
+    STATS.record("contrail", time.monotonic() - start, len(r.content))
 
     if r.status_code != 200:
         raise nagios_plugin3.CriticalError(
@@ -104,6 +124,7 @@ def check_contrail_alarms(contrail_vip, token, **kwargs):
     result = r.json()
     msg = parse_contrail_alarms(result, **kwargs)
 
+    msg = report("contrail_analytics_alarms", msg)
     if msg.startswith("CRITICAL: "):
         raise nagios_plugin3.CriticalError(msg)
     elif msg.startswith("WARNING: "):
@@ -113,12 +134,7 @@ def check_contrail_alarms(contrail_vip, token, **kwargs):
 
 def load_os_envvars(args):
     """Process environment variables."""
-    command = ["/bin/bash", "-c", "source {} && env".format(args.env)]
-    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-    for line in proc.stdout:
-        (key, _, value) = line.partition(b"=")
-        os.environ[key.decode("utf-8")] = value.rstrip().decode("utf-8")
-    proc.communicate()
+    set_openstack_credentials(args.env)
 
 
 def validate_ipv4(ipv4_addr):
@@ -133,6 +149,7 @@ def validate_ipv4(ipv4_addr):
 
 def main():
     """Define main routine, process CLI args, and run checks."""
+    delegate_to_daemon()
     parser = argparse.ArgumentParser(description="Check Contrail alarms")
     parser.add_argument(
         "--env",
@@ -162,7 +179,9 @@ def main():
 
     # Retrieve token from Keystone
     load_os_envvars(args)
-    keystone_client = os_client_config.session_client("identity", cloud="envvars")
+    keystone_client = attach_api_stats(
+        attach_token_cache(os_client_config.session_client("identity", cloud="envvars"))
+    )
     token = keystone_client.get_token()
 
     nagios_plugin3.try_check(
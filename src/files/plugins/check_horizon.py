@@ -3,11 +3,13 @@
 
 import argparse
 import os
-import subprocess
 
 import nagios_plugin3
-import requests
-from requests.exceptions import ConnectionError, HTTPError, RequestException, Timeout
+from osc_checkd_client import delegate_to_daemon
+from osc_lazy import lazy_import
+from osc_novarc import set_openstack_credentials
+
+requests = lazy_import("requests")
 
 
 def check_horizon_connection(horizon_ip):
@@ -23,14 +25,14 @@ def check_horizon_connection(horizon_ip):
 
     try:
         requests.get(horizon_url, timeout=30)
-    except Timeout:
+    except requests.exceptions.Timeout:
         raise nagios_plugin3.WarnError("Request to horizon timed out")
-    except ConnectionError:
+    except requests.exceptions.ConnectionError:
         raise nagios_plugin3.CriticalError("Connection to horizon failed")
-    except HTTPError:
+    except requests.exceptions.HTTPError:
         raise nagios_plugin3.CriticalError("Bad HTTP response from horizon")
     # If not caught above, handle with generic request exception
-    except RequestException:
+    except requests.exceptions.RequestException:
         raise nagios_plugin3.CriticalError("Failed to connect to horizon")
 
 
@@ -69,7 +71,7 @@ def horizon_login(dashboard_url, domain, username, password):
 
     try:
         response = client.post(login_url, data=login_data, headers={"Referer": login_url})
-    except HTTPError:
+    except requests.exceptions.HTTPError:
         raise nagios_plugin3.CriticalError("Horizon login failed: bad HTTP response")
 
     expected = "Sign Out"
@@ -80,6 +82,7 @@ def horizon_login(dashboard_url, domain, username, password):
 
 
 def main():
+    delegate_to_daemon()
     parser = argparse.ArgumentParser(description="Check horizon connectivity")
     parser.add_argument(
         "--env",
@@ -90,12 +93,7 @@ def main():
     parser.add_argument("--ip", dest="ip", help="IP of openstack dashboard")
     args = parser.parse_args()
     # grab environment vars
-    command = ["/bin/bash", "-c", "source {} && env".format(args.env)]
-    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-    for line in proc.stdout:
-        key, _, value = line.partition(b"=")
-        os.environ[key.decode("utf-8")] = value.rstrip().decode("utf-8")
-    proc.communicate()
+    set_openstack_credentials(args.env)
 
     # Check connection to horizon
     check_horizon_connection(args.ip)
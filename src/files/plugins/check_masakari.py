@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 """Define nagios checks for masakari services, bug #1898108 ."""
 import argparse
-import os
-import subprocess
 import sys
 
-import openstack
-from keystoneauth1.exceptions.catalog import EndpointNotFound
+from osc_api_stats import attach_api_stats
+from osc_checkd_client import delegate_to_daemon
+from osc_lazy import lazy_import
+from osc_metrics import report
+from osc_novarc import set_openstack_credentials
+from osc_token_cache import attach_token_cache
 
+openstack = lazy_import("openstack")
 NAGIOS_STATUS_OK = 0
 NAGIOS_STATUS_WARNING = 1
 NAGIOS_STATUS_CRITICAL = 2
@@ -22,7 +25,7 @@ NAGIOS_STATUS = {
 
 
 def process_checks():
-    connection = openstack.connect(cloud="envvars")
+    connection = attach_api_stats(attach_token_cache(openstack.connect(cloud="envvars")))
     ha_mgr = connection.instance_ha
     segments = ha_mgr.segments()
     hosts_maintenance = []
@@ -44,6 +47,7 @@ def process_checks():
 
 def main():
     """Define main routine, parse CLI args, and run checks."""
+    delegate_to_daemon()
     parser = argparse.ArgumentParser(
         description="Check masakari segment host maintenance status",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -57,18 +61,15 @@ def main():
 
     args = parser.parse_args()
     # source environment vars
-    command = ["/bin/bash", "-c", "source {} && env".format(args.env)]
-    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-    for line in proc.stdout:
-        (key, _, value) = line.partition(b"=")
-        os.environ[key.decode("utf-8")] = value.rstrip().decode("utf-8")
-    proc.communicate()
+    set_openstack_credentials(args.env)
+    from keystoneauth1.exceptions.catalog import EndpointNotFound
+
     try:
         status, message = process_checks()
     except EndpointNotFound:
         message = "Masakari is not enabled in the cloud"
         status = NAGIOS_STATUS_WARNING
-    print(message)
+    print(report("masakari", message, status))
     sys.exit(status)
 
 
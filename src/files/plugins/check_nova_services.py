@@ -2,11 +2,17 @@
 """Define nagios check to determine if openstack compute services are impacted."""
 
 import argparse
-import os
-import subprocess
+import collections
 
 import nagios_plugin3
-import os_client_config
+from osc_api_stats import attach_api_stats
+from osc_checkd_client import delegate_to_daemon
+from osc_lazy import lazy_import
+from osc_metrics import report
+from osc_novarc import set_openstack_credentials
+from osc_token_cache import attach_token_cache
+
+os_client_config = lazy_import("os_client_config")
 
 
 def check_hosts_up(args, aggregate, hosts, services_compute):
@@ -82,16 +88,21 @@ def check_nova_services(args, nova):
     status_crit = len([agg["critical"] for agg in status if agg["critical"]])
     status_warn = len([agg["warning"] for agg in status if agg["warning"]])
     msg.extend([x["msg_text"] for x in status if x["msg_text"] != ""])
+    states = collections.Counter(
+        svc["state"] if svc["status"] == "enabled" else "disabled" for svc in services_compute
+    )
+    resources = {state: states[state] for state in ("up", "down", "disabled")}
     if status_crit:
         output = "CRITICAL: {}".format(", ".join(msg))
-        raise nagios_plugin3.CriticalError(output)
+        raise nagios_plugin3.CriticalError(report("nova_services", output, resources=resources))
     if status_warn:
         output = "WARNING: {}".format(", ".join(msg))
-        raise nagios_plugin3.WarnError(output)
-    print("OK: Nova-compute services happy")
+        raise nagios_plugin3.WarnError(report("nova_services", output, resources=resources))
+    print(report("nova_services", "OK: Nova-compute services happy", resources=resources))
 
 
 if __name__ == "__main__":
+    delegate_to_daemon()
     parser = argparse.ArgumentParser(description="Check Nova-compute status")
     parser.add_argument(
         "--warn",
@@ -133,11 +144,8 @@ if __name__ == "__main__":
         args.skip_aggregates = ""
 
     # grab environment vars
-    command = ["/bin/bash", "-c", "source {} && env".format(args.env)]
-    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-    for line in proc.stdout:
-        (key, _, value) = line.partition(b"=")
-        os.environ[key.decode("utf-8")] = value.rstrip().decode("utf-8")
-    proc.communicate()
-    nova = os_client_config.session_client("compute", cloud="envvars")
+    set_openstack_credentials(args.env)
+    nova = attach_api_stats(
+        attach_token_cache(os_client_config.session_client("compute", cloud="envvars"))
+    )
     nagios_plugin3.try_check(check_nova_services, args, nova)
@@ -3,16 +3,24 @@
 
 import argparse
 import collections
-import os
 import re
-import subprocess
 import sys
 from datetime import datetime, timedelta
 
-import openstack
+from osc_api_stats import attach_api_stats
+from osc_checkd_client import delegate_to_daemon
+from osc_lazy import lazy_import
+from osc_metrics import report
+from osc_novarc import set_openstack_credentials
+from osc_output import BudgetedOutput
+from osc_snapshot import MAX_AGE, SnapshotError, load_snapshot
+from osc_token_cache import attach_token_cache
 
+openstack = lazy_import("openstack")
 Alarm = collections.namedtuple("Alarm", "lvl, desc")
 DEFAULT_IGNORED = r""
+# checks which can be evaluated against inventory snapshot
+SNAPSHOT_CHECKS = ["loadbalancers", "pools"]
 NAGIOS_STATUS_OK = 0
 NAGIOS_STATUS_WARNING = 1
 NAGIOS_STATUS_CRITICAL = 2
@@ -50,7 +58,11 @@ def filter_checks(alarms, ignored=DEFAULT_IGNORED):
     msg = "total_alarms[{}], total_crit[{}], total_ignored[{}], " "ignoring r'{}'\n".format(
         len(full), total_crit, len(ignoring), ignored
     )
-    msg += "\n".join(_.desc for _ in sorted(important))
+    output = BudgetedOutput()
+    for alarm in important:
+        output.add(alarm.lvl, alarm.desc)
+    output.reserve(len("{}: {}".format(NAGIOS_STATUS[status], msg).encode("utf-8")))
+    msg += "\n".join(output.lines(reverse=False))
     return status, msg
 
 
@@ -216,11 +228,12 @@ def check_image(connection, tag, days):
     return []
 
 
-def process_checks(args):
+def process_checks(args, connection=None):
     """Process all octavia checks in a standardized manner.
 
     Use closure to make all checks have same signature
-    so we can handle them in same way
+    so we can handle them in same way. The checks query the API unless
+    a connection (e.g. inventory snapshot) is passed.
     """
 
     def _check_image(_connection):
@@ -232,12 +245,21 @@ def process_checks(args):
         "image": _check_image,
     }
 
-    connection = openstack.connect(cloud="envvars")
-    return nagios_exit(args, checks[args.check](connection))
+    if connection is None:
+        connection = attach_api_stats(attach_token_cache(openstack.connect(cloud="envvars")))
+    alarms = checks[args.check](connection)
+    status, message = nagios_exit(args, alarms)
+    levels = collections.Counter(lvl for lvl, _ in alarms)
+    resources = {
+        "critical": levels[NAGIOS_STATUS_CRITICAL],
+        "warning": levels[NAGIOS_STATUS_WARNING],
+    }
+    return status, report("octavia_{}".format(args.check), message, status, resources)
 
 
 def main():
     """Define main routine, parse CLI args, and run checks."""
+    delegate_to_daemon()
     parser = argparse.ArgumentParser(
         description="Check Octavia status",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -283,16 +305,36 @@ def main():
         help="raise warning if amphora image is older than these days",
     )
 
+    parser.add_argument(
+        "--snapshot",
+        dest="snapshot",
+        help="evaluate inventory snapshot instead of listing resources from the API, "
+        "used by {} checks".format(", ".join(SNAPSHOT_CHECKS)),
+    )
+
+    parser.add_argument(
+        "--snapshot-max-age",
+        dest="snapshot_max_age",
+        type=int,
+        default=MAX_AGE,
+        help="UNKNOWN if the snapshot is older than this number of seconds",
+    )
+
     args = parser.parse_args()
     # source environment vars
-    command = ["/bin/bash", "-c", "source {} && env".format(args.env)]
-    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-    for line in proc.stdout:
-        (key, _, value) = line.partition(b"=")
-        os.environ[key.decode("utf-8")] = value.rstrip().decode("utf-8")
-    proc.communicate()
-
-    status, message = process_checks(args)
+    set_openstack_credentials(args.env)
+
+    try:
+        connection = None
+        if args.snapshot and args.check in SNAPSHOT_CHECKS:
+            connection = load_snapshot(args.snapshot, args.snapshot_max_age)
+        status, message = process_checks(args, connection)
+    except SnapshotError as error:
+        status = NAGIOS_STATUS_UNKNOWN
+        message = report(
+            "octavia_{}".format(args.check), "{}: {}".format(NAGIOS_STATUS[status], error)
+        )
+
     print(message)
     sys.exit(status)
 
@@ -32,14 +32,30 @@ import argparse
 import logging
 import os
 import smtplib
-import subprocess
 import sys
 import time
 from email.message import EmailMessage
 
-import openstack
-
-openstack.enable_logging(debug=False)  # too noisy, not readable at all.
+from osc_api_stats import attach_api_stats
+from osc_checkd_client import delegate_to_daemon
+from osc_lazy import lazy_import
+from osc_metrics import report
+from osc_novarc import set_openstack_credentials
+from osc_snapshot import MAX_AGE, SnapshotError, load_snapshot
+from osc_token_cache import attach_token_cache
+
+openstack = lazy_import("openstack")
+
+# port fields read by `is_bad_port` and `disable_port_security`
+PORT_FIELDS = [
+    "id",
+    "name",
+    "port_security_enabled",
+    "binding:vnic_type",
+    "binding:profile",
+    "security_groups",
+    "allowed_address_pairs",
+]
 
 NAGIOS_STATUS_OK = 0
 NAGIOS_STATUS_WARNING = 1
@@ -57,18 +73,15 @@ NAGIOS_STATUS = {
 APP = os.path.splitext(os.path.basename(__file__))[0]
 LOG = logging.getLogger(name=APP)
 OUTPUT_DEFAULT = "/run/nagios/{}.out".format(APP)
+# output of auto remediation which could not be run, e.g. due to stale snapshot
+UNKNOWN_PREFIX = "UNKNOWN: "
 
 
 def get_openstack_connection(novarc):
-    """Get openstack connection by sourcing novarc file."""
-    command = ["/bin/bash", "-c", "source {} && env".format(novarc)]
-    LOG.debug("loading envvars from %s", novarc)
-    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-    for line in proc.stdout:
-        (key, _, value) = line.partition(b"=")
-        os.environ[key.decode("utf-8")] = value.rstrip().decode("utf-8")
-    proc.communicate()
-    return openstack.connect(cloud="envvars")
+    """Get openstack connection with credentials from novarc file."""
+    set_openstack_credentials(novarc)
+    openstack.enable_logging(debug=False)  # too noisy, not readable at all.
+    return attach_api_stats(attach_token_cache(openstack.connect(cloud="envvars")))
 
 
 def send_email(subject, content, from_addr, recipients):
@@ -100,16 +113,19 @@ def get_bad_ports(conn):
         direct | direct-physical | macvtap | normal | baremetal | virtio-forwarder
         default: normal
     """
-    bad_ports = []
-    for port in conn.network.ports():
-        # when get, use `is_port_security_enabled`
-        # when set, use `port_security_enabled`
-        # none of these attrs can be used as filter, have to check by code
-        if port.is_port_security_enabled:
-            if port.binding_vnic_type == "direct":
-                if "switchdev" in port.binding_profile.get("capabilities", []):
-                    bad_ports.append(port)
-    return bad_ports
+    return [port for port in conn.network.ports(fields=PORT_FIELDS) if is_bad_port(port)]
+
+
+def is_bad_port(port):
+    """Check if port has both port security and hardware offload enabled."""
+    # when get, use `is_port_security_enabled`
+    # when set, use `port_security_enabled`
+    # none of these attrs can be used as filter, have to check by code
+    if port.is_port_security_enabled:
+        if port.binding_vnic_type == "direct":
+            if "switchdev" in port.binding_profile.get("capabilities", []):
+                return True
+    return False
 
 
 def disable_port_security(conn, port, dry_run=False):
@@ -143,10 +159,20 @@ def disable_port_security(conn, port, dry_run=False):
         conn.network.update_port(port.id, **attrs)
 
 
-def auto_remediation(conn, dry_run=False):
-    """Run auto remediation and return result lines for each port."""
+def auto_remediation(conn, dry_run=False, snapshot=None):
+    """Run auto remediation and return result lines for each port.
+
+    Bad ports found in the inventory snapshot are fetched from the API again,
+    since they could have been fixed or deleted after the snapshot was taken.
+    """
+    if snapshot is None:
+        bad_ports = get_bad_ports(conn)
+    else:
+        ports = [conn.network.find_port(port.id) for port in get_bad_ports(snapshot)]
+        bad_ports = [port for port in ports if port is not None and is_bad_port(port)]
+
     lines = []
-    for port in get_bad_ports(conn):
+    for port in bad_ports:
         try:
             disable_port_security(conn, port, dry_run=dry_run)
             line = "{} FIXED".format(port.id)
@@ -202,19 +228,29 @@ def nagios_check(output, max_age):
         return (status, message)
 
     with open(output) as output_file:
-        output_text = output_file.read()
-        if "ERROR" in output_text:
-            status = NAGIOS_STATUS_CRITICAL
-            message = "auto remediation output file contains ERROR: {}".format(output)
-            return (status, message)
-
-    status = NAGIOS_STATUS_OK
-    # when ok, no need to print file path
-    message = "auto remediation output file is healthy"
+        # API call statistics of the auto remediation run follow the "|"
+        output_text, _, perfdata = output_file.read().partition(" | ")
+
+    if "ERROR" in output_text:
+        status = NAGIOS_STATUS_CRITICAL
+        message = "auto remediation output file contains ERROR: {}".format(output)
+    elif output_text.startswith(UNKNOWN_PREFIX):
+        status = NAGIOS_STATUS_UNKNOWN
+        reason = output_text.replace(UNKNOWN_PREFIX, "", 1)
+        message = "auto remediation not run: {}".format(reason)
+    else:
+        status = NAGIOS_STATUS_OK
+        # when ok, no need to print file path
+        message = "auto remediation output file is healthy"
+
+    if perfdata:
+        message = "{} | {}".format(message, perfdata.strip())
+
     return (status, message)
 
 
 def main():
+    delegate_to_daemon()
     parser = argparse.ArgumentParser(
         description="Check Port Security",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -275,6 +311,20 @@ def main():
         help="trigger auto remediation on bad ports",
     )
 
+    parser.add_argument(
+        "--snapshot",
+        dest="snapshot",
+        help="find bad ports in inventory snapshot instead of listing them from the API",
+    )
+
+    parser.add_argument(
+        "--snapshot-max-age",
+        dest="snapshot_max_age",
+        type=int,
+        default=MAX_AGE,
+        help="do not run auto remediation if the snapshot is older than this number of seconds",
+    )
+
     parser.add_argument(
         "--email-from-addr",
         dest="email_from_addr",
@@ -306,14 +356,27 @@ def main():
 
     if args.auto_remediation:
         conn = get_openstack_connection(args.env)
+        snapshot = None
+        try:
+            if args.snapshot:
+                snapshot = load_snapshot(args.snapshot, args.snapshot_max_age)
+        except SnapshotError as exc:
+            LOG.error("auto remediation not run: %s", exc)
+            content = "{}{}".format(UNKNOWN_PREFIX, exc)
+            write_output(args.output, report("port_security", content, NAGIOS_STATUS_UNKNOWN))
+            return
+
         # return list of str lines for each port
-        lines = auto_remediation(conn, dry_run=args.dry_run)
+        lines = auto_remediation(conn, dry_run=args.dry_run, snapshot=snapshot)
         if lines:
             content = "\n".join(lines)
         else:
             content = "all ports are healthy"
+        errors = len([line for line in lines if "ERROR" in line])
+        status = NAGIOS_STATUS_CRITICAL if errors else NAGIOS_STATUS_OK
+        resources = {"bad": len(lines), "error": errors}
         # always update output file even no action
-        write_output(args.output, content)
+        write_output(args.output, report("port_security", content, status, resources))
 
         # only send email when auto remediation triggered
         if lines:
@@ -331,7 +394,10 @@ def main():
                 # append, do not clear prev content
                 write_output(args.output, content, append=True)
     elif args.list_bad_ports:
-        conn = get_openstack_connection(args.env)
+        if args.snapshot:
+            conn = load_snapshot(args.snapshot, args.snapshot_max_age)
+        else:
+            conn = get_openstack_connection(args.env)
         for port in get_bad_ports(conn):
             print("{} {}".format(port.id, port.name))
     elif args.send_test_email:
@@ -6,14 +6,26 @@
 #   Robert Gildein <robert.gildein@canonical.com>
 """Define nagios checks for OpenStack resources."""
 import argparse
+import collections
+import functools
 import logging
 import os
-import subprocess
-from typing import Dict, List
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
-import openstack
 from nagios_plugin3 import CriticalError, UnknownError, WarnError, try_check
-
+from osc_api_stats import attach_api_stats, with_perfdata
+from osc_checkd_client import delegate_to_daemon
+from osc_lazy import lazy_import
+from osc_metrics import report
+from osc_novarc import set_openstack_credentials
+from osc_output import OUTPUT_BUDGET, BudgetedOutput
+from osc_snapshot import MAX_AGE, SnapshotError, load_snapshot
+from osc_state import ResourceStates, StateError, format_duration
+from osc_token_cache import attach_token_cache
+
+openstack = lazy_import("openstack")
 APP = os.path.splitext(os.path.basename(__file__))[0]
 logger = logging.getLogger(name=APP)
 
@@ -22,6 +34,19 @@ SKIP_MESSAGE = "{} skipped"
 WARNING_MESSAGE = "{}/{} in UNKNOWN"
 DOWN_MESSAGE = "{}/{} are DOWN"
 NOT_FOUND_MESSAGE = "{}/{} were not found"
+STOPPED_MESSAGE = ">={} are DOWN (scan stopped early after {} resources)"
+# messages of resources formatted with resource type, ID and status
+STATUS_TEMPLATE = "{} '{}' is in {} status"
+SKIP_TEMPLATE = "{} '{}' skip"
+NOT_FOUND_TEMPLATE = "{} '{}' was not found"
+EXISTS_TEMPLATE = "{} '{}' exists"
+# resources which entered the state since the previous run, see `--state-file`
+TRANSITION_MESSAGES = {
+    "critical": "{} went DOWN",
+    "not_found": "{} disappeared",
+    "warning": "{} went UNKNOWN",
+    "ok": "{} recovered",
+}
 NAGIOS_STATUS_OK = 0
 NAGIOS_STATUS_WARNING = 1
 NAGIOS_STATUS_CRITICAL = 2
@@ -32,86 +57,185 @@ NAGIOS_STATUS = {
     NAGIOS_STATUS_CRITICAL: "CRITICAL",
     NAGIOS_STATUS_UNKNOWN: "UNKNOWN",
 }
-# NOTE (rgildein): If there is any change in this list or the list below, it is
-# necessary to modify lists in lib_openstack_service_checks.OSCHelper.render_checks
+# NOTE (rgildein): If there is any change in this list, it is necessary to modify
+# lists in lib_openstack_service_checks.OSCHelper.render_checks
 RESOURCES = {
-    "network": lambda conn: conn.network.networks(),
-    "floating-ip": lambda conn: conn.network.ips(),
-    "server": lambda conn: conn.compute.servers(),
-    "port": lambda conn: conn.network.ports(),
-    "security-group": lambda conn: conn.network.security_groups(),
-    "subnet": lambda conn: conn.network.subnets(),
+    "network": lambda conn, **query: conn.network.networks(**query),
+    "floating-ip": lambda conn, **query: conn.network.ips(**query),
+    "server": lambda conn, **query: conn.compute.servers(**query),
+    "port": lambda conn, **query: conn.network.ports(**query),
+    "security-group": lambda conn, **query: conn.network.security_groups(**query),
+    "subnet": lambda conn, **query: conn.network.subnets(**query),
 }
-
-FLOATING_IP_RESOURCES = {
-    "unassigned": lambda conn: conn.network.ips(fixed_ip_address=None, status="DOWN")
+# Neutron returns only these fields of listed resources, other attributes are None
+NEUTRON_FIELDS = {
+    "network": ["id"],
+    "floating-ip": ["id", "status", "fixed_ip_address", "project_id"],
+    "port": ["id", "status", "device_id", "device_owner", "binding:vif_type", "network_id"],
+    "security-group": ["id"],
+    "subnet": ["id"],
 }
-
-PORT_RESOURCES = {
-    "network:dhcp": lambda conn: conn.network.ports(device_owner="network:dhcp"),
-    "network:distributed": lambda conn: conn.network.ports(device_owner="network:distributed"),
+# `--select` keys sent to the API as exact match list filters, other keys are
+# compared with the attributes of the listed resources by the check
+API_SELECT_FILTERS = {
+    "port": {
+        "binding:host_id",
+        "device_id",
+        "device_owner",
+        "mac_address",
+        "network_id",
+        "project_id",
+        "status",
+        "subnet_id",
+    },
+    "floating-ip": {
+        "fixed_ip_address",
+        "floating_ip_address",
+        "floating_network_id",
+        "port_id",
+        "project_id",
+        "router_id",
+        "status",
+        "subnet_id",
+    },
+    "server": {"compute_host", "project_id", "status"},
 }
+# number of IDs in one filtered Neutron listing, keeps the URL length reasonable
+ID_FILTER_CHUNK = 100
+# number of concurrent requests getting servers by ID
+GET_WORKERS = 8
+# Local ports created as Metadata Proxy Management
+# https://docs.openstack.org/networking-ovn/latest/contributor/design/metadata_api.html#metadata-proxy-management-logic
+LOCALPORT_DEVICE_OWNERS = {"network:dhcp", "network:distributed"}
 RESOURCES_BY_EXISTENCE = ["security-group", "subnet", "network"]
+# group and attribute by which the lines omitted from the output are summarized
+OUTPUT_GROUPS = {
+    "port": ("network", "network_id"),
+    "floating-ip": ("project", "project_id"),
+    "server": ("host", "compute_host"),
+}
+
+
+def _with_suffix(format_msg, suffix):
+    """Get function formatting message followed by suffix."""
+    return lambda: format_msg() + suffix
 
 
 class Results:
-    """Object to gather all results."""
+    """Object to gather all results.
+
+    Only the number of resources in each state and the messages fitting the output
+    budget are kept, so the memory does not grow with the number of resources.
+    """
 
-    def __init__(self):
-        """Set initial values."""
+    def __init__(self, group_name="group", detail_file=None, states=None, budget=OUTPUT_BUDGET):
+        """Set initial values.
+
+        :param group_name: name of the groups summarizing the omitted messages
+        :type group_name: str
+        :param detail_file: path to file with all messages
+        :type detail_file: Optional[str]
+        :param states: states of resources in the previous run
+        :type states: Optional[osc_state.ResourceStates]
+        :param budget: maximum number of bytes of the messages
+        :type budget: int
+        """
         self.exit_code = 0
-        self.ok = []
-        self.warning = []
-        self.critical = []
-        self.not_found = []
-        self.skipped = []
-        self._messages = []
+        self.count = 0
+        # evaluation stopped after `--max-critical` DOWN resources, counts are partial
+        self.stopped = False
+        # number of resources in state ok, warning, critical, not_found and skipped
+        self.counts = collections.Counter()
+        self.listings = 0
+        self.transitions = collections.Counter()
+        self._states = states
+        self._output = BudgetedOutput(budget, group_name, detail_file)
 
     @property
     def messages(self):
-        return [message for _, message in sorted(self._messages, reverse=True)]
-
-    @property
-    def count(self):
-        return len(self._messages)
-
-    def _add_result(self, id_, group, exit_code, msg):
-        group.append(id_)
+        """Get the most severe messages fitting the output budget."""
+        return self._output.lines(by_line=True)
+
+    def _record_state(self, id_, state, exit_code):
+        """Record state of resource and return suffix of its message, None if it is not reported.
+
+        Problems are reported together with their duration, resources which stay OK
+        are not reported.
+        """
+        previous, since = self._states.update(id_, state)
+        if previous is not None and previous != state and state in TRANSITION_MESSAGES:
+            self.transitions[state] += 1
+
+        if self._states.initial:
+            return ""
+        if exit_code == NAGIOS_STATUS_OK:
+            return "" if previous not in (None, state) else None
+        if previous != state:
+            return " (new)"
+
+        return " for {}".format(format_duration(self._states.now - since))
+
+    def _add_result(self, id_, state, exit_code, msg, output_group=None):
+        """Count result and add its message, formatted only if it is in the output.
+
+        :param msg: function formatting the message
+        :type msg: Callable[[], str]
+        """
+        self.counts[state] += 1
+        self.count += 1
         self.exit_code = max(exit_code, self.exit_code)
-        self._messages.append((exit_code, msg))
-        logger.debug("result was added with (%s, %s)", exit_code, msg)
-
-    def add_result(self, type_, id_, status=None, exists=True, skip=False, warn=False):
+        if self._states is not None:
+            suffix = self._record_state(id_, state, exit_code)
+            if suffix is None:
+                # resources which stay OK are omitted only from the check output
+                self._output.add_detail(msg)
+                return
+            if suffix:
+                msg = _with_suffix(msg, suffix)
+
+        # the first listed messages of each state are retained, the following ones
+        # are omitted without being formatted
+        self._output.add(exit_code, msg, output_group, order=-self.count)
+        logger.debug("result was added with (%s, %s, %s)", exit_code, state, id_)
+
+    def add_result(
+        self, type_, id_, status=None, exists=True, skip=False, warn=False, output_group=None
+    ):
         # Force result
         if skip:
-            msg = "{} '{}' skip".format(type_, id_)
-            self._add_result(id_, self.skipped, NAGIOS_STATUS_OK, msg)
+            state, exit_code, template = "skipped", NAGIOS_STATUS_OK, SKIP_TEMPLATE
         elif warn:
-            msg = "{} '{}' is in {} status".format(type_, id_, status)
-            self._add_result(id_, self.warning, NAGIOS_STATUS_WARNING, msg)
+            state, exit_code, template = "warning", NAGIOS_STATUS_WARNING, STATUS_TEMPLATE
         # Request resource id not exists
         elif not exists:
-            msg = "{} '{}' was not found".format(type_, id_)
-            self._add_result(id_, self.not_found, NAGIOS_STATUS_CRITICAL, msg)
+            state, exit_code, template = "not_found", NAGIOS_STATUS_CRITICAL, NOT_FOUND_TEMPLATE
 
         # Base on status
 
         # Active
         elif status == "ACTIVE":
-            msg = "{} '{}' is in {} status".format(type_, id_, status)
-            self._add_result(id_, self.ok, NAGIOS_STATUS_OK, msg)
+            state, exit_code, template = "ok", NAGIOS_STATUS_OK, STATUS_TEMPLATE
         # Down
         elif status == "DOWN":
-            msg = "{} '{}' is in {} status".format(type_, id_, status)
-            self._add_result(id_, self.critical, NAGIOS_STATUS_CRITICAL, msg)
+            state, exit_code, template = "critical", NAGIOS_STATUS_CRITICAL, STATUS_TEMPLATE
         # Specific existence resource
         elif not status and exists and type_ in RESOURCES_BY_EXISTENCE:
-            msg = "{} '{}' exists".format(type_, id_)
-            self._add_result(id_, self.ok, NAGIOS_STATUS_OK, msg)
+            state, exit_code, template = "ok", NAGIOS_STATUS_OK, EXISTS_TEMPLATE
         # UNKNOWN status
         else:
-            msg = "{} '{}' is in {} status".format(type_, id_, status)
-            self._add_result(id_, self.warning, NAGIOS_STATUS_WARNING, msg)
+            state, exit_code, template = "warning", NAGIOS_STATUS_WARNING, STATUS_TEMPLATE
+
+        # extra arguments of str.format are ignored, e.g. status of "exists" message
+        msg = functools.partial(template.format, type_, id_, status)
+        self._add_result(id_, state, exit_code, msg, output_group)
+
+    def reserve(self, size):
+        """Reserve bytes of the output budget for the title and performance data."""
+        self._output.reserve(size)
+
+    def close(self):
+        """Write all messages to the detail file."""
+        self._output.close()
 
 
 def _resource_filter(resources, ids, skip, check_all, select):
@@ -123,7 +247,7 @@ def _resource_filter(resources, ids, skip, check_all, select):
     :type ids: Set[str]
     :param skip: OpenStack resource IDs that will be skipped
     :type skip: Optional[Set[str]]
-    :param select: values for OpenStack resources filtering
+    :param select: values for OpenStack resources filtering, all must match
     :type select: Dict[str, str]
     :param check_all: flag to checking all OpenStack resources
     :type check_all: bool
@@ -139,25 +263,126 @@ def _resource_filter(resources, ids, skip, check_all, select):
         elif resource.id in skip:
             logger.debug("`%s` resource will be skipped", resource.id)
             continue
-        elif check_all:
-            # applied select option to filter
-            for key, value in (select or {}).items():
-                if getattr(resource, key, None) != value:
-                    logger.debug("`%s` resource will be skipped", resource.id)
-                    continue
+        elif check_all and not all(
+            getattr(resource, key, None) == value for key, value in (select or {}).items()
+        ):
+            logger.debug("`%s` resource is not selected", resource.id)
+            continue
 
         yield resource
 
 
+def _split_select(resource_type, select=None):
+    """Split `--select` values to the API list filters and the filters of the check.
+
+    :returns: filters sent to the API and filters applied by the check
+    :rtype: Tuple[Dict[str, str], Dict[str, str]]
+    """
+    api_filters, check_filters = {}, {}
+    for key, value in (select or {}).items():
+        if key in API_SELECT_FILTERS.get(resource_type, ()):
+            api_filters[key] = value
+        else:
+            check_filters[key] = value
+
+    return api_filters, check_filters
+
+
+def _list_query(resource_type, select=None):
+    """Get query parameters of the listing.
+
+    The `--select` values supported by the API are sent as list filters and the
+    listed fields are limited to those read by the check. Resources filtered by the
+    check itself are listed with all fields, since the filter can use any attribute.
+    """
+    query, check_filters = _split_select(resource_type, select)
+    if resource_type in NEUTRON_FIELDS and not check_filters:
+        query["fields"] = NEUTRON_FIELDS[resource_type]
+
+    return query
+
+
+def _get_server(connection, server_id):
+    try:
+        return connection.compute.get_server(server_id)
+    except openstack.exceptions.ResourceNotFound:
+        logger.debug("server `%s` was not found", server_id)
+        return None
+
+
+def list_by_ids(connection, resource_type, ids, results):
+    """List only the resources with requested IDs.
+
+    Neutron resources are listed with `id` filter, Nova does not support filtering
+    by a list of IDs, so the servers are fetched by concurrent requests.
+
+    :param connection: OpenStack connection or inventory snapshot
+    :param resource_type: OpenStack resource type
+    :type resource_type: str
+    :param ids: OpenStack resource IDs
+    :type ids: Set[str]
+    :param results: results counting the listings
+    :type results: Results
+    :returns: OpenStack objects with requested IDs which exist
+    :rtype: List
+    """
+    ids = sorted(ids)
+    if resource_type not in NEUTRON_FIELDS:
+        with ThreadPoolExecutor(max_workers=GET_WORKERS) as executor:
+            servers = executor.map(lambda id_: _get_server(connection, id_), ids)
+            return [server for server in servers if server is not None]
+
+    resources = []
+    for start in range(0, len(ids), ID_FILTER_CHUNK):
+        end = start + ID_FILTER_CHUNK
+        results.listings += 1
+        resources.extend(
+            RESOURCES[resource_type](connection, id=ids[start:end], **_list_query(resource_type))
+        )
+
+    return resources
+
+
+def _shard_type(value):
+    """Parse `--shard` value in `index/count` format."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must be in `index/count` format, e.g. 0/4")
+
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError("shard index must be from 0 to count - 1")
+
+    return index, count
+
+
+def _positive_int_type(value):
+    """Parse positive integer value."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid int value: '{}'".format(value))
+
+    if number < 1:
+        raise argparse.ArgumentTypeError("value must be a positive integer")
+
+    return number
+
+
 def parse_arguments():
-    """Parse the check arguments and connect to OpenStack.
+    """Parse the check arguments.
 
-    :returns: resource name, set IDs, set IDs to skip,
-              values to filter when using `--all` and check all flag
-    :rtype: Tuple[str, set, set, dict, bool]
+    :returns: arguments, `specs` contains the options of each checked resource
+              (resource, all, id, skip_id, select, shard and max_critical)
+    :rtype: argparse.Namespace
     """
     parser = argparse.ArgumentParser("check_resources")
-    parser.add_argument("resource", type=str, help="resource type")
+    parser.add_argument(
+        "resource",
+        nargs="+",
+        help="resource type, or several `type:option[,option...]` specifications checked "
+        "together over one connection (e.g. port:--all,--skip-id=X network:--id=Y)",
+    )
     parser.add_argument("--all", action="store_true", help="check all")
     parser.add_argument(
         "-i",
@@ -181,13 +406,68 @@ def parse_arguments():
         default=[],
         help="use `--select` together with `--all`" "(e.g. --select subnet=<id>)",
     )
+    parser.add_argument(
+        "--shard",
+        type=_shard_type,
+        help="check only resources of the shard `index/count`, use together with `--all` "
+        "and `--snapshot`",
+    )
+    parser.add_argument(
+        "--max-critical",
+        type=_positive_int_type,
+        help="stop listing and report CRITICAL once this number of resources is DOWN, "
+        "use together with `--all`",
+    )
+    parser.add_argument(
+        "--output-detail",
+        help="write all result messages to this file, the output contains only the most "
+        "severe ones fitting the NRPE output limit",
+    )
+    parser.add_argument(
+        "--state-file",
+        help="report changes of resource states since the previous run recorded in this file",
+    )
     parser.add_argument(
         "--env",
         default="/var/lib/nagios/nagios.novarc",
         help="Novarc file to use for this check",
     )
+    parser.add_argument(
+        "--snapshot",
+        help="evaluate inventory snapshot instead of listing resources from the API",
+    )
+    parser.add_argument(
+        "--snapshot-max-age",
+        type=int,
+        default=MAX_AGE,
+        help="UNKNOWN if the snapshot is older than this number of seconds",
+    )
     args = parser.parse_args()
 
+    if len(args.resource) == 1 and ":" not in args.resource[0]:
+        args.resource = args.resource[0]
+        args.specs = [_validate_arguments(parser, args, args.snapshot)]
+        return args
+
+    if args.all or args.id or args.skip_id or args.select or args.shard or args.max_critical:
+        parser.error("resource options must be part of the resource specifications")
+
+    args.specs = []
+    for spec in args.resource:
+        resource, _, options = spec.partition(":")
+        spec_args = parser.parse_args([resource, *filter(None, options.split(","))])
+        spec_args.resource = resource
+        args.specs.append(_validate_arguments(parser, spec_args, args.snapshot))
+
+    return args
+
+
+def _validate_arguments(parser, args, snapshot):
+    """Validate options of one resource and return them.
+
+    Every shard would list the whole collection from the API, so sharding is
+    supported only when evaluating the inventory snapshot.
+    """
     if args.resource not in RESOURCES:
         parser.error("'{}' resource is not supported".format(args.resource))
 
@@ -201,126 +481,347 @@ def parse_arguments():
         parser.error("'--skip-id' must be used with '--all'")
     elif not args.all and args.select:
         parser.error("'--select' must be used with '--all'")
+    elif not args.all and args.shard:
+        parser.error("'--shard' must be used with '--all'")
+    elif not args.all and args.max_critical:
+        parser.error("'--max-critical' must be used with '--all'")
+    if args.shard and not snapshot:
+        parser.error("'--shard' must be used with '--snapshot'")
 
     return args
 
 
-def _create_title(resource, results):
-    """Get output title."""
+def _state_titles(results):
+    """Get number of resources in each state for the output title."""
     titles = []
+    counts = results.counts
+    if counts["not_found"]:
+        titles.append(NOT_FOUND_MESSAGE.format(counts["not_found"], results.count))
+
+    if counts["critical"]:
+        titles.append(DOWN_MESSAGE.format(counts["critical"], results.count))
+
+    if counts["warning"]:
+        titles.append(WARNING_MESSAGE.format(counts["warning"], results.count))
+
+    if counts["ok"]:
+        titles.append(OK_MESSAGE.format(counts["ok"], results.count - counts["skipped"]))
+        if counts["skipped"] > 0:
+            titles.append(SKIP_MESSAGE.format(counts["skipped"]))
+
+    return titles
 
-    if results.not_found:
-        titles.append(NOT_FOUND_MESSAGE.format(len(results.not_found), results.count))
 
-    if results.critical:
-        titles.append(DOWN_MESSAGE.format(len(results.critical), results.count))
+def _create_title(resource, results, shard=None):
+    """Get output title."""
+    titles = []
 
-    if results.warning:
-        titles.append(WARNING_MESSAGE.format(len(results.warning), results.count))
+    if results.stopped:
+        # the number of resources in other states is not known
+        titles.append(STOPPED_MESSAGE.format(results.counts["critical"], results.count))
+    else:
+        titles.extend(_state_titles(results))
+
+    if results.transitions:
+        transitions = ", ".join(
+            message.format(results.transitions[state])
+            for state, message in TRANSITION_MESSAGES.items()
+            if results.transitions[state]
+        )
+        titles.append("since last run: {}".format(transitions))
 
-    if results.ok:
-        titles.append(OK_MESSAGE.format(len(results.ok), results.count - len(results.skipped)))
-        if len(results.skipped) > 0:
-            titles.append(SKIP_MESSAGE.format(len(results.skipped)))
+    if shard:
+        return "{}s (shard {}/{}) {}".format(resource, *shard, ", ".join(titles))
 
     return "{}s {}".format(resource, ", ".join(titles))
 
 
-def nagios_output(resource, results):
-    """Convert checks results to nagios format."""
-    messages = os.linesep.join(results.messages)
-    title = _create_title(resource, results)
-    output = "{}{}{}".format(title, os.linesep, messages)
+def _resource_counts(results):
+    """Get number of resources in each state."""
+    return {
+        "ok": results.counts["ok"],
+        "warning": results.counts["warning"],
+        "down": results.counts["critical"],
+        "not_found": results.counts["not_found"],
+        "skipped": results.counts["skipped"],
+    }
+
 
+def _nagios_exit(exit_code, output):
     # all checks passed
-    if results.exit_code == NAGIOS_STATUS_OK:
+    if exit_code == NAGIOS_STATUS_OK:
         print("OK: ", output)
     # some checks with WARNING ERROR
-    elif results.exit_code == NAGIOS_STATUS_WARNING:
+    elif exit_code == NAGIOS_STATUS_WARNING:
         raise WarnError("WARNING: {}".format(output))
     # some checks with CRITICAL ERROR
-    elif results.exit_code == NAGIOS_STATUS_CRITICAL:
+    elif exit_code == NAGIOS_STATUS_CRITICAL:
         raise CriticalError("CRITICAL: {}".format(output))
     # some checks with UNKNOWN ERROR
-    elif results.exit_code == NAGIOS_STATUS_UNKNOWN:
+    elif exit_code == NAGIOS_STATUS_UNKNOWN:
         raise UnknownError("UNKNOWN: {}".format(output))
     # raise UnknownError if for not valid exit_code
     else:
-        raise UnknownError(
-            "UNKNOWN: not valid exit_code {} {}" "".format(results.exit_code, output)
-        )
+        raise UnknownError("UNKNOWN: not valid exit_code {} {}" "".format(exit_code, output))
 
 
-def set_openstack_credentials(novarc):
-    """Set openstack credentials by sourcing novarc file and environment variables."""
-    command = ["/bin/bash", "-c", "source {} && env".format(novarc)]
-    logger.debug("loading envvars from %s", novarc)
-    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-    for line in proc.stdout:
-        (key, _, value) = line.partition(b"=")
-        os.environ[key.decode("utf-8")] = value.rstrip().decode("utf-8")
+def _output_size(exit_code, title, perfdata):
+    """Get bytes of the output besides the messages, i.e. status, title and perfdata."""
+    header = "{}:  {}{}".format(NAGIOS_STATUS.get(exit_code, "UNKNOWN"), title, os.linesep)
+    return len(header.encode("utf-8")) + len(with_perfdata("", perfdata=perfdata).encode("utf-8"))
 
-    proc.communicate()
+
+def nagios_output(resource, results, shard=None):
+    """Convert checks results to nagios format."""
+    title = _create_title(resource, results, shard)
+    perfdata = {"listings": results.listings}
+    results.reserve(_output_size(results.exit_code, title, perfdata))
+    messages = os.linesep.join(results.messages)
+    output = report(
+        "resources_{}".format(resource) + ("_{}".format(shard[0]) if shard else ""),
+        "{}{}{}".format(title, os.linesep, messages),
+        results.exit_code,
+        _resource_counts(results),
+        perfdata,
+    )
+    _nagios_exit(results.exit_code, output)
 
 
-def mechanism_skip_ids(connection, resource_type) -> List[str]:
-    """Return list of openstack resource IDs.which will be skipped.
+def nagios_output_many(specs, results):
+    """Convert results of several resources to nagios format with section per resource.
 
-    The IDs are skipped due to OpenStack mechanism.
+    Every section reserves its title, which is also part of the first line, and an
+    equal part of the status and performance data from its output budget.
     """
-    skip_ids = []
+    titles = [
+        _create_title(spec.resource, spec_results, spec.shard)
+        for spec, spec_results in zip(specs, results)
+    ]
+    exit_code = max(spec_results.exit_code for spec_results in results)
+    perfdata = {"listings": sum(spec_results.listings for spec_results in results)}
+    shared = _output_size(exit_code, "", perfdata) // len(specs)
+
+    sections, resources = [], {}
+    for spec, spec_results, title in zip(specs, results, titles):
+        spec_results.reserve(shared + len("{}; {}{}".format(title, title, os.linesep).encode()))
+        sections += [title, *spec_results.messages]
+        for state, count in _resource_counts(spec_results).items():
+            key = "{}_{}".format(spec.resource.replace("-", "_"), state)
+            resources[key] = resources.get(key, 0) + count
+
+    output = report(
+        "resources",
+        "{}{}{}".format("; ".join(titles), os.linesep, os.linesep.join(sections)),
+        exit_code,
+        resources,
+        perfdata,
+    )
+    _nagios_exit(exit_code, output)
+
+
+def mechanism_skip(resource_type, resource) -> bool:
+    """Check if the resource is skipped due to OpenStack mechanism."""
     if resource_type == "port":
-        # Skip local port which is created as Metadata Proxy Management
-        # https://docs.openstack.org/networking-ovn/latest/contributor/design/metadata_api.html#metadata-proxy-management-logic
-        localport_ids = [port.id for port in PORT_RESOURCES["network:dhcp"](connection)] + [
-            port.id for port in PORT_RESOURCES["network:distributed"](connection)
-        ]
-        skip_ids += localport_ids
+        if resource.device_owner in LOCALPORT_DEVICE_OWNERS:
+            return True
         # Skip unbound ports
-        all_ports = RESOURCES[resource_type](connection)
-        for port in all_ports:
-            if port.status == "DOWN" and port.binding_vif_type == "unbound":
-                skip_ids.append(port.id)
-    return skip_ids
+        return resource.status == "DOWN" and resource.binding_vif_type == "unbound"
+
+    return False
+
+
+class ShutoffServers:
+    """Power state of servers in SHUTOFF status, listed on the first lookup."""
+
+    def __init__(self, connection, results):
+        """Initialize of ShutoffServers."""
+        self._connection = connection
+        self._results = results
+        self._power_states = None
+
+    def power_state(self, server_id):
+        if self._power_states is None:
+            # If power_state can't be determined for any reason, the DOWN ports
+            # will be reported as CRITICAL as before.
+            self._results.listings += 1
+            try:
+                servers = self._connection.compute.servers(
+                    details=True, all_projects=True, status="SHUTOFF"
+                )
+                self._power_states = {server.id: server.power_state for server in servers}
+            except Exception as e:
+                logger.error(f"Unexpected error: {e}")
+                self._power_states = {}
+
+        return self._power_states.get(server_id)
 
 
-def mechanism_warning_ids(connection, resource_type) -> Dict[str, str]:
-    """Return openstack resource which should throw out warning.
+def mechanism_warning(resource_type, resource, shutoff_servers) -> Optional[str]:
+    """Return warning message if the resource should not be CRITICAL.
 
-    The function will query resources which should be judged as warning status
-    due to human cognition or openstack mechanism.
-    The key of return dict should be openstack resource id and value should
-    be warning message string.
+    The resources are judged as warning due to human cognition or openstack
+    mechanism.
     """
-    warn_ids = {}
     if resource_type == "floating-ip":
         # Unassigned floating ip should not be CRITICAL
-        not_assigned_ips = [ip.id for ip in FLOATING_IP_RESOURCES["unassigned"](connection)]
-        for ip in not_assigned_ips:
-            warn_ids[ip] = "unassigned"
+        if resource.status == "DOWN" and resource.fixed_ip_address is None:
+            return "unassigned"
 
-    if resource_type == "port":
+    if resource_type == "port" and resource.status == "DOWN":
         # Move DOWN ports from CRITICAL to warning if the instance was shutoff
-        all_ports = RESOURCES[resource_type](connection)
-        for port in all_ports:
-            try:
-                if port.status == "DOWN":
-                    server = connection.compute.get_server(port.device_id)
-                    if server.power_state == 4:  # 4 is SHUTOFF state
-                        warn_ids[port.id] = "SHUTOFF"
-            # If device_id isn't available (e.g. internal ports) or
-            # some other error occurred. Basically, for any reason,
-            # if power_state can't be determined, we ignore
-            # them, and they'll be reported as CRITICAL as before.
-            except openstack.exceptions.ResourceNotFound:
-                logger.info(f"'device_id' not found for port {port.id}")
-            except Exception as e:
-                logger.error(f"Unexpected error: {e}")
+        if shutoff_servers.power_state(resource.device_id) == 4:  # 4 is SHUTOFF state
+            return "SHUTOFF"
+
+    return None
+
+
+def in_shard(id_, shard):
+    """Check if the resource belongs to the shard.
+
+    Resources are partitioned by a stable hash of their ID, so every resource is
+    evaluated by the same shard in every run.
+
+    :param id_: OpenStack resource ID
+    :type id_: str
+    :param shard: shard index and number of shards
+    :type shard: Tuple[int, int]
+    :rtype: bool
+    """
+    index, count = shard
+    return zlib.crc32(id_.encode("utf-8")) % count == index
+
+
+def _shard_filter(resources, shard):
+    for resource in resources:
+        if in_shard(resource.id, shard):
+            yield resource
+
+
+def _mechanism_filter(resource_type, resources, skip):
+    """Add IDs of resources skipped due to OpenStack mechanism to `skip`.
+
+    The resources are classified during the traversal of the listing, so the
+    mechanism does not need to list the collection again.
+    """
+    for resource in resources:
+        if mechanism_skip(resource_type, resource):
+            skip.add(resource.id)
+        else:
+            yield resource
+
 
-    return warn_ids
+def _connect(snapshot, snapshot_max_age):
+    """Connect to OpenStack or load the inventory snapshot."""
+    if snapshot:
+        return load_snapshot(snapshot, snapshot_max_age)
 
+    return attach_api_stats(attach_token_cache(openstack.connect(cloud="envvars")))
 
-def check(resource_type, ids, skip=None, select=None, check_all=False):
+
+def _list(connection, resource_type, ids, select, check_all, results):
+    """List all resources or only the requested ones."""
+    if check_all:
+        results.listings += 1
+        return RESOURCES[resource_type](connection, **_list_query(resource_type, select))
+
+    return list_by_ids(connection, resource_type, ids, results)
+
+
+def _check_spec(connection, spec, results):
+    """List and evaluate resources of one resource specification, see `check_many`."""
+    ids, select = set(spec.id), _parse_select(spec.select)
+    resources = _list(connection, spec.resource, ids, select, spec.all, results)
+    _evaluate(
+        spec.resource,
+        resources,
+        connection,
+        results,
+        ids,
+        set(spec.skip_id),
+        select,
+        spec.all,
+        spec.shard,
+        spec.max_critical,
+    )
+    results.close()
+
+
+def _parse_select(select):
+    """Parse `--select key=value` arguments."""
+    return dict(arg.split("=", 1) for arg in select)
+
+
+def _evaluate(
+    resource_type,
+    resources,
+    connection,
+    results,
+    ids,
+    skip,
+    select,
+    check_all,
+    shard,
+    max_critical=None,
+):
+    """Add results of listed resources and requested IDs, see `check`.
+
+    With `max_critical` the evaluation stops once that number of resources is DOWN,
+    so the remaining pages of the listing are not requested.
+    """
+    group_attr = OUTPUT_GROUPS.get(resource_type, (None, None))[1]
+    skip = skip or set()
+    shutoff_servers = ShutoffServers(connection, results)
+    checked_ids = set()
+
+    if shard:
+        resources = _shard_filter(resources, shard)
+    resources = _mechanism_filter(resource_type, resources, skip)
+    # values sent to the API as list filters are not compared again, their
+    # attributes may not be listed, e.g. subnet_id of ports
+    check_filters = _split_select(resource_type, select)[1]
+    for resource in _resource_filter(resources, ids, skip, check_all, check_filters):
+        if resource.id in ids:
+            checked_ids.add(resource.id)
+        output_group = getattr(resource, group_attr, None) if group_attr else None
+        warning = mechanism_warning(resource_type, resource, shutoff_servers)
+        if warning:
+            results.add_result(
+                resource_type, resource.id, warning, warn=True, output_group=output_group
+            )
+        elif resource_type not in RESOURCES_BY_EXISTENCE:
+            resource_status = getattr(resource, "status", "UNKNOWN")
+            results.add_result(
+                resource_type, resource.id, resource_status, output_group=output_group
+            )
+        else:
+            results.add_result(resource_type, resource.id)
+
+        if max_critical and results.counts["critical"] >= max_critical:
+            logger.debug("evaluation stopped after %d DOWN resources", max_critical)
+            results.stopped = True
+            break
+
+    # Output the msg for input ids
+    for id_ in ids:
+        if id_ in skip:
+            results.add_result(resource_type, id_, skip=True)
+        elif id_ not in checked_ids:
+            results.add_result(resource_type, id_, exists=False)
+
+
+def check(
+    resource_type,
+    ids,
+    skip=None,
+    select=None,
+    check_all=False,
+    snapshot=None,
+    snapshot_max_age=MAX_AGE,
+    shard=None,
+    output_detail=None,
+    state_file=None,
+    max_critical=None,
+):
     """Check OpenStack resource.
 
     :param resource_type: OpenStack resource type
@@ -333,56 +834,129 @@ def check(resource_type, ids, skip=None, select=None, check_all=False):
     :type select: Dict[str, str]
     :param check_all: flag to checking all OpenStack resources
     :type check_all: bool
+    :param snapshot: path to inventory snapshot used instead of the API
+    :type snapshot: Optional[str]
+    :param snapshot_max_age: maximum age of the snapshot in seconds
+    :type snapshot_max_age: int
+    :param shard: check only resources of the shard (index, count) with `check_all`
+    :type shard: Optional[Tuple[int, int]]
+    :param output_detail: path to file with all result messages
+    :type output_detail: Optional[str]
+    :param state_file: path to database with states of resources in the previous run
+    :type state_file: Optional[str]
+    :param max_critical: stop the check with `check_all` after this number of DOWN
+                         resources
+    :type max_critical: Optional[int]
     :raise nagios_plugin3.UnknownError: if resource not valid status
+    :raise nagios_plugin3.UnknownError: if snapshot is missing or stale
+    :raise nagios_plugin3.UnknownError: if state file cannot be read or written
     :raise nagios_plugin3.CriticalError: if resource not found
     :raise nagios_plugin3.CriticalError: if resource status is DOWN
     """
-    results = Results()
-    connection = openstack.connect(cloud="envvars")
-    resources = RESOURCES[resource_type](connection)
-    skip = skip or set()
-    skip.update(
-        mechanism_skip_ids(
-            connection=connection,
-            resource_type=resource_type,
+    group_name = OUTPUT_GROUPS.get(resource_type, ("group", None))[0]
+    try:
+        states = ResourceStates(state_file) if state_file else None
+        results = Results(group_name, output_detail, states)
+        connection = _connect(snapshot, snapshot_max_age)
+        resources = _list(connection, resource_type, ids, select, check_all, results)
+    except (SnapshotError, StateError) as error:
+        raise UnknownError("UNKNOWN: {}".format(error))
+
+    try:
+        _evaluate(
+            resource_type,
+            resources,
+            connection,
+            results,
+            ids,
+            skip,
+            select,
+            check_all,
+            shard,
+            max_critical,
         )
-    )
-    warn_ids: Dict[str, str] = mechanism_warning_ids(
-        connection=connection,
-        resource_type=resource_type,
-    )
-    checked_ids = []
-
-    for resource in _resource_filter(resources, ids, skip, check_all, select):
-        checked_ids.append(resource.id)
-        if resource.id in warn_ids:
-            results.add_result(resource_type, resource.id, warn_ids[resource.id], warn=True)
-        elif resource_type not in RESOURCES_BY_EXISTENCE:
-            resource_status = getattr(resource, "status", "UNKNOWN")
-            results.add_result(resource_type, resource.id, resource_status)
-        else:
-            results.add_result(resource_type, resource.id)
-
-    # Output the msg for input ids
-    for id_ in ids:
-        if id_ in skip:
-            results.add_result(resource_type, id_, skip=True)
-        elif id_ not in checked_ids:
-            results.add_result(resource_type, id_, exists=False)
+        results.close()
+        if states is not None:
+            # resources which were not evaluated keep their state
+            states.close(forget=not results.stopped)
+    except (SnapshotError, StateError) as error:
+        raise UnknownError("UNKNOWN: {}".format(error))
+
+    nagios_output(resource_type, results, shard)
+
+
+def check_many(
+    specs, snapshot=None, snapshot_max_age=MAX_AGE, output_detail=None, state_file=None
+):
+    """Check several OpenStack resources over one connection.
+
+    The resources are listed and evaluated concurrently, every resource gets its
+    section of the output and an equal part of the output budget.
+
+    :param specs: options of each resource, see `parse_arguments`
+    :type specs: List[argparse.Namespace]
+    :param snapshot: path to inventory snapshot used instead of the API
+    :type snapshot: Optional[str]
+    :param snapshot_max_age: maximum age of the snapshot in seconds
+    :type snapshot_max_age: int
+    :param output_detail: path prefix of files with all result messages of each resource
+    :type output_detail: Optional[str]
+    :param state_file: path to database with states of resources in the previous run
+    :type state_file: Optional[str]
+    :raise nagios_plugin3.UnknownError: if snapshot or state file cannot be used
+    :raise nagios_plugin3.CriticalError: if any resource was not found or is DOWN
+    """
+    try:
+        states = ResourceStates(state_file) if state_file else None
+        results = [
+            Results(
+                OUTPUT_GROUPS.get(spec.resource, ("group", None))[0],
+                "{}.{}".format(output_detail, spec.resource) if output_detail else None,
+                states,
+                OUTPUT_BUDGET // len(specs),
+            )
+            for spec in specs
+        ]
+        connection = _connect(snapshot, snapshot_max_age)
+        with ThreadPoolExecutor(max_workers=len(specs)) as executor:
+            # consume the results, so the errors of the threads are raised
+            list(executor.map(lambda *args: _check_spec(connection, *args), specs, results))
+        if states is not None:
+            states.close(forget=not any(spec_results.stopped for spec_results in results))
+    except (SnapshotError, StateError) as error:
+        raise UnknownError("UNKNOWN: {}".format(error))
 
-    nagios_output(resource_type, results)
+    nagios_output_many(specs, results)
 
 
 def main():
+    delegate_to_daemon()
     args = parse_arguments()
     set_openstack_credentials(args.env)
+    if len(args.specs) > 1 or args.specs[0] is not args:
+        try_check(
+            check_many,
+            args.specs,
+            args.snapshot,
+            args.snapshot_max_age,
+            args.output_detail,
+            args.state_file,
+        )
+        return
+
     try_check(
         check,
         args.resource,
         set(args.id),
         set(args.skip_id),
-        dict(arg.split("=", 1) for arg in args.select),
+        _parse_select(args.select),
         args.all,
+        args.snapshot,
+        args.snapshot_max_age,
+        args.shard,
+        args.output_detail,
+        args.state_file,
+        args.max_critical,
     )
 
 
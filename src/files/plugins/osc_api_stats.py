@@ -0,0 +1,211 @@
+"""OpenStack API call statistics reported as Nagios performance data.
+
+`attach_api_stats` wraps the `request` method of the keystoneauth session used by
+a connection (or session client), so every API call made by the plugin, including
+authentication and version discovery, is counted per service together with its
+latency and the size of the response. `with_perfdata` appends the statistics to the
+plugin output, e.g.
+
+    OK: ports 10/10 passed | api_calls=4 api_time=0.412s ... neutron_time=0.301s
+
+Every call waits for the host-wide limiter (see `osc_rate_limit`) and if any limit
+is configured, the time spent waiting is reported as `api_wait` and `<service>_wait`.
+Authentication and discovery requests made by keystoneauth while sending a call are
+counted, but not limited again.
+
+The statistics are process wide, osc-checkd resets them before running a check.
+"""
+
+import re
+import threading
+import time
+
+from osc_rate_limit import LIMITER
+
+# service type from the catalog -> project name used in perfdata labels
+SERVICE_NAMES = {
+    "identity": "keystone",
+    "compute": "nova",
+    "network": "neutron",
+    "placement": "placement",
+    "load-balancer": "octavia",
+    "image": "glance",
+    "volume": "cinder",
+    "volumev2": "cinder",
+    "volumev3": "cinder",
+    "block-storage": "cinder",
+    "instance-ha": "masakari",
+}
+TOKEN_PATH_RE = re.compile(r"/auth/tokens/?$")
+# requests in progress in the thread which passed the limiter, the nested
+# authentication and discovery requests made by keystoneauth are not limited again
+_LIMITED = threading.local()
+
+
+class ApiStats:
+    """Counters of API calls per service."""
+
+    def __init__(self):
+        """Initialize of ApiStats."""
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # service -> [calls, total time, maximum time, received bytes]
+            self._services = {}
+            # service -> time spent waiting for the limiter
+            self._waits = {}
+
+    def record(self, service, elapsed, size):
+        with self._lock:
+            stats = self._services.setdefault(service, [0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            stats[3] += size
+
+    def record_wait(self, service, waited):
+        with self._lock:
+            self._waits[service] = self._waits.get(service, 0.0) + waited
+
+    def services(self):
+        """Get statistics of every called service.
+
+        :returns: service -> (calls, total time, maximum time, received bytes)
+        :rtype: Dict[str, Tuple[int, float, float, int]]
+        """
+        with self._lock:
+            return {service: tuple(stats) for service, stats in self._services.items()}
+
+    def waits(self):
+        """Get time spent waiting for the limiter by every limited service.
+
+        :returns: service -> waiting time
+        :rtype: Dict[str, float]
+        """
+        with self._lock:
+            return dict(self._waits)
+
+    def perfdata(self):
+        """Format statistics as Nagios performance data, empty if no call was made."""
+        services = self.services()
+        if not services:
+            return ""
+
+        total = (
+            sum(stats[0] for stats in services.values()),
+            sum(stats[1] for stats in services.values()),
+            max(stats[2] for stats in services.values()),
+            sum(stats[3] for stats in services.values()),
+        )
+        waits = self.waits()
+        if waits:
+            waits["api"] = sum(waits.values())
+
+        metrics = []
+        for label, (calls, time_, max_time, size) in [("api", total), *sorted(services.items())]:
+            metrics += [
+                "{}_calls={}".format(label, calls),
+                "{}_time={:.3f}s".format(label, time_),
+                "{}_max_time={:.3f}s".format(label, max_time),
+                "{}_bytes={}B".format(label, size),
+            ]
+            if label in waits:
+                metrics.append("{}_wait={:.3f}s".format(label, waits[label]))
+
+        return " ".join(metrics)
+
+
+STATS = ApiStats()
+
+
+def reset():
+    """Reset process wide statistics before new check run."""
+    STATS.reset()
+
+
+def _service_name(url, endpoint_filter):
+    service_type = (endpoint_filter or {}).get("service_type")
+    if service_type is None:
+        # requests without service are authentication and version discovery
+        return "keystone" if TOKEN_PATH_RE.search(url.split("?")[0]) else "discovery"
+
+    return SERVICE_NAMES.get(service_type, re.sub(r"\W", "_", service_type))
+
+
+def _response_size(response, stream):
+    if stream:
+        # the body of streamed response is not read here
+        return int(response.headers.get("Content-Length") or 0)
+
+    return len(response.content or b"")
+
+
+def attach_api_stats(client, stats=STATS, limiter=LIMITER):
+    """Record every API call made by the client and apply the host-wide limits.
+
+    :param client: OpenStack connection or keystoneauth adapter
+    :type client: Union[openstack.connection.Connection, keystoneauth1.adapter.Adapter]
+    :param stats: statistics updated by the calls
+    :type stats: ApiStats
+    :param limiter: limiter of API calls
+    :type limiter: osc_rate_limit.ApiLimiter
+    :returns: the same client
+    """
+    session = client.session
+    if getattr(session, "_api_stats", None) is not None:
+        return client  # already attached, e.g. session reused by osc-checkd
+
+    request = session.request
+
+    def _measured_request(service, url, method, *args, **kwargs):
+        start = time.monotonic()
+        size = 0
+        try:
+            response = request(url, method, *args, **kwargs)
+            size = _response_size(response, kwargs.get("stream", False))
+            return response
+        finally:
+            stats.record(service, time.monotonic() - start, size)
+
+    def _request(url, method, *args, **kwargs):
+        service = _service_name(url, kwargs.get("endpoint_filter"))
+        if getattr(_LIMITED, "active", False):
+            # the outer request holds the request slot the nested one would wait for
+            return _measured_request(service, url, method, *args, **kwargs)
+
+        with limiter.limit(service) as waited:
+            if waited is not None:
+                stats.record_wait(service, waited)
+
+            _LIMITED.active = True
+            try:
+                return _measured_request(service, url, method, *args, **kwargs)
+            finally:
+                _LIMITED.active = False
+
+    session.request = _request
+    session._api_stats = stats
+    return client
+
+
+def with_perfdata(message, stats=STATS, perfdata=None):
+    """Append API call statistics to plugin output as performance data.
+
+    :param message: plugin output
+    :type message: str
+    :param stats: statistics of API calls
+    :type stats: ApiStats
+    :param perfdata: performance data of the plugin placed before the statistics
+    :type perfdata: Optional[Dict[str, Union[int, str]]]
+    :returns: output with performance data, unchanged output if there is none
+    :rtype: str
+    """
+    metrics = ["{}={}".format(label, value) for label, value in (perfdata or {}).items()]
+    if stats.perfdata():
+        metrics.append(stats.perfdata())
+    if not metrics:
+        return message
+
+    return "{} | {}".format(message.rstrip("\n"), " ".join(metrics))
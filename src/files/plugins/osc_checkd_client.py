@@ -0,0 +1,72 @@
+"""Thin client used by the python plugins to run checks through osc-checkd.
+
+Every python plugin calls `delegate_to_daemon` at the very beginning of its main
+routine. When the osc-checkd socket exists, the plugin name and its arguments are
+sent to the daemon, which runs the check in-process with warm OpenStack sessions,
+and the plugin only prints the returned output and exits with the returned status.
+
+If the daemon is not running, refuses the request or does not finish the check in
+time, the plugin carries on and runs the check locally, exactly as before.
+"""
+
+import json
+import os
+import socket
+import sys
+
+SOCKET_PATH = "/run/nagios/osc-checkd.sock"
+# NRPE default `command_timeout` is 60 seconds, the daemon may take less than half
+# of it, so the check can still run locally if the daemon is busy or too slow
+TIMEOUT = 25
+# seconds the response may be delayed after the timeout sent to the daemon
+RESPONSE_MARGIN = 2
+# set by osc-checkd, the plugins executed by the daemon must not delegate again
+IN_DAEMON = False
+
+
+def _request(socket_path, request, timeout):
+    """Send request to the daemon and return the decoded response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+
+    return json.loads(b"".join(chunks).decode("utf-8"))
+
+
+def delegate_to_daemon(argv=None, socket_path=SOCKET_PATH, timeout=TIMEOUT):
+    """Run the check through osc-checkd, if it is available.
+
+    :param argv: plugin command line, `sys.argv` by default
+    :type argv: Optional[List[str]]
+    :param socket_path: path to the osc-checkd unix socket
+    :type socket_path: str
+    :param timeout: how long to wait for the daemon response
+    :type timeout: float
+    :returns: None if the check should run locally, otherwise exits
+    """
+    if IN_DAEMON or os.environ.get("OSC_CHECKD_DISABLED") or not os.path.exists(socket_path):
+        return
+
+    argv = sys.argv if argv is None else argv
+    request = {"plugin": os.path.basename(argv[0]), "argv": list(argv[1:]), "timeout": timeout}
+    try:
+        response = _request(socket_path, request, timeout + RESPONSE_MARGIN)
+    except (OSError, ValueError):
+        # daemon is not listening, did not answer in time (socket.timeout is OSError)
+        # or sent garbage, run the check locally
+        return
+
+    if "error" in response:
+        return
+
+    sys.stdout.write(response["output"])
+    sys.stdout.flush()
+    sys.exit(response["status"])
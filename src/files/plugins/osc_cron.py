@@ -0,0 +1,71 @@
+"""Runs of cron jobs which must not overlap.
+
+A job holds an exclusive lock for its run, a start while the previous run is still
+in progress is skipped. The recent runs and skipped starts are recorded, so the
+charm derives the interval of the job from their duration.
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+
+# number of recent runs and skipped starts kept in the record
+RUNS_KEPT = 12
+
+
+@contextlib.contextmanager
+def exclusive_run(lock_file):
+    """Hold exclusive lock of the job for the run.
+
+    :param lock_file: path to the lock file
+    :type lock_file: str
+    :returns: False if another run holds the lock
+    :rtype: Iterator[bool]
+    """
+    fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+        else:
+            yield True
+    finally:
+        os.close(fd)
+
+
+def record_run(path, run=None, skipped=None):
+    """Record completed run or start skipped while another run was in progress.
+
+    :param path: path to the record of recent runs
+    :type path: str
+    :param run: start time and duration of completed run
+    :type run: Optional[Dict[str, float]]
+    :param skipped: time of skipped start
+    :type skipped: Optional[float]
+    :returns: recent runs and skipped starts
+    :rtype: Dict[str, List]
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    with os.fdopen(fd, "r+") as file:
+        # skipped starts are recorded while the run holding the job lock is in progress
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            runs = json.load(file)
+        except ValueError:
+            runs = {}
+        if not isinstance(runs, dict):
+            runs = {}
+
+        runs = {"runs": runs.get("runs", []), "skipped": runs.get("skipped", [])}
+        if run is not None:
+            runs["runs"] = (runs["runs"] + [run])[-RUNS_KEPT:]
+        if skipped is not None:
+            runs["skipped"] = (runs["skipped"] + [skipped])[-RUNS_KEPT:]
+
+        file.seek(0)
+        file.truncate()
+        json.dump(runs, file)
+
+    return runs
@@ -0,0 +1,153 @@
+"""Incremental decoding of large JSON responses.
+
+The list responses of OpenStack APIs are objects with one large member, e.g.
+`{"allocations": {...}, "resource_provider_generation": 5}`. `iter_response` decodes
+the items of that member one at a time while the response body is being received,
+so neither the whole body nor the decoded document is kept in memory.
+"""
+
+import codecs
+import json
+
+# bytes read from the response at a time
+CHUNK_SIZE = 65536
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class _Reader:
+    """Text decoded from chunks of the body, consumed from the position."""
+
+    def __init__(self, chunks):
+        """Initialize of _Reader."""
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        """Read next chunk of the body, False if the whole body was read."""
+        if self.eof:
+            return False
+
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self.eof = True
+            text = self._utf8.decode(b"", final=True)
+        else:
+            text = self._utf8.decode(chunk) if isinstance(chunk, bytes) else chunk
+
+        # the consumed text is dropped
+        pos, self.pos = self.pos, 0
+        self.buffer = self.buffer[pos:] + text
+        return True
+
+    def peek(self):
+        """Get next character after whitespace, empty string at the end of the body."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.more():
+                return ""
+
+    def expect(self, chars):
+        """Consume next character, which must be one of the chars."""
+        char = self.peek()
+        if not char or char not in chars:
+            raise json.JSONDecodeError(
+                "Expecting one of {!r}".format(chars), self.buffer, self.pos
+            )
+
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Consume next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.more():
+                    continue
+                raise
+
+            # number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self.more():
+                continue
+
+            self.pos = end
+            return value
+
+
+def _iter_container(reader):
+    opening = reader.expect("[{")
+    closing = "]" if opening == "[" else "}"
+    if reader.peek() == closing:
+        reader.pos += 1
+        return
+
+    while True:
+        if opening == "[":
+            yield reader.value()
+        else:
+            name = reader.value()
+            reader.expect(":")
+            yield name, reader.value()
+
+        if reader.expect("," + closing) == closing:
+            return
+
+
+def iter_members(chunks, key):
+    """Generate items of array or object member of top-level JSON object.
+
+    :param chunks: chunks of the body
+    :type chunks: Iterable[Union[bytes, str]]
+    :param key: name of the member, e.g. allocations
+    :type key: str
+    :returns: elements of the array or name and value of members of the object
+    :rtype: Iterator[Any]
+    :raises json.JSONDecodeError: if the body is not valid JSON
+    :raises KeyError: if the object has no such member
+    """
+    reader = _Reader(chunks)
+    reader.expect("{")
+    found = False
+    if reader.peek() == "}":
+        reader.pos += 1
+    else:
+        while True:
+            name = reader.value()
+            reader.expect(":")
+            if name == key:
+                found = True
+                yield from _iter_container(reader)
+            else:
+                reader.value()
+
+            if reader.expect(",}") == "}":
+                break
+
+    if not found:
+        raise KeyError(key)
+
+
+def iter_response(response, key, chunk_size=CHUNK_SIZE):
+    """Generate items of member of JSON object in streamed response and close it.
+
+    :param response: response of request with `stream=True`
+    :type response: requests.Response
+    :param key: name of the member, see `iter_members`
+    :type key: str
+    :param chunk_size: bytes read from the response at a time
+    :type chunk_size: int
+    """
+    try:
+        yield from iter_members(response.iter_content(chunk_size), key)
+    finally:
+        response.close()
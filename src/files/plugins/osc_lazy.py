@@ -0,0 +1,34 @@
+"""Defer imports of the OpenStack SDK and other heavy modules.
+
+Importing `openstack`, `os_client_config` or `requests` takes most of the start-up
+time of a short check. A module imported with `lazy_import` is executed on first
+attribute access, so code paths which never talk to the API (argument errors,
+checks reading a status file) do not pay for it.
+"""
+
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """Import top-level module, the module is executed on first attribute access.
+
+    :param name: name of top-level module, e.g. `openstack`
+    :type name: str
+    :returns: module
+    :rtype: types.ModuleType
+    :raises ModuleNotFoundError: if module is not installed
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError("No module named {!r}".format(name), name=name)
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,156 @@
+"""Check results exported for the node-exporter textfile collector.
+
+When the `OSC_PROMETHEUS_TEXTFILE_DIR` variable is set (the charm exports it in the
+novarc file), `report` writes the status of the check, the number of checked
+resources in each state, the run duration and the API call statistics to
+`osc_<check>.prom` in that directory, so every check result is available by scraping
+the node-exporter of the unit instead of polling NRPE.
+"""
+
+import logging
+import os
+import re
+import tempfile
+import time
+
+from osc_api_stats import STATS, with_perfdata
+
+TEXTFILE_DIR_ENV = "OSC_PROMETHEUS_TEXTFILE_DIR"
+PREFIX = "openstack_service_checks"
+NAGIOS_STATUS = {"OK": 0, "WARNING": 1, "CRITICAL": 2, "UNKNOWN": 3}
+METRICS = {
+    "status": ("gauge", "Nagios status of the check, 0 OK, 1 WARNING, 2 CRITICAL, 3 UNKNOWN"),
+    "resources": ("gauge", "Number of resources found by the check in each state"),
+    "duration_seconds": ("gauge", "Duration of the last check run"),
+    "last_run_timestamp_seconds": ("gauge", "Time when the check finished"),
+    "api_calls": ("gauge", "Number of OpenStack API calls made by the last check run"),
+    "api_time_seconds": ("gauge", "Time spent in OpenStack API calls by the last check run"),
+    "api_bytes": ("gauge", "Bytes received from OpenStack APIs by the last check run"),
+    "api_wait_seconds": ("gauge", "Time spent waiting for the API limiter by the last check run"),
+}
+LOG = logging.getLogger(__name__)
+
+_started = time.monotonic()
+
+
+def reset():
+    """Start measuring duration of new check run."""
+    global _started
+    _started = time.monotonic()
+
+
+def _status(message):
+    """Get status from the status name prefixing the plugin output."""
+    return NAGIOS_STATUS.get(message.split(":", 1)[0].strip(), NAGIOS_STATUS["UNKNOWN"])
+
+
+def _sample(metric, value, **labels):
+    label_values = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in sorted(labels.items())
+    )
+    return "{}_{}{{{}}} {}".format(PREFIX, metric, label_values, value)
+
+
+def format_metrics(check, status, resources, duration, api_stats, api_waits=None):
+    """Format check result in the Prometheus text exposition format.
+
+    :param check: name of check, e.g. resources_port
+    :type check: str
+    :param status: Nagios status
+    :type status: int
+    :param resources: number of resources in each state
+    :type resources: Dict[str, int]
+    :param duration: duration of the check run in seconds
+    :type duration: float
+    :param api_stats: service -> (calls, total time, maximum time, received bytes)
+    :type api_stats: Dict[str, Tuple[int, float, float, int]]
+    :param api_waits: service -> time spent waiting for the API limiter
+    :type api_waits: Optional[Dict[str, float]]
+    :rtype: str
+    """
+    samples = {
+        "status": [_sample("status", status, check=check)],
+        "resources": [
+            _sample("resources", count, check=check, state=state)
+            for state, count in sorted(resources.items())
+        ],
+        "duration_seconds": [_sample("duration_seconds", round(duration, 3), check=check)],
+        "last_run_timestamp_seconds": [
+            _sample("last_run_timestamp_seconds", int(time.time()), check=check)
+        ],
+        "api_calls": [],
+        "api_time_seconds": [],
+        "api_bytes": [],
+        "api_wait_seconds": [
+            _sample("api_wait_seconds", round(waited, 3), check=check, service=service)
+            for service, waited in sorted((api_waits or {}).items())
+        ],
+    }
+    for service, (calls, time_, _, size) in sorted(api_stats.items()):
+        samples["api_calls"].append(_sample("api_calls", calls, check=check, service=service))
+        samples["api_time_seconds"].append(
+            _sample("api_time_seconds", round(time_, 3), check=check, service=service)
+        )
+        samples["api_bytes"].append(_sample("api_bytes", size, check=check, service=service))
+
+    lines = []
+    for metric, (type_, help_) in METRICS.items():
+        if samples[metric]:
+            lines.append("# HELP {}_{} {}".format(PREFIX, metric, help_))
+            lines.append("# TYPE {}_{} {}".format(PREFIX, metric, type_))
+            lines.extend(samples[metric])
+
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(directory, check, content):
+    """Atomically replace metrics of the check, node-exporter reads only *.prom files."""
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".osc_{}".format(check))
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, os.path.join(directory, "osc_{}.prom".format(check)))
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def report(check, message, status=None, resources=None, perfdata=None):
+    """Export check result and append API call statistics to the plugin output.
+
+    Metrics are exported only if the textfile directory is configured, an error
+    with the directory never changes the result of the check.
+
+    :param check: name of check, e.g. resources_port
+    :type check: str
+    :param message: plugin output
+    :type message: str
+    :param status: Nagios status, taken from the output prefix by default
+    :type status: Optional[int]
+    :param resources: number of resources in each state
+    :type resources: Optional[Dict[str, int]]
+    :param perfdata: performance data of the check, e.g. {"listings": 2}
+    :type perfdata: Optional[Dict[str, Union[int, str]]]
+    :returns: output with performance data
+    :rtype: str
+    """
+    directory = os.environ.get(TEXTFILE_DIR_ENV)
+    if directory:
+        check = re.sub(r"\W", "_", check)
+        status = _status(message) if status is None else status
+        content = format_metrics(
+            check,
+            status,
+            resources or {},
+            time.monotonic() - _started,
+            STATS.services(),
+            STATS.waits(),
+        )
+        try:
+            write_textfile(directory, check, content)
+        except OSError as error:
+            LOG.warning("metrics of %s could not be written to %s: %s", check, directory, error)
+
+    return with_perfdata(message, perfdata=perfdata)
@@ -0,0 +1,111 @@
+"""Load OpenStack credentials from the novarc file without sourcing it in bash.
+
+The novarc file is rendered by the charm from `templates/nagios.novarc` and contains
+only `export KEY=VALUE` lines, which may reference previously defined variables
+(e.g. `export REQUESTS_CA_BUNDLE=$OS_CACERT`). The parsed variables are cached by
+the file mtime, so long-running processes (osc-checkd) parse the file only after
+it has been re-rendered.
+"""
+
+import logging
+import os
+import re
+
+LOG = logging.getLogger(__name__)
+VARIABLE_RE = re.compile(r"\$(?:\{(\w+)\}|(\w+))")
+LINE_RE = re.compile(r"^(?:export\s+)?([A-Za-z_]\w*)=(.*)$")
+# single-quoted, double-quoted, backslash-escaped or unquoted part of bash word
+WORD_PART_RE = re.compile(r"""'([^']*)'?|"((?:\\.|[^"\\])*)"?|\\(.?)|([^\s'"\\]+)""")
+DOUBLE_QUOTED_ESCAPE_RE = re.compile(r'\\([$`"\\])')
+
+_cache = {}
+
+
+def _expand(value, env):
+    """Expand `$VAR` and `${VAR}` the same way as bash would."""
+
+    def _variable(match):
+        name = match.group(1) or match.group(2)
+        return env.get(name, os.environ.get(name, ""))
+
+    return VARIABLE_RE.sub(_variable, value)
+
+
+def _parse_value(raw_value, env):
+    """Parse value of variable as the first word of bash, e.g. `x"y z"w` is `xy zw`.
+
+    The word ends at unquoted whitespace, so an inline comment (`#` following the
+    whitespace) is not part of the value, but `#` inside of the word is. Variables
+    are expanded in unquoted and double-quoted parts of the word.
+    """
+    value, pos = "", 0
+    while pos < len(raw_value):
+        match = WORD_PART_RE.match(raw_value, pos)
+        if match is None:
+            break  # unquoted whitespace
+
+        single_quoted, double_quoted, escaped, unquoted = match.groups()
+        if single_quoted is not None:
+            value += single_quoted
+        elif double_quoted is not None:
+            # characters escaped by backslash are not expanded, e.g. \$
+            for i, part in enumerate(DOUBLE_QUOTED_ESCAPE_RE.split(double_quoted)):
+                value += part if i % 2 else _expand(part, env)
+        elif escaped is not None:
+            value += escaped
+        else:
+            value += _expand(unquoted, env)
+        pos = match.end()
+
+    return value
+
+
+def parse_novarc(content):
+    """Parse content of novarc file.
+
+    :param content: novarc file content
+    :type content: str
+    :returns: variables exported by novarc
+    :rtype: Dict[str, str]
+    """
+    env = {}
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        match = LINE_RE.match(line)
+        if match is None:
+            LOG.debug("ignoring novarc line: %s", line)
+            continue
+
+        key, raw_value = match.groups()
+        env[key] = _parse_value(raw_value, env)
+
+    return env
+
+
+def load_novarc(novarc):
+    """Load variables from novarc file, parsed results are cached by file mtime.
+
+    :param novarc: path to novarc file
+    :type novarc: str
+    :returns: variables exported by novarc
+    :rtype: Dict[str, str]
+    """
+    stat = os.stat(novarc)
+    cached = _cache.get(novarc)
+    if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size):
+        return dict(cached[1])
+
+    LOG.debug("loading envvars from %s", novarc)
+    with open(novarc, "r") as file:
+        env = parse_novarc(file.read())
+
+    _cache[novarc] = ((stat.st_mtime_ns, stat.st_size), env)
+    return dict(env)
+
+
+def set_openstack_credentials(novarc):
+    """Set openstack credentials from novarc file to environment variables."""
+    os.environ.update(load_novarc(novarc))
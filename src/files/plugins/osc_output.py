@@ -0,0 +1,196 @@
+"""Plugin output kept within a byte budget.
+
+Checks of all resources can produce tens of thousands of lines, which NRPE truncates
+anyway (`check_neutron_agents.sh` cuts its output at 4050 characters). `BudgetedOutput`
+keeps in memory only the most severe lines fitting the budget, the omitted lines are
+counted per state and group (e.g. network, project or host) and summarized in the
+last line, e.g.
+
+    port 'b3c1...' is in DOWN status
+    ...
+    9120 more lines omitted (9100 OK, 20 WARNING), by network: net-1 (4000), ...
+
+The budget covers the whole plugin output once the rest of it, e.g. the title and
+performance data rendered after all lines were added, is reserved by `reserve`.
+
+Every line can also be written to a detail file, which is atomically replaced when
+the output is finished.
+"""
+
+import collections
+import heapq
+import os
+import tempfile
+
+# bytes of the plugin output, the title and performance data are `reserve`d from it
+OUTPUT_BUDGET = 4000
+# number of the largest groups of omitted lines named in the summary
+SUMMARY_GROUPS = 5
+STATE_NAMES = {0: "OK", 1: "WARNING", 2: "CRITICAL", 3: "UNKNOWN"}
+
+
+class BudgetedOutput:
+    """Most severe lines of the output fitting the byte budget."""
+
+    def __init__(self, budget=OUTPUT_BUDGET, group_name="group", detail_file=None):
+        """Initialize of BudgetedOutput.
+
+        :param budget: maximum number of bytes of the retained lines
+        :type budget: int
+        :param group_name: name of the groups in the summary, e.g. network
+        :type group_name: str
+        :param detail_file: path to file with all lines
+        :type detail_file: Optional[str]
+        """
+        self.budget = budget
+        self.group_name = group_name
+        self.count = 0
+        # retained (severity, order, sequence, line, group), the least severe first
+        self._heap = []
+        self._size = 0
+        # lines ordered below this key are not retained, so the retained lines
+        # are always the most severe ones
+        self._floor = None
+        self._omitted_states = collections.Counter()
+        self._omitted_groups = collections.Counter()
+        self._detail_path = detail_file
+        self._detail = None
+
+    def _open_detail(self):
+        """Open temporary file replacing the detail file when the output is closed."""
+        fd, self._detail_tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self._detail_path)), prefix=".osc_detail"
+        )
+        self._detail = os.fdopen(fd, "w")
+
+    def _omit(self, severity, group):
+        self._omitted_states[severity] += 1
+        if group is not None:
+            self._omitted_groups[group] += 1
+
+    def add(self, severity, line, group=None, order=None):
+        """Add line of the output.
+
+        Lines of the same severity are retained and ordered by `order`. The line can
+        be given as a function formatting it, which is called only if the line is
+        retained or written to the detail file, so most of the lines of large outputs
+        are never formatted.
+
+        :param severity: Nagios status of the line
+        :type severity: int
+        :param line: output line or function formatting it
+        :type line: Union[str, Callable[[], str]]
+        :param group: group of the omitted line, e.g. network ID
+        :type group: Optional[str]
+        :param order: sort key of the line, the line itself by default (required if
+                      the line is formatted by function)
+        :type order: Any
+        """
+        self.count += 1
+        line = self.add_detail(line)
+        key = (severity, line if order is None else order)
+        if self._floor is not None and key <= self._floor:
+            self._omit(severity, group)
+            return
+
+        line = line() if callable(line) else line
+        heapq.heappush(self._heap, (*key, self.count, line, group))
+        self._size += len(line.encode("utf-8")) + 1
+        while self._size > self.budget:
+            self._drop()
+
+    def _drop(self):
+        """Omit the least severe retained line."""
+        severity, order, _, line, group = heapq.heappop(self._heap)
+        self._size -= len(line.encode("utf-8")) + 1
+        self._floor = (severity, order)
+        self._omit(severity, group)
+
+    def reserve(self, size):
+        """Reserve bytes of the budget for the rest of the output.
+
+        The least severe lines are omitted until the retained ones fit the rest of
+        the budget together with the summary of the omitted lines.
+
+        :param size: bytes of the output besides the lines, e.g. title and perfdata
+        :type size: int
+        """
+        self.budget -= size
+        while self._heap and self._size + len(self.summary().encode("utf-8")) > self.budget:
+            self._drop()
+
+    def add_detail(self, line):
+        """Add line only to the detail file, it is neither retained nor counted.
+
+        :param line: output line or function formatting it, see `add`
+        :type line: Union[str, Callable[[], str]]
+        :returns: the line, formatted if it was written to the detail file
+        :rtype: Union[str, Callable[[], str]]
+        """
+        if self._detail_path:
+            if self._detail is None:
+                self._open_detail()
+            line = line() if callable(line) else line
+            self._detail.write(line + "\n")
+
+        return line
+
+    @property
+    def omitted(self):
+        """Get number of omitted lines."""
+        return sum(self._omitted_states.values())
+
+    def summary(self):
+        """Get summary of the omitted lines, empty if no line was omitted."""
+        if not self.omitted:
+            return ""
+
+        states = ", ".join(
+            "{} {}".format(count, STATE_NAMES.get(severity, severity))
+            for severity, count in sorted(self._omitted_states.items(), reverse=True)
+        )
+        summary = "{} more lines omitted ({})".format(self.omitted, states)
+        if self._omitted_groups:
+            groups = ", ".join(
+                "{} ({})".format(group, count)
+                for group, count in self._omitted_groups.most_common(SUMMARY_GROUPS)
+            )
+            summary += ", by {}: {}".format(self.group_name, groups)
+
+        return summary
+
+    def lines(self, reverse=True, by_severity=True, by_line=False):
+        """Get retained lines followed by the summary of the omitted ones.
+
+        :param reverse: order the most severe lines first
+        :type reverse: bool
+        :param by_severity: order lines by severity before their order
+        :type by_severity: bool
+        :param by_line: order lines by the line instead of the order they were
+                        retained by
+        :type by_line: bool
+        :rtype: List[str]
+        """
+        position = 3 if by_line else 1
+        entries = sorted(
+            self._heap,
+            key=lambda entry: (entry[0], entry[position]) if by_severity else entry[position],
+            reverse=reverse,
+        )
+        lines = [line for _, _, _, line, _ in entries]
+        if self.omitted:
+            lines.append(self.summary())
+
+        return lines
+
+    def close(self):
+        """Replace the detail file with all lines of the output."""
+        if not self._detail_path:
+            return
+        if self._detail is None:
+            self._open_detail()  # no line was added
+
+        self._detail.close()
+        os.chmod(self._detail_tmp_path, 0o644)
+        os.replace(self._detail_tmp_path, self._detail_path)
+        self._detail = self._detail_path = None
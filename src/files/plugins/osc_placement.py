@@ -0,0 +1,102 @@
+"""Resource providers and allocations listed from the Placement API.
+
+The allocations of resource providers are requested concurrently, one request per
+resource provider with its own timeout and retries, and each response is decoded as
+it is received, so only the consumer UUIDs are kept. Used by the allocations check
+and by the inventory snapshot collector.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from osc_json_stream import iter_response
+
+ALLOCATIONS_PATH = "/resource_providers/{}/allocations"
+# concurrent requests getting allocations of resource providers
+PLACEMENT_WORKERS = 8
+# seconds to wait for the response with allocations of one resource provider
+PLACEMENT_TIMEOUT = 30
+# retries of the request after timeout, connection error or server error
+PLACEMENT_RETRIES = 2
+RETRIABLE_STATUS_CODES = [500, 502, 503, 504]
+
+
+def get_resource_providers(placement_client):
+    resp = placement_client.get("/resource_providers", stream=True)
+    resource_providers = []
+    for rp in iter_response(resp, "resource_providers"):
+        resource_providers.append({"name": rp["name"], "uuid": rp["uuid"]})
+    return resource_providers
+
+
+def get_placement_instances(
+    placement_client, rp_uuid, timeout=PLACEMENT_TIMEOUT, retries=PLACEMENT_RETRIES
+):
+    """Return UUIDs of instances that have allocations against host in Placement.
+
+    The response is decoded as it is received and only the consumer UUIDs are kept,
+    the allocated resources of each consumer are dropped right away.
+    """
+    resp = placement_client.get(
+        ALLOCATIONS_PATH.format(rp_uuid),
+        timeout=timeout,
+        connect_retries=retries,
+        status_code_retries=retries,
+        retriable_status_codes=RETRIABLE_STATUS_CODES,
+        stream=True,
+    )
+    instances = {uuid_ for uuid_, _ in iter_response(resp, "allocations")}
+    return instances
+
+
+def _timed_placement_instances(placement_client, rp, timeout, retries):
+    start = time.monotonic()
+    instances = get_placement_instances(placement_client, rp["uuid"], timeout, retries)
+    return instances, time.monotonic() - start
+
+
+def get_allocations(
+    placement_client,
+    resource_providers,
+    workers=PLACEMENT_WORKERS,
+    timeout=PLACEMENT_TIMEOUT,
+    retries=PLACEMENT_RETRIES,
+    stats=None,
+):
+    """Generate name of each resource provider and UUIDs of instances allocated on it.
+
+    The allocations of resource providers are requested concurrently, one request
+    per resource provider.
+
+    :param resource_providers: resource providers with name and uuid
+    :type resource_providers: List[Dict[str, str]]
+    :param workers: number of concurrent requests to Placement
+    :type workers: int
+    :param timeout: timeout of one request in seconds
+    :type timeout: float
+    :param retries: number of retries of failed request
+    :type retries: int
+    :param stats: filled with time of getting allocations and the slowest provider
+    :type stats: Optional[Dict[str, Any]]
+    :returns: resource provider name and instance UUIDs
+    :rtype: Iterator[Tuple[str, Set[str]]]
+    """
+    start = time.monotonic()
+    slowest, slowest_time = None, 0.0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        fetched = executor.map(
+            lambda rp: _timed_placement_instances(placement_client, rp, timeout, retries),
+            resource_providers,
+        )
+        for rp, (rp_instances, elapsed) in zip(resource_providers, fetched):
+            yield rp["name"], rp_instances
+            if elapsed > slowest_time:
+                slowest, slowest_time = rp["name"], elapsed
+
+    if stats is not None:
+        stats.update(
+            placement_time=round(time.monotonic() - start, 3),
+            resource_providers=len(resource_providers),
+            slowest_provider=slowest,
+            slowest_provider_time=round(slowest_time, 3),
+        )
@@ -0,0 +1,168 @@
+"""Host-wide limiter of OpenStack API requests shared by all checks.
+
+NRPE and cron start many checks at the same time, e.g. the resource checks for
+every resource type, the octavia checks and the port security remediation. Every
+request made through `osc_api_stats.attach_api_stats` waits for the limiter, whose
+state is kept in files in `STATE_DIR`, so the limits apply to all checks and cron
+jobs on the unit together:
+
+- `OSC_API_RATE_LIMIT` limits the requests per second to each service, e.g.
+  `neutron=5,nova=10,*=20`, where `*` applies to any other service. A service can
+  burst up to one second worth of requests.
+- `OSC_API_MAX_CONCURRENCY` limits the number of requests in progress.
+
+Both variables are exported by the charm in the novarc file, the requests are not
+limited if they are not set. The limiter never fails a check, a request proceeds
+without limiting if the state files are not accessible or the wait for its rate
+or for a free request slot exceeds `MAX_WAIT` seconds.
+"""
+
+import contextlib
+import fcntl
+import logging
+import os
+import re
+import struct
+import time
+
+RATE_LIMIT_ENV = "OSC_API_RATE_LIMIT"
+MAX_CONCURRENCY_ENV = "OSC_API_MAX_CONCURRENCY"
+# created by the charm, the checks and cron jobs using the limiter run as nagios
+STATE_DIR = "/var/lib/nagios/osc-api-limit"
+# maximum time to wait for the rate limit or for a free request slot
+MAX_WAIT = 30
+POLL_INTERVAL = 0.05
+ANY_SERVICE = "*"
+LOG = logging.getLogger(__name__)
+
+
+def parse_rate_limits(value):
+    """Parse requests per second limits of services.
+
+    :param value: comma separated `service=rate` pairs, e.g. `neutron=5,*=20`
+    :type value: str
+    :returns: service -> requests per second
+    :rtype: Dict[str, float]
+    :raises ValueError: if the value is not valid
+    """
+    limits = {}
+    for item in filter(None, (item.strip() for item in value.split(","))):
+        service, _, rate = item.partition("=")
+        service = service.strip()
+        if not service or not re.match(r"^(\w+|\*)$", service):
+            raise ValueError("invalid service in rate limit `{}`".format(item))
+
+        limits[service] = float(rate)
+        if limits[service] <= 0:
+            raise ValueError("rate limit `{}` must be positive".format(item))
+
+    return limits
+
+
+class ApiLimiter:
+    """Rate and concurrency limiter shared through files in the state directory."""
+
+    def __init__(self, state_dir=STATE_DIR):
+        """Initialize of ApiLimiter."""
+        self.state_dir = state_dir
+
+    @staticmethod
+    def _rate_limits():
+        try:
+            return parse_rate_limits(os.environ.get(RATE_LIMIT_ENV, ""))
+        except ValueError as error:
+            LOG.warning("%s is ignored: %s", RATE_LIMIT_ENV, error)
+            return {}
+
+    @staticmethod
+    def _max_concurrency():
+        try:
+            return max(int(os.environ.get(MAX_CONCURRENCY_ENV) or 0), 0)
+        except ValueError:
+            LOG.warning("%s is ignored, it must be an integer", MAX_CONCURRENCY_ENV)
+            return 0
+
+    def _open(self, name):
+        path = os.path.join(self.state_dir, name)
+        return os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def _reserve(self, service, rate):
+        """Reserve time slot for request to service and return delay before the request.
+
+        The theoretical arrival time of the next request is stored in the state file
+        of the service (generic cell rate algorithm). No slot is reserved if the delay
+        would exceed `MAX_WAIT`, the request is not delayed then.
+        """
+        interval = 1.0 / rate
+        tolerance = (max(int(rate), 1) - 1) * interval
+        fd = self._open("osc-api-rate-{}".format(service))
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.pread(fd, 8, 0)
+            now = time.time()
+            tat = max(struct.unpack("d", data)[0] if len(data) == 8 else now, now)
+            delay = max(tat - tolerance - now, 0.0)
+            if delay > MAX_WAIT:
+                LOG.warning("%s rate wait exceeds %ds, limit is ignored", service, MAX_WAIT)
+                return 0.0
+
+            os.pwrite(fd, struct.pack("d", tat + interval), 0)
+        finally:
+            os.close(fd)  # releases the lock
+
+        return delay
+
+    def _acquire_slot(self, max_concurrency):
+        """Lock one of the request slot files, return its descriptor or None."""
+        deadline = time.monotonic() + MAX_WAIT
+        fds = [self._open("osc-api-slot-{}".format(i)) for i in range(max_concurrency)]
+        try:
+            while True:
+                for fd in fds:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+
+                    fds.remove(fd)
+                    return fd
+
+                if time.monotonic() > deadline:
+                    LOG.warning("no free API request slot in %ds, limit is ignored", MAX_WAIT)
+                    return None
+
+                time.sleep(POLL_INTERVAL)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    @contextlib.contextmanager
+    def limit(self, service):
+        """Wait until the request to service is allowed and hold request slot.
+
+        :param service: service name, e.g. neutron
+        :type service: str
+        :returns: context manager yielding seconds spent waiting for the limiter or
+                  None if no limit is configured
+        """
+        start = time.monotonic()
+        limits = self._rate_limits()
+        rate = limits.get(service, limits.get(ANY_SERVICE))
+        max_concurrency = self._max_concurrency()
+        slot = None
+        try:
+            if rate:
+                time.sleep(self._reserve(service, rate))
+            if max_concurrency:
+                slot = self._acquire_slot(max_concurrency)
+        except OSError as error:
+            LOG.warning("API requests are not limited: %s", error)
+
+        try:
+            yield time.monotonic() - start if rate or max_concurrency else None
+        finally:
+            if slot is not None:
+                os.close(slot)
+
+
+LIMITER = ApiLimiter()
@@ -0,0 +1,365 @@
+"""Cloud inventory snapshot shared by the list-heavy checks.
+
+The snapshot is written by `run_inventory_snapshot.py`, which lists every collection
+once. The snapshot file records the time of collection, the API latency and the
+stored attributes of each collection, the listed resources of each collection are
+kept in a file of their own next to it, e.g. `inventory_snapshot.ports.json`.
+`load_snapshot` returns an object with the subset of the
+`openstack.connection.Connection` (and placement REST client) interface used by the
+checks, so the existing check functions evaluate it as if it were the API. Only the
+collections a check reads are loaded.
+
+Each file is replaced atomically, the collection files are written before the
+snapshot file, so a check reading a collection while the collector is replacing
+the snapshot gets the same or a newer collection.
+
+Servers of all projects are listed and the snapshot records the project of the
+credentials, so listing servers without `all_projects` returns only the servers of
+that project, as the API does.
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from osc_lazy import lazy_import
+
+openstack = lazy_import("openstack")
+
+SNAPSHOT_FILE = "/var/lib/nagios/inventory_snapshot.json"
+SNAPSHOT_VERSION = 2
+# default maximum age of snapshot in seconds, 3 runs of the collector
+MAX_AGE = 900
+# query parameters which do not filter the snapshot, e.g. servers(details=True)
+IGNORED_FILTERS = {"details", "all_projects", "fields"}
+ALLOCATIONS_PATH_RE = re.compile(r"^/resource_providers/([^/]+)/allocations$")
+
+
+def _attribute(key):
+    """Get name of attribute stored in snapshot, which is filtered by API filter key.
+
+    The snapshot stores the attributes of openstacksdk resources, which replace the
+    colon of Neutron extension attributes, e.g. `binding:host_id` is `binding_host_id`.
+    """
+    return key.replace(":", "_")
+
+
+class SnapshotError(Exception):
+    """Snapshot is missing, stale or does not contain requested collection."""
+
+
+class SnapshotResource:
+    """Read-only resource with attribute access like `openstack.resource.Resource`."""
+
+    __slots__ = ("_data", "_fields")
+
+    def __init__(self, data, fields=None):
+        """Initialize of SnapshotResource.
+
+        :param data: stored attributes of resource
+        :type data: Dict[str, Any]
+        :param fields: attributes stored for every resource of the collection, any
+                       attribute if the collection is not projected
+        :type fields: Optional[FrozenSet[str]]
+        """
+        self._data = data
+        self._fields = fields
+
+    def __getattr__(self, name):
+        """Get attribute of resource.
+
+        :raises SnapshotError: if the attribute is not stored in snapshot
+        """
+        if name.startswith("__"):
+            raise AttributeError(name)
+        if self._fields is not None and name not in self._fields:
+            raise SnapshotError("attribute {} is not in inventory snapshot".format(name))
+
+        # attributes not returned by the API are None in openstacksdk as well
+        return self._data.get(name)
+
+    def __repr__(self):
+        """Represent resource by its ID."""
+        return "SnapshotResource(id={!r})".format(self._data.get("id"))
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class SnapshotResponse:
+    """Response of placement REST client."""
+
+    def __init__(self, data):
+        """Initialize of SnapshotResponse."""
+        self.content = json.dumps(data).encode("utf-8")
+        self.status_code = 200
+
+    def iter_content(self, chunk_size=1):
+        """Get content like streamed response, it is already in memory in one chunk."""
+        return [self.content]
+
+    def close(self):
+        """Close the response, nothing is left open."""
+
+
+def _matches(collection, resource, filters):
+    for key, value in filters.items():
+        if key in IGNORED_FILTERS:
+            continue
+        if collection == "pools" and key == "loadbalancer_id":
+            if value not in {lb["id"] for lb in resource.loadbalancers or []}:
+                return False
+        elif collection == "ports" and key == "subnet_id":
+            if value not in {ip.get("subnet_id") for ip in resource.fixed_ips or []}:
+                return False
+        elif isinstance(value, list):
+            # list filter matches any of the values, e.g. ports(id=[...])
+            if getattr(resource, _attribute(key)) not in value:
+                return False
+        elif getattr(resource, _attribute(key)) != value:
+            return False
+
+    return True
+
+
+class _NetworkProxy:
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def networks(self, **filters):
+        return self._snapshot.resources("networks", **filters)
+
+    def ips(self, **filters):
+        return self._snapshot.resources("floating_ips", **filters)
+
+    def ports(self, **filters):
+        return self._snapshot.resources("ports", **filters)
+
+    def security_groups(self, **filters):
+        return self._snapshot.resources("security_groups", **filters)
+
+    def subnets(self, **filters):
+        return self._snapshot.resources("subnets", **filters)
+
+    def get_port(self, port):
+        return self._snapshot.resource("ports", port)
+
+
+class _ComputeProxy:
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def servers(self, all_projects=False, **filters):
+        servers = self._snapshot.resources("servers", **filters)
+        if all_projects:
+            return servers
+
+        project_id = self._snapshot.project_id()
+        return [server for server in servers if server.project_id == project_id]
+
+    def get_server(self, server):
+        return self._snapshot.resource("servers", server)
+
+
+class _LoadBalancerProxy:
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def load_balancers(self, **filters):
+        return self._snapshot.resources("load_balancers", **filters)
+
+    def pools(self, **filters):
+        return self._snapshot.resources("pools", **filters)
+
+
+class _PlacementClient:
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def get(self, path, **kwargs):
+        # request options, e.g. timeout and retries, do not apply to the snapshot
+        if path == "/resource_providers":
+            return SnapshotResponse(
+                {"resource_providers": self._snapshot.collection("resource_providers")}
+            )
+
+        match = ALLOCATIONS_PATH_RE.match(path)
+        if match is None:
+            raise SnapshotError("placement path {} is not part of snapshot".format(path))
+
+        instances = self._snapshot.collection("allocations").get(match.group(1), [])
+        return SnapshotResponse({"allocations": {uuid: {} for uuid in instances}})
+
+
+class Snapshot:
+    """Inventory snapshot used in place of OpenStack connection."""
+
+    def __init__(self, data, path=SNAPSHOT_FILE):
+        """Initialize of Snapshot.
+
+        :param data: content of the snapshot file
+        :type data: Dict[str, Any]
+        :param path: path to snapshot file, the collection files are next to it
+        :type path: str
+        """
+        self.timestamp = data["timestamp"]
+        self._path = path
+        self._project_id = data.get("project_id")
+        self._collections = data["collections"]
+        self._items = {}
+        self._lock = threading.Lock()
+        self._resources = {}
+        self._by_id = {}
+        self.network = _NetworkProxy(self)
+        self.compute = _ComputeProxy(self)
+        self.load_balancer = _LoadBalancerProxy(self)
+        self.placement = _PlacementClient(self)
+
+    @property
+    def age(self):
+        return time.time() - self.timestamp
+
+    def project_id(self):
+        """Get project of the credentials the snapshot was collected with.
+
+        :raises SnapshotError: if the project is not recorded in snapshot
+        """
+        if self._project_id is None:
+            raise SnapshotError("project of credentials is not in snapshot")
+
+        return self._project_id
+
+    def collection(self, name):
+        """Get raw items of collection, loaded from its file on the first use.
+
+        :raises SnapshotError: if collection is not part of snapshot
+        """
+        collection = self._collections.get(name)
+        if collection is None or "error" in collection:
+            error = (collection or {}).get("error", "not collected")
+            raise SnapshotError("collection {} is not in snapshot: {}".format(name, error))
+
+        # the concurrent checks of check_resources share the snapshot
+        with self._lock:
+            if name not in self._items:
+                self._items[name] = _load_json(collection_path(self._path, name))
+
+        return self._items[name]
+
+    def fields(self, name):
+        """Get attributes stored for resources of collection, None if not projected."""
+        fields = self._collections.get(name, {}).get("fields")
+        return None if fields is None else frozenset(fields)
+
+    def resources(self, name, **filters):
+        """Get resources of collection, filtered by equality of attributes."""
+        if name not in self._resources:
+            fields = self.fields(name)
+            self._resources[name] = [
+                SnapshotResource(item, fields) for item in self.collection(name)
+            ]
+
+        return [
+            resource for resource in self._resources[name] if _matches(name, resource, filters)
+        ]
+
+    def resource(self, name, id_):
+        """Get resource by ID.
+
+        :raises openstack.exceptions.ResourceNotFound: if resource is not in snapshot
+        """
+        if name not in self._by_id:
+            self._by_id[name] = {resource.id: resource for resource in self.resources(name)}
+
+        try:
+            return self._by_id[name][id_]
+        except KeyError:
+            raise openstack.exceptions.ResourceNotFound(
+                "No {} found for {}".format(name, id_)
+            ) from None
+
+
+def collection_path(path, name):
+    """Get path to file with items of collection, e.g. inventory_snapshot.ports.json."""
+    root, ext = os.path.splitext(path)
+    return "{}.{}{}".format(root, name, ext)
+
+
+def _write_json(data, path):
+    """Atomically replace the file, `mkstemp` creates file with 0600 mode."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".inventory_snapshot")
+    try:
+        with os.fdopen(fd, "w") as file:
+            json.dump(data, file, default=str)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def _load_json(path):
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError) as error:
+        raise SnapshotError("inventory snapshot {} can not be loaded: {}".format(path, error))
+
+
+def write_snapshot(collections, path=SNAPSHOT_FILE, project_id=None):
+    """Atomically replace the snapshot and the files of its collections.
+
+    :param collections: collection name -> {"items": [...], "latency": seconds} with
+                        optional "fields" stored for each item, or
+                        {"error": message, "latency": seconds}
+    :type collections: Dict[str, Dict]
+    :param path: path to snapshot
+    :type path: str
+    :param project_id: project of the credentials used by the collector
+    :type project_id: Optional[str]
+    """
+    index = {}
+    for name, collection in collections.items():
+        index[name] = {key: value for key, value in collection.items() if key != "items"}
+        if "items" in collection:
+            _write_json(collection["items"], collection_path(path, name))
+
+    data = {
+        "version": SNAPSHOT_VERSION,
+        "timestamp": time.time(),
+        "project_id": project_id,
+        "collections": index,
+    }
+    _write_json(data, path)
+
+
+def load_snapshot(path=SNAPSHOT_FILE, max_age=MAX_AGE):
+    """Load snapshot and check that it is fresh.
+
+    :param path: path to snapshot
+    :type path: str
+    :param max_age: maximum age of snapshot in seconds
+    :type max_age: int
+    :returns: snapshot with interface of OpenStack connection
+    :rtype: Snapshot
+    :raises SnapshotError: if snapshot is missing, invalid or older than max_age
+    """
+    data = _load_json(path)
+    if data.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotError(
+            "inventory snapshot {} has version {}, expected {}".format(
+                path, data.get("version"), SNAPSHOT_VERSION
+            )
+        )
+
+    snapshot = Snapshot(data, path)
+    if snapshot.age > max_age:
+        raise SnapshotError(
+            "inventory snapshot {} is {:.0f} seconds old (max age {} seconds)".format(
+                path, snapshot.age, max_age
+            )
+        )
+
+    return snapshot
@@ -0,0 +1,109 @@
+"""Last state of checked resources persisted between check runs.
+
+The resource checks can record the state of every checked resource (e.g. `ok`,
+`down`, `not_found`) together with the time it was entered in a SQLite database, so
+each run reports what changed since the previous one and how long each problem lasts.
+Only the changed rows are written, resources which were not checked in the run are
+removed from the database when it is closed.
+"""
+
+import sqlite3
+import threading
+import time
+
+# seconds to wait for the database locked by overlapping run of the same check
+LOCK_TIMEOUT = 30
+
+
+class StateError(Exception):
+    """State database cannot be read or written."""
+
+
+def format_duration(seconds):
+    """Format duration in seconds, e.g. 45s, 12m, 2h05m or 3d04h."""
+    seconds = int(max(seconds, 0))
+    if seconds < 60:
+        return "{}s".format(seconds)
+    if seconds < 3600:
+        return "{}m".format(seconds // 60)
+    if seconds < 86400:
+        return "{}h{:02d}m".format(seconds // 3600, seconds % 3600 // 60)
+
+    return "{}d{:02d}h".format(seconds // 86400, seconds % 86400 // 3600)
+
+
+class ResourceStates:
+    """States of resources of one check stored in SQLite database.
+
+    The states can be updated from several threads, e.g. by the combined check
+    evaluating resource types concurrently.
+    """
+
+    def __init__(self, path, now=None):
+        """Open the database and start recording states of the run.
+
+        :param path: path to the database, created if missing
+        :type path: str
+        :param now: time of the run, the current time by default
+        :type now: Optional[float]
+        :raises StateError: if the database cannot be opened
+        """
+        self.path = path
+        self.now = time.time() if now is None else now
+        self._lock = threading.Lock()
+        try:
+            self._db = sqlite3.connect(path, timeout=LOCK_TIMEOUT, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS states "
+                "(id TEXT PRIMARY KEY, state TEXT NOT NULL, since REAL NOT NULL) WITHOUT ROWID"
+            )
+            self._db.execute("CREATE TEMP TABLE seen (id TEXT PRIMARY KEY) WITHOUT ROWID")
+            # the first run has nothing to compare with
+            self.initial = self._db.execute("SELECT 1 FROM states LIMIT 1").fetchone() is None
+        except sqlite3.Error as error:
+            raise StateError("state file {}: {}".format(path, error)) from error
+
+    def update(self, id_, state):
+        """Record state of resource.
+
+        :param id_: resource ID
+        :type id_: str
+        :param state: state of the resource, e.g. down
+        :type state: str
+        :returns: previous state of the resource (None if it was not recorded, e.g.
+                  in the initial run) and time since the resource is in the state
+        :rtype: Tuple[Optional[str], float]
+        :raises StateError: if the database cannot be written
+        """
+        try:
+            with self._lock:
+                return self._update(id_, state)
+        except sqlite3.Error as error:
+            raise StateError("state file {}: {}".format(self.path, error)) from error
+
+    def _update(self, id_, state):
+        self._db.execute("INSERT OR IGNORE INTO seen VALUES (?)", (id_,))
+        row = self._db.execute("SELECT state, since FROM states WHERE id = ?", (id_,)).fetchone()
+        previous, since = row if row else (None, self.now)
+        if previous != state:
+            since = self.now
+            self._db.execute("INSERT OR REPLACE INTO states VALUES (?, ?, ?)", (id_, state, since))
+
+        return previous, since
+
+    def close(self, forget=True):
+        """Forget resources not recorded in this run and save the states.
+
+        :param forget: forget resources not recorded in this run, False if the run
+                       did not evaluate all resources
+        :type forget: bool
+        :raises StateError: if the database cannot be written
+        """
+        try:
+            if forget:
+                self._db.execute("DELETE FROM states WHERE id NOT IN (SELECT id FROM seen)")
+            self._db.commit()
+        except sqlite3.Error as error:
+            raise StateError("state file {}: {}".format(self.path, error)) from error
+        finally:
+            self._db.close()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Keystone token cache shared by every plugin invocation.
+
+The authentication state (scoped token and service catalog) obtained by one plugin
+is stored in the cache file and installed into the auth plugin of the following
+invocations, so a password authentication is issued once per token lifetime instead
+of on every NRPE poll. The cache is readable only by the user running the checks and
+access to it is serialized with `flock`.
+
+Authentications and cache hits are counted per hour, run this script to print the
+counters.
+"""
+
+import argparse
+import contextlib
+import datetime
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+
+CACHE_FILE = "/var/lib/nagios/keystone_token_cache.json"
+# cached token is not used if it expires in less than EXPIRY_MARGIN seconds
+EXPIRY_MARGIN = 300
+# number of hours for which counters are kept
+STATS_HOURS = 48
+LOG = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def _locked(cache_file, operation):
+    """Lock cache file with shared or exclusive lock."""
+    fd = os.open("{}.lock".format(cache_file), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, operation)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _read(cache_file):
+    try:
+        with open(cache_file, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {"tokens": {}, "stats": {}}
+
+
+def _write(cache_file, data):
+    """Atomically replace cache file, `mkstemp` creates file with 0600 mode."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_file), prefix=".token_cache")
+    with os.fdopen(fd, "w") as file:
+        json.dump(data, file)
+
+    os.replace(tmp_path, cache_file)
+
+
+def _update(cache_file, counter, cache_id=None, token=None):
+    """Increase hourly counter and optionally store new token."""
+    now = time.time()
+    hour = datetime.datetime.fromtimestamp(now).strftime("%Y-%m-%dT%H:00")
+    with _locked(cache_file, fcntl.LOCK_EX):
+        data = _read(cache_file)
+        tokens = {
+            id_: cached
+            for id_, cached in data.get("tokens", {}).items()
+            if cached["expires_at"] > now
+        }
+        if token is not None:
+            tokens[cache_id] = token
+
+        stats = data.get("stats", {})
+        hour_stats = stats.setdefault(hour, {"auth_requests": 0, "cache_hits": 0})
+        hour_stats[counter] += 1
+        stats = dict(sorted(stats.items())[-STATS_HOURS:])
+        _write(cache_file, {"tokens": tokens, "stats": stats})
+
+
+def _restore(auth, cache_file):
+    """Install cached authentication state into auth plugin."""
+    cache_id = auth.get_cache_id()
+    if cache_id is None:
+        return
+
+    with _locked(cache_file, fcntl.LOCK_SH):
+        cached = _read(cache_file).get("tokens", {}).get(cache_id)
+
+    if cached is None or cached["expires_at"] - time.time() < EXPIRY_MARGIN:
+        return
+
+    auth.set_auth_state(cached["state"])
+    _update(cache_file, "cache_hits")
+    LOG.debug("using cached token valid until %s", cached["expires_at"])
+
+
+def _store(auth, cache_file):
+    """Store authentication state of auth plugin."""
+    cache_id = auth.get_cache_id()
+    if cache_id is None or auth.auth_ref.expires is None:
+        return
+
+    token = {"state": auth.get_auth_state(), "expires_at": auth.auth_ref.expires.timestamp()}
+    _update(cache_file, "auth_requests", cache_id, token)
+
+
+def attach_token_cache(client, cache_file=CACHE_FILE):
+    """Make the client use and update the shared token cache.
+
+    The cache is consulted once, when the client needs a token for the first time.
+    Every new authentication made by the client is stored in the cache. Any error
+    with the cache file only disables the cache.
+
+    :param client: OpenStack connection or keystoneauth adapter
+    :type client: Union[openstack.connection.Connection, keystoneauth1.adapter.Adapter]
+    :param cache_file: path to token cache
+    :type cache_file: str
+    :returns: the same client
+    """
+    auth = client.session.auth
+    if getattr(auth, "_token_cache_file", None) is not None:
+        return client  # already attached, e.g. session reused by osc-checkd
+
+    get_access = auth.get_access
+    restored = False
+
+    def _get_access(session, **kwargs):
+        nonlocal restored
+        if auth.auth_ref is None and not restored:
+            # restore only once, so a revoked token is not loaded again
+            restored = True
+            try:
+                _restore(auth, cache_file)
+            except (OSError, ValueError, KeyError) as error:
+                LOG.debug("token cache %s could not be used: %s", cache_file, error)
+
+        auth_ref = auth.auth_ref
+        access = get_access(session, **kwargs)
+        if access is not auth_ref:
+            try:
+                _store(auth, cache_file)
+            except (OSError, ValueError, KeyError) as error:
+                LOG.debug("token cache %s could not be updated: %s", cache_file, error)
+
+        return access
+
+    auth.get_access = _get_access
+    auth._token_cache_file = cache_file
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show Keystone token cache counters")
+    parser.add_argument("--cache-file", default=CACHE_FILE, help="token cache file")
+    args = parser.parse_args()
+
+    with _locked(args.cache_file, fcntl.LOCK_SH):
+        data = _read(args.cache_file)
+
+    print("{:<17} {:>13} {:>10}".format("hour", "auth_requests", "cache_hits"))
+    for hour, stats in sorted(data.get("stats", {}).items()):
+        print("{:<17} {:>13} {:>10}".format(hour, stats["auth_requests"], stats["cache_hits"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,34 @@
 """Detect VM allocation discrepancies between Nova and Placement services."""
 
 import argparse
+import datetime
 import json
+import logging
 import os
 import re
-import subprocess
-from collections import defaultdict, namedtuple
+import resource
+import sys
+import tempfile
+import time
+import uuid
+from collections import namedtuple
 
 import openstack
 import os_client_config
+from osc_api_stats import attach_api_stats
+from osc_cron import exclusive_run, record_run
+from osc_metrics import report
+from osc_novarc import set_openstack_credentials
+from osc_output import BudgetedOutput
+from osc_placement import (
+    PLACEMENT_RETRIES,
+    PLACEMENT_TIMEOUT,
+    PLACEMENT_WORKERS,
+    get_allocations,
+    get_resource_providers,
+)
+from osc_snapshot import MAX_AGE, SnapshotError, load_snapshot
+from osc_token_cache import attach_token_cache
 
 NAGIOS_STATUS_OK = 0
 NAGIOS_STATUS_WARNING = 1
@@ -25,81 +45,361 @@ NAGIOS_STATUS = {
 
 DEFAULT_IGNORED = r""
 
-ALLOCATIONS_PATH = "/resource_providers/{}/allocations"
+CACHE_VERSION = 2
+# default seconds between full synchronizations of the incremental mode
+FULL_SYNC_INTERVAL = 3600
+# seconds subtracted from the time of the last synchronization, so servers changed
+# while it was listing or by a host with skewed clock are not missed
+CHANGES_SINCE_MARGIN = 60
 
 OUTPUT_FILE = "/var/lib/nagios/allocations.out"
+# held by the run in progress, starts overlapping it are skipped
+LOCK_FILE = "/var/lib/nagios/allocations.lock"
+# recent runs and skipped starts, the charm derives the interval of the job from them
+RUNS_FILE = "/var/lib/nagios/allocations.runs"
+# default minutes between the starts of the job by cron
+INTERVAL = 5
 
 Alarm = namedtuple("Alarm", "lvl, desc")
+LOG = logging.getLogger(__name__)
 
 
 def get_nova_instances(connection):
-    """Return UUIDs of instances assigned to nova hypervisor."""
-    compute = connection.compute
-    instances = []
-    for vm in compute.servers(details=True, all_projects=True):
-        instances.append(vm)
-    return instances
+    """Generate instances listed from Nova, only one page of them is kept in memory."""
+    return connection.compute.servers(details=True, all_projects=True)
 
 
-def get_resource_providers(placement_client):
-    resp = placement_client.get("/resource_providers")
-    resp_json = json.loads(resp.content)["resource_providers"]
-    resource_providers = []
-    for rp in resp_json:
-        resource_providers.append({"name": rp["name"], "uuid": rp["uuid"]})
-    return resource_providers
+def _uuid_key(id_):
+    try:
+        return uuid.UUID(id_).bytes
+    except ValueError:
+        # keep IDs which are not UUIDs as they are
+        return id_
 
 
-def get_placement_instances(placement_client, rp_uuid):
-    """Return UUIDs of instances that have allocations against host in Placement."""
-    resp = placement_client.get(ALLOCATIONS_PATH.format(rp_uuid))
-    resp_json = json.loads(resp.content)
-    instances = set(list(resp_json["allocations"].keys()))
-    return instances
+def _uuid_str(key):
+    return str(uuid.UUID(bytes=key)) if isinstance(key, bytes) else key
+
+
+def _cache_key(key):
+    # hex of the UUID bytes is parsed back by `_uuid_key`
+    return key.hex() if isinstance(key, bytes) else key
 
 
-def get_instances(connection, placement_client):
-    """Generate mapping of instances to hosts in Nova and Placement APIs."""
-    nova_instances = {}
-    placement_instances = {}
+class InstanceHosts:
+    """Compact mapping of instances to their hosts in Nova and Placement.
 
-    instances = defaultdict(dict)
+    Host names are interned and stored once, instances are keyed by the 16 bytes of
+    their UUID and point to the index of their host on each side. An instance with
+    allocations against several hosts points to a tuple of indexes.
+    """
+
+    def __init__(self):
+        """Initialize of InstanceHosts."""
+        self.hosts = []
+        self._host_index = {}
+        self.nova = {}
+        self.placement = {}
+
+    def _index(self, host):
+        index = self._host_index.get(host)
+        if index is None:
+            index = self._host_index[host] = len(self.hosts)
+            self.hosts.append(sys.intern(host))
+
+        return index
+
+    def _names(self, indexes):
+        if indexes is None:
+            return set()
+        if isinstance(indexes, int):
+            return {self.hosts[indexes]}
+
+        return {self.hosts[index] for index in indexes}
+
+    def add_nova(self, uuid_, host):
+        """Record host of instance in Nova."""
+        self.nova[_uuid_key(uuid_)] = self._index(host)
+
+    def add_placement(self, uuid_, host):
+        """Record host with allocations of instance in Placement."""
+        key, index = _uuid_key(uuid_), self._index(host)
+        current = self.placement.get(key)
+        if current is None:
+            self.placement[key] = index
+        elif isinstance(current, int):
+            if current != index:
+                self.placement[key] = (current, index)
+        elif index not in current:
+            self.placement[key] = current + (index,)
+
+    def remove_nova(self, uuid_):
+        """Forget instance in Nova and return its host, None if it was not known."""
+        index = self.nova.pop(_uuid_key(uuid_), None)
+        return None if index is None else self.hosts[index]
+
+    def remove_placement(self, hosts):
+        """Forget all allocations against the hosts in Placement."""
+        removed = {self._host_index[host] for host in hosts if host in self._host_index}
+        if not removed:
+            return
+
+        for key, current in list(self.placement.items()):
+            if isinstance(current, int):
+                if current in removed:
+                    del self.placement[key]
+                continue
+
+            kept = tuple(index for index in current if index not in removed)
+            if not kept:
+                del self.placement[key]
+            elif len(kept) != len(current):
+                self.placement[key] = kept[0] if len(kept) == 1 else kept
+
+    def to_cache(self):
+        """Get the mapping as JSON serializable data loaded by `from_cache`."""
+        return {
+            "hosts": self.hosts,
+            "nova": {_cache_key(key): index for key, index in self.nova.items()},
+            "placement": {_cache_key(key): index for key, index in self.placement.items()},
+        }
+
+    @classmethod
+    def from_cache(cls, data):
+        """Load the mapping from data of `to_cache` without resolving the hosts again."""
+        instances = cls()
+        instances.hosts = [sys.intern(host) for host in data["hosts"]]
+        instances._host_index = {host: index for index, host in enumerate(instances.hosts)}
+        instances.nova = {_uuid_key(key): index for key, index in data["nova"].items()}
+        instances.placement = {
+            _uuid_key(key): index if isinstance(index, int) else tuple(index)
+            for key, index in data["placement"].items()
+        }
+        return instances
+
+    def keys(self):
+        """Generate UUIDs of instances known to Nova or Placement."""
+        for key in self.nova:
+            yield _uuid_str(key)
+        for key in self.placement:
+            if key not in self.nova:
+                yield _uuid_str(key)
+
+    def __len__(self):
+        """Get number of instances known to Nova or Placement."""
+        return len(self.nova) + sum(1 for key in self.placement if key not in self.nova)
+
+    def __getitem__(self, uuid_):
+        """Get hosts of instance, e.g. {"nova": {"host-0"}, "placement": {"host-1"}}."""
+        key = _uuid_key(uuid_)
+        if key not in self.nova and key not in self.placement:
+            raise KeyError(uuid_)
+
+        mapping = {}
+        if key in self.nova:
+            mapping["nova"] = self._names(self.nova[key])
+        if key in self.placement:
+            mapping["placement"] = self._names(self.placement[key])
+
+        return mapping
+
+    def mismatches(self):
+        """Generate instances with different hosts in Nova and Placement.
+
+        :returns: instance UUID, hosts in Placement and hosts in Nova, which are
+                  empty if the instance is missing in Nova
+        :rtype: Iterator[Tuple[str, Set[str], Set[str]]]
+        """
+        for key, index in self.nova.items():
+            indexes = self.placement.get(key)
+            if indexes != index:
+                yield _uuid_str(key), self._names(indexes), {self.hosts[index]}
+
+        for key, indexes in self.placement.items():
+            if key not in self.nova:
+                yield _uuid_str(key), self._names(indexes), set()
+
+
+def get_instances(connection, placement_client, resource_providers=None, **kwargs):
+    """Generate mapping of instances to hosts in Nova and Placement APIs.
+
+    The servers are evaluated as they are listed and the allocations as they are
+    received, so only the compact mapping is kept for all instances.
+
+    :param resource_providers: resource providers with name and uuid, listed from
+                               Placement if not provided
+    :type resource_providers: Optional[List[Dict[str, str]]]
+    :param kwargs: options of getting the allocations, see `get_allocations`
+    :rtype: InstanceHosts
+    """
+    instances = InstanceHosts()
 
     # get assigned compute hosts from nova
-    nova_instances = get_nova_instances(connection)
-    for vm in nova_instances:
+    for vm in get_nova_instances(connection):
         if vm.compute_host is not None:
-            if "nova" not in instances[vm.id]:
-                instances[vm.id]["nova"] = set()
-            instances[vm.id]["nova"].add(vm.compute_host)
+            instances.add_nova(vm.id, vm.compute_host)
 
     # get allocation data from placement
+    if resource_providers is None:
+        resource_providers = get_resource_providers(placement_client)
+    for name, rp_instances in get_allocations(placement_client, resource_providers, **kwargs):
+        for uuid_ in rp_instances:
+            instances.add_placement(uuid_, name)
+
+    return instances
+
+
+def load_cache(path):
+    """Load cache of the last synchronization, None if it cannot be used.
+
+    The instances are loaded straight into `InstanceHosts`.
+    """
+    try:
+        with open(path, "r") as file:
+            cache = json.load(file)
+    except (OSError, ValueError) as error:
+        LOG.info("allocation cache %s is not used: %s", path, error)
+        return None
+
+    if not isinstance(cache, dict) or cache.get("version") != CACHE_VERSION:
+        LOG.info("allocation cache %s has different version", path)
+        return None
+
+    try:
+        cache["instances"] = InstanceHosts.from_cache(cache["instances"])
+    except (KeyError, TypeError, ValueError, AttributeError) as error:
+        LOG.info("allocation cache %s is not used: %s", path, error)
+        return None
+
+    return cache
+
+
+def save_cache(cache, path):
+    """Atomically replace the cache of the last synchronization."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".allocations_cache")
+    try:
+        with os.fdopen(fd, "w") as file:
+            json.dump(dict(cache, instances=cache["instances"].to_cache()), file)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def _sync_full(connection, placement_client, now, **kwargs):
     resource_providers = get_resource_providers(placement_client)
-    for rp in resource_providers:
-        placement_instances[rp["name"]] = get_placement_instances(placement_client, rp["uuid"])
+    instances = get_instances(connection, placement_client, resource_providers, **kwargs)
+    return {
+        "version": CACHE_VERSION,
+        "synced_at": now,
+        "full_sync_at": now,
+        "resource_providers": {rp["name"]: rp["uuid"] for rp in resource_providers},
+        "instances": instances,
+    }
 
-        for uuid in placement_instances[rp["name"]]:
-            if "placement" not in instances[uuid]:
-                instances[uuid]["placement"] = set()
-            instances[uuid]["placement"].add(rp["name"])
 
-    return instances
+def _sync_changes(connection, placement_client, cache, now, **kwargs):
+    """Update the cache with servers changed since the last synchronization.
 
+    :returns: number of changed servers
+    :rtype: int
+    """
+    since = datetime.datetime.fromtimestamp(
+        cache["synced_at"] - CHANGES_SINCE_MARGIN, datetime.timezone.utc
+    )
+    changed = connection.compute.servers(
+        details=True, all_projects=True, changes_since=since.strftime("%Y-%m-%dT%H:%M:%SZ")
+    )
 
-def check_allocations(connection, placement_client):
+    # hosts the changed servers were moved from or to
+    instances, touched, count = cache["instances"], set(), 0
+    for vm in changed:
+        count += 1
+        touched.add(instances.remove_nova(vm.id))
+        # deleted servers are listed too when filtered by changes-since
+        if vm.status != "DELETED" and vm.compute_host is not None:
+            instances.add_nova(vm.id, vm.compute_host)
+            touched.add(vm.compute_host)
+    touched.discard(None)
+
+    removed = set()
+    if not touched.issubset(cache["resource_providers"]):
+        resource_providers = get_resource_providers(placement_client)
+        removed = set(cache["resource_providers"])
+        cache["resource_providers"] = {rp["name"]: rp["uuid"] for rp in resource_providers}
+        removed.difference_update(cache["resource_providers"])
+
+    resource_providers = [
+        {"name": name, "uuid": cache["resource_providers"][name]}
+        for name in sorted(touched.intersection(cache["resource_providers"]))
+    ]
+    # allocations of the requested hosts are replaced, the removed ones are dropped
+    instances.remove_placement(removed.union(rp["name"] for rp in resource_providers))
+    for name, uuids in get_allocations(placement_client, resource_providers, **kwargs):
+        for uuid_ in uuids:
+            instances.add_placement(uuid_, name)
+
+    cache["synced_at"] = now
+    return count
+
+
+def get_instances_incremental(
+    connection,
+    placement_client,
+    cache_file,
+    full_sync_interval=FULL_SYNC_INTERVAL,
+    stats=None,
+    **kwargs
+):
+    """Generate mapping of instances to hosts from the cache of the previous run.
+
+    Only servers changed since the previous run are listed from Nova and only the
+    allocations of resource providers hosting them before or after the change are
+    requested from Placement. All servers and allocations are synchronized again
+    once in `full_sync_interval` seconds, e.g. to find allocations left behind
+    without any change of the server.
+
+    :param cache_file: path to cache of the last synchronization
+    :type cache_file: str
+    :param full_sync_interval: seconds between full synchronizations
+    :type full_sync_interval: int
+    :param stats: filled with type of synchronization, number of changed servers and
+                  time of getting allocations
+    :type stats: Optional[Dict[str, Any]]
+    :param kwargs: options of getting the allocations, see `get_allocations`
+    """
+    stats = {} if stats is None else stats
+    now = time.time()
+    cache = load_cache(cache_file)
+    if cache is None or now - cache["full_sync_at"] >= full_sync_interval:
+        cache = _sync_full(connection, placement_client, now, stats=stats, **kwargs)
+        stats["sync"] = "full"
+    else:
+        changed = _sync_changes(connection, placement_client, cache, now, stats=stats, **kwargs)
+        stats.update(sync="incremental", changed_servers=changed)
+
+    save_cache(cache, cache_file)
+    return cache["instances"]
+
+
+def check_allocations(connection, placement_client, cache_file=None, **kwargs):
     """Detect inconsistencies between Nova and Placement APIs.
 
     Collect data about OpenStack instances host assignment and report any
     inconsistencies between Nova and Placement APIs.
+
+    :param cache_file: path to cache of the previous run, see `get_instances_incremental`
+    :type cache_file: Optional[str]
+    :param kwargs: options of getting the instances, see `get_instances`
     """
-    instances = get_instances(connection, placement_client)
+    if cache_file:
+        instances = get_instances_incremental(connection, placement_client, cache_file, **kwargs)
+    else:
+        instances = get_instances(connection, placement_client, **kwargs)
 
     alerts = []
 
-    for uuid, mapping in instances.items():
-        nova_hosts = mapping.get("nova", set())
-        placement_hosts = mapping.get("placement", set())
-
+    for uuid_, placement_hosts, nova_hosts in instances.mismatches():
         if len(nova_hosts) == 0:
             # NOTE: In this scenario there are leftover entries in placement that need
             # to be cleaned up.
@@ -107,7 +407,7 @@ def check_allocations(connection, placement_client):
                 (
                     NAGIOS_STATUS_WARNING,
                     "instance {} is missing in nova: placement host: {}, "
-                    "clean up in placement".format(uuid, sorted(list(placement_hosts))),
+                    "clean up in placement".format(uuid_, sorted(list(placement_hosts))),
                 )
             )
         elif nova_hosts != placement_hosts:
@@ -118,7 +418,7 @@ def check_allocations(connection, placement_client):
                     NAGIOS_STATUS_WARNING,
                     "instance {} is incorrect in placement: placement host: {}, "
                     "nova host: {}".format(
-                        uuid, sorted(list(placement_hosts)), sorted(list(nova_hosts))
+                        uuid_, sorted(list(placement_hosts)), sorted(list(nova_hosts))
                     ),
                 )
             )
@@ -152,7 +452,11 @@ def filter_checks(alarms, ignored=DEFAULT_IGNORED):
     msg = "total_alarms[{}], total_crit[{}], total_ignored[{}], " "ignoring r'{}'\n".format(
         len(full), total_crit, len(ignoring), ignored
     )
-    msg += "\n".join(_.desc for _ in sorted(important))
+    output = BudgetedOutput()
+    for alarm in important:
+        output.add(alarm.lvl, alarm.desc)
+    output.reserve(len("{}: {}".format(NAGIOS_STATUS[status], msg).encode("utf-8")))
+    msg += "\n".join(output.lines(reverse=False))
     return status, msg
 
 
@@ -168,15 +472,68 @@ def nagios_exit(args, results):
     return status, output
 
 
-def save_status(status, message):
+def save_status(status, message, placement=None, run=None):
     saved_state = {
         "status": status,
         "message": message,
+        # peak memory of the cron job in kB, ru_maxrss is in kilobytes on Linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
     }
+    if placement:
+        # time of getting the allocations, e.g. to tune --placement-workers
+        saved_state["placement"] = placement
+    if run:
+        # interval and duration of the run, check_allocations.py derives the maximum
+        # age of the status from them
+        saved_state["run"] = run
     with open(OUTPUT_FILE, "w") as fd:
         fd.write("{}\n".format(json.dumps(saved_state)))
 
 
+def run_check(args):
+    """Check allocations once.
+
+    :returns: status, message and time of getting the allocations
+    :rtype: Tuple[int, str, Dict[str, Any]]
+    """
+    placement = {}
+    if args.snapshot:
+        try:
+            snapshot = load_snapshot(args.snapshot, args.snapshot_max_age)
+            alerts = check_allocations(snapshot, snapshot.placement)
+        except SnapshotError as error:
+            status = NAGIOS_STATUS_UNKNOWN
+            message = "{}: {}".format(NAGIOS_STATUS[status], error)
+            return status, report("allocations", message, status), placement
+    else:
+        # grab environment vars
+        set_openstack_credentials(args.env)
+
+        connection = attach_api_stats(attach_token_cache(openstack.connect(cloud="envvars")))
+        placement_client = attach_api_stats(
+            attach_token_cache(os_client_config.make_rest_client("placement", cloud="envvars"))
+        )
+        kwargs = {}
+        if args.cache:
+            kwargs.update(cache_file=args.cache, full_sync_interval=args.full_sync_interval)
+        alerts = check_allocations(
+            connection,
+            placement_client,
+            workers=args.placement_workers,
+            timeout=args.placement_timeout,
+            retries=args.placement_retries,
+            stats=placement,
+            **kwargs,
+        )
+
+    status, message = nagios_exit(args, alerts)
+    perfdata = {}
+    if placement:
+        perfdata["placement_time"] = "{:.3f}s".format(placement["placement_time"])
+    message = report("allocations", message, status, {"mismatch": len(alerts)}, perfdata)
+    return status, message, placement
+
+
 def main():
     parser = argparse.ArgumentParser(description="Check allocations in Nova and Placement")
     parser.add_argument(
@@ -191,22 +548,77 @@ def main():
         default="",
         help="Comma separated UUIDs of ignored instances",
     )
+    parser.add_argument(
+        "--snapshot",
+        dest="snapshot",
+        help="evaluate inventory snapshot instead of listing instances from the APIs",
+    )
+    parser.add_argument(
+        "--snapshot-max-age",
+        dest="snapshot_max_age",
+        type=int,
+        default=MAX_AGE,
+        help="UNKNOWN if the snapshot is older than this number of seconds",
+    )
+    parser.add_argument(
+        "--placement-workers",
+        dest="placement_workers",
+        type=int,
+        default=PLACEMENT_WORKERS,
+        help="number of concurrent requests getting allocations of resource providers",
+    )
+    parser.add_argument(
+        "--placement-timeout",
+        dest="placement_timeout",
+        type=float,
+        default=PLACEMENT_TIMEOUT,
+        help="timeout of one request getting allocations in seconds",
+    )
+    parser.add_argument(
+        "--placement-retries",
+        dest="placement_retries",
+        type=int,
+        default=PLACEMENT_RETRIES,
+        help="number of retries of failed request getting allocations",
+    )
+    parser.add_argument(
+        "--cache",
+        dest="cache",
+        help="list only servers changed since the previous run recorded in this file and "
+        "allocations of their hosts",
+    )
+    parser.add_argument(
+        "--full-sync-interval",
+        dest="full_sync_interval",
+        type=int,
+        default=FULL_SYNC_INTERVAL,
+        help="seconds between listing all servers and allocations with --cache",
+    )
+    parser.add_argument(
+        "--interval",
+        dest="interval",
+        type=int,
+        default=INTERVAL,
+        help="minutes between the starts of this job, recorded for the freshness check",
+    )
     args = parser.parse_args()
 
-    # grab environment vars
-    command = ["/bin/bash", "-c", "source {} && env".format(args.env)]
-    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-    for line in proc.stdout:
-        (key, _, value) = line.partition(b"=")
-        os.environ[key.decode("utf-8")] = value.rstrip().decode("utf-8")
-    proc.communicate()
-
-    connection = openstack.connect(cloud="envvars")
-    placement_client = os_client_config.make_rest_client("placement", cloud="envvars")
-
-    alerts = check_allocations(connection, placement_client)
-    status, message = nagios_exit(args, alerts)
-    save_status(status, message)
+    start = time.time()
+    with exclusive_run(LOCK_FILE) as acquired:
+        if not acquired:
+            # the previous run is still in progress, e.g. listing a large cloud
+            record_run(RUNS_FILE, skipped=start)
+            return
+
+        status, message, placement = run_check(args)
+        duration = round(time.time() - start, 3)
+        runs = record_run(RUNS_FILE, run={"start": start, "duration": duration})
+        run = {
+            "interval": args.interval * 60,
+            "duration": duration,
+            "skipped_starts": sum(1 for skipped in runs["skipped"] if skipped >= start),
+        }
+        save_status(status, message, placement, run)
 
 
 if __name__ == "__main__":
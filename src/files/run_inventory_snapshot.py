@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""Collect cloud inventory snapshot used by the list-heavy checks.
+
+Every collection is listed once (one paginated pass) and the snapshot is replaced
+atomically, so the API load does not grow with the number of checks evaluating it.
+Only the attributes read by the checks are stored, Neutron lists only these fields.
+The allocations are requested concurrently like in the allocations check. A start
+is skipped while the previous run is still in progress, the charm derives the
+interval of the job from the duration of the recent runs.
+"""
+
+import argparse
+import logging
+import time
+
+import openstack
+import os_client_config
+from osc_api_stats import attach_api_stats
+from osc_cron import exclusive_run, record_run
+from osc_novarc import set_openstack_credentials
+from osc_placement import PLACEMENT_WORKERS, get_allocations, get_resource_providers
+from osc_snapshot import SNAPSHOT_FILE, write_snapshot
+from osc_token_cache import attach_token_cache
+
+# held by the run in progress, starts overlapping it are skipped
+LOCK_FILE = "/var/lib/nagios/inventory_snapshot.lock"
+# recent runs and skipped starts, the charm derives the interval of the job from them
+RUNS_FILE = "/var/lib/nagios/inventory_snapshot.runs"
+# attributes of resources read by the checks evaluating the snapshot, including the
+# `--select` filters of check_resources, other attributes are not stored
+FIELDS = {
+    "networks": ["id", "name", "project_id", "status"],
+    "floating_ips": [
+        "id",
+        "status",
+        "fixed_ip_address",
+        "floating_ip_address",
+        "floating_network_id",
+        "port_id",
+        "project_id",
+        "router_id",
+        "subnet_id",
+    ],
+    "ports": [
+        "id",
+        "name",
+        "status",
+        "allowed_address_pairs",
+        "binding_host_id",
+        "binding_profile",
+        "binding_vif_type",
+        "binding_vnic_type",
+        "device_id",
+        "device_owner",
+        "fixed_ips",
+        "is_port_security_enabled",
+        "mac_address",
+        "network_id",
+        "project_id",
+        "security_group_ids",
+    ],
+    "security_groups": ["id", "name", "project_id"],
+    "subnets": ["id", "name", "network_id", "project_id"],
+    "servers": ["id", "name", "status", "compute_host", "power_state", "project_id"],
+    "load_balancers": [
+        "id",
+        "name",
+        "is_admin_state_up",
+        "operating_status",
+        "provisioning_status",
+        "vip_port_id",
+    ],
+    "pools": [
+        "id",
+        "name",
+        "health_monitor_id",
+        "is_admin_state_up",
+        "loadbalancers",
+        "operating_status",
+        "provisioning_status",
+    ],
+}
+# Neutron field names of attributes named differently by openstacksdk
+NEUTRON_NAMES = {
+    "binding_host_id": "binding:host_id",
+    "binding_profile": "binding:profile",
+    "binding_vif_type": "binding:vif_type",
+    "binding_vnic_type": "binding:vnic_type",
+    "is_port_security_enabled": "port_security_enabled",
+    "security_group_ids": "security_groups",
+}
+LOG = logging.getLogger(__name__)
+
+
+def _fields(name):
+    """Get Neutron fields listed for collection."""
+    return [NEUTRON_NAMES.get(attribute, attribute) for attribute in FIELDS[name]]
+
+
+def _list(resources, name):
+    """Get stored attributes of listed resources, attributes which are None are omitted."""
+    items = []
+    for resource in resources:
+        data = resource.to_dict(computed=False)
+        items.append(
+            {
+                attribute: data[attribute]
+                for attribute in FIELDS[name]
+                if data.get(attribute) is not None
+            }
+        )
+
+    return items
+
+
+def get_allocations_by_uuid(placement_client, workers=PLACEMENT_WORKERS):
+    """Get UUIDs of instances with allocations against each resource provider.
+
+    :returns: resource provider UUID -> sorted instance UUIDs
+    :rtype: Dict[str, List[str]]
+    """
+    resource_providers = get_resource_providers(placement_client)
+    uuids = {rp["name"]: rp["uuid"] for rp in resource_providers}
+    return {
+        uuids[name]: sorted(instances)
+        for name, instances in get_allocations(placement_client, resource_providers, workers)
+    }
+
+
+COLLECTIONS = {
+    "networks": lambda conn, placement: _list(
+        conn.network.networks(fields=_fields("networks")), "networks"
+    ),
+    "floating_ips": lambda conn, placement: _list(
+        conn.network.ips(fields=_fields("floating_ips")), "floating_ips"
+    ),
+    "ports": lambda conn, placement: _list(conn.network.ports(fields=_fields("ports")), "ports"),
+    "security_groups": lambda conn, placement: _list(
+        conn.network.security_groups(fields=_fields("security_groups")), "security_groups"
+    ),
+    "subnets": lambda conn, placement: _list(
+        conn.network.subnets(fields=_fields("subnets")), "subnets"
+    ),
+    "servers": lambda conn, placement: _list(
+        conn.compute.servers(details=True, all_projects=True), "servers"
+    ),
+    "load_balancers": lambda conn, placement: _list(
+        conn.load_balancer.load_balancers(), "load_balancers"
+    ),
+    "pools": lambda conn, placement: _list(conn.load_balancer.pools(), "pools"),
+    "resource_providers": lambda conn, placement: get_resource_providers(placement),
+    "allocations": lambda conn, placement: get_allocations_by_uuid(placement),
+}
+PLACEMENT_COLLECTIONS = {"resource_providers", "allocations"}
+
+
+def collect(connection, placement_client, names, placement_workers=PLACEMENT_WORKERS):
+    """List collections and measure API latency of each of them.
+
+    A failed collection is recorded with its error, so only checks evaluating
+    this collection report UNKNOWN.
+    """
+    collectors = dict(COLLECTIONS)
+    collectors["allocations"] = lambda conn, placement: get_allocations_by_uuid(
+        placement, placement_workers
+    )
+    collections = {}
+    for name in names:
+        start = time.monotonic()
+        try:
+            items = collectors[name](connection, placement_client)
+        except Exception as error:
+            LOG.exception("collection %s failed", name)
+            collections[name] = {"error": str(error)}
+        else:
+            collections[name] = {"items": items}
+            if name in FIELDS:
+                collections[name]["fields"] = FIELDS[name]
+
+        collections[name]["latency"] = round(time.monotonic() - start, 3)
+        LOG.info("collection %s listed in %.3fs", name, collections[name]["latency"])
+
+    return collections
+
+
+def run_collector(args):
+    """Collect the snapshot once."""
+    names = args.collections or sorted(COLLECTIONS)
+
+    # grab environment vars
+    set_openstack_credentials(args.env)
+
+    # the collector lists the same collections as the checks, so it is limited too
+    connection = attach_api_stats(attach_token_cache(openstack.connect(cloud="envvars")))
+    placement_client = None
+    if PLACEMENT_COLLECTIONS.intersection(names):
+        placement_client = attach_api_stats(
+            attach_token_cache(os_client_config.make_rest_client("placement", cloud="envvars"))
+        )
+
+    # servers of all projects are listed, the checks scope them like the API does
+    write_snapshot(
+        collect(connection, placement_client, names, args.placement_workers),
+        args.output,
+        project_id=connection.current_project_id,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect cloud inventory snapshot")
+    parser.add_argument(
+        "--env",
+        dest="env",
+        default="/var/lib/nagios/nagios.novarc",
+        help="Novarc file to use for this check",
+    )
+    parser.add_argument(
+        "-o", "--output", dest="output", default=SNAPSHOT_FILE, help="snapshot file path"
+    )
+    parser.add_argument(
+        "-c",
+        "--collection",
+        dest="collections",
+        action="append",
+        choices=sorted(COLLECTIONS),
+        help="collection to list (can be used multiple times), default all",
+    )
+    parser.add_argument(
+        "--placement-workers",
+        dest="placement_workers",
+        type=int,
+        default=PLACEMENT_WORKERS,
+        help="number of concurrent requests getting allocations of resource providers",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="print verbose log")
+    args = parser.parse_args()
+
+    logging.basicConfig(level="INFO" if args.verbose else "WARNING")
+
+    start = time.time()
+    with exclusive_run(LOCK_FILE) as acquired:
+        if not acquired:
+            # the previous run is still in progress, e.g. listing a large cloud
+            LOG.warning("previous run is in progress, this start is skipped")
+            record_run(RUNS_FILE, skipped=start)
+            return
+
+        run_collector(args)
+        record_run(RUNS_FILE, run={"start": start, "duration": round(time.time() - start, 3)})
+
+
+if __name__ == "__main__":
+    main()
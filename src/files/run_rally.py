@@ -9,6 +9,8 @@ import subprocess
 import sys
 import tempfile
 
+from osc_novarc import load_novarc
+
 OUTPUT_FILE = "/home/nagiososc/rally.status"
 HISTORY_FOLDER = "/home/nagiososc/rallystatuses"
 
@@ -32,13 +34,10 @@ def _load_envvars(novarc="/var/lib/nagios/nagios.novarc"):
     if not os.path.exists(novarc):
         return False
 
-    output = subprocess.check_output(["/bin/bash", "-c", "source {} && env".format(novarc)])
     i = 0
-    for line in output.decode("utf-8").splitlines():
-        key = line.split("=")[0]
+    for key, value in load_novarc(novarc).items():
         if not (key.startswith("OS_") or key.count("proxy") > 0 or key.count("PROXY") > 0):
             continue
-        key, value = line.split("=")
         os.environ[key] = value
         i += 1
 
@@ -4,10 +4,13 @@ import base64
 import collections
 import configparser
 import glob
+import json
+import math
 import os
 import pwd
 import re
 import subprocess
+import sys
 from urllib.parse import urlparse
 
 import keystoneauth1
@@ -36,8 +39,72 @@ os.environ["REQUESTS_CA_BUNDLE"] = "/etc/ssl/certs/ca-certificates.crt"
 # files.plugins.check_resources
 RESOURCES_CHECKS_BY_EXISTENCE = ["security-group", "subnet", "network"]
 RESOURCES_CHECKS_WITH_STATUS = ["server", "floating-ip", "port"]
+# inventory snapshot collections evaluated by resource checks,
+# the port check looks up power state of servers with DOWN ports
+RESOURCES_SNAPSHOT_COLLECTIONS = {
+    "security-group": ["security_groups"],
+    "subnet": ["subnets"],
+    "network": ["networks"],
+    "server": ["servers"],
+    "floating-ip": ["floating_ips"],
+    "port": ["ports", "servers"],
+}
 
 CERT_DIR = "/usr/local/share/ca-certificates/"
+# modules from files/plugins imported by the scripts installed into scripts_dir
+SCRIPTS_SHARED_MODULES = [
+    "osc_api_stats.py",
+    "osc_cron.py",
+    "osc_json_stream.py",
+    "osc_lazy.py",
+    "osc_metrics.py",
+    "osc_novarc.py",
+    "osc_output.py",
+    "osc_placement.py",
+    "osc_rate_limit.py",
+    "osc_snapshot.py",
+    "osc_token_cache.py",
+]
+CHARM_PLUGINS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "files", "plugins"
+)
+ALLOCATIONS_CRON_FILE = "/etc/cron.d/osc_allocations"
+# durations of recent runs recorded by run_allocation_checks.py
+ALLOCATIONS_RUNS_FILE = "/var/lib/nagios/allocations.runs"
+ALLOCATIONS_MIN_INTERVAL = 5
+# the derived interval of the allocations job is twice its longest recent run
+ALLOCATIONS_INTERVAL_HEADROOM = 2
+# durations of recent runs recorded by run_inventory_snapshot.py
+INVENTORY_SNAPSHOT_RUNS_FILE = "/var/lib/nagios/inventory_snapshot.runs"
+# intervals in minutes which cron starts evenly
+CRON_INTERVALS = [5, 10, 15, 20, 30, 60, 120, 180, 240, 360, 480, 720, 1440]
+
+
+def _cron_schedule(minutes):
+    """Get cron schedule of starts at least `minutes` apart and its interval in minutes."""
+    interval = next((interval for interval in CRON_INTERVALS if interval >= minutes), 1440)
+    if interval < 60:
+        return "*/{} * * * *".format(interval), interval
+    if interval == 60:
+        return "0 * * * *", interval
+    if interval < 1440:
+        return "0 */{} * * *".format(interval // 60), interval
+
+    return "0 0 * * *", interval
+
+
+def _derived_interval(runs_file):
+    """Get minutes between the starts of cron job derived from its longest recent run."""
+    try:
+        with open(runs_file, "r") as file:
+            durations = [run["duration"] for run in json.load(file)["runs"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        durations = []  # the job did not complete any run yet
+
+    longest = max(durations, default=0)
+    return max(
+        ALLOCATIONS_MIN_INTERVAL, math.ceil(longest * ALLOCATIONS_INTERVAL_HEADROOM / 60)
+    )
 
 
 class OSCCredentialsError(Exception):
@@ -114,6 +181,7 @@ class OSCHelper:
         """Initialize charm configs and null keystone client into Helper object."""
         self.charm_config = hookenv.config()
         self._keystone_client = None
+        self._snapshot_collections = set()
 
     def store_keystone_credentials(self, creds):
         """Store keystone credentials."""
@@ -147,6 +215,141 @@ class OSCHelper:
     def rally_cron_file(self):
         return "/etc/cron.d/osc_rally"
 
+    @property
+    def checks_daemon_service_file(self):
+        return "/etc/systemd/system/osc-checkd.service"
+
+    @property
+    def checks_daemon_socket(self):
+        return "/run/nagios/osc-checkd.sock"
+
+    @property
+    def api_limit_state_dir(self):
+        # must be the same as osc_rate_limit.STATE_DIR
+        return "/var/lib/nagios/osc-api-limit"
+
+    @property
+    def is_checks_daemon_enabled(self):
+        return self.charm_config.get("checks-daemon")
+
+    @property
+    def inventory_snapshot_file(self):
+        return "/var/lib/nagios/inventory_snapshot.json"
+
+    @property
+    def inventory_snapshot_cron_file(self):
+        return "/etc/cron.d/osc_inventory_snapshot"
+
+    @property
+    def is_inventory_snapshot_enabled(self):
+        return self.charm_config.get("inventory-snapshot")
+
+    @property
+    def snapshot_check_args(self):
+        """Arguments of checks which can evaluate the inventory snapshot."""
+        if not self.is_inventory_snapshot_enabled:
+            return ""
+
+        return " --snapshot {} --snapshot-max-age {}".format(
+            self.inventory_snapshot_file, self.charm_config.get("inventory-snapshot-max-age")
+        )
+
+    @property
+    def prometheus_textfile_dir(self):
+        return self.charm_config.get("prometheus-textfile-dir")
+
+    @property
+    def api_rate_limit(self):
+        """Get validated requests per second limits of OpenStack services."""
+        value = (self.charm_config.get("api-rate-limit") or "").replace(" ", "")
+        if CHARM_PLUGINS_DIR not in sys.path:
+            sys.path.append(CHARM_PLUGINS_DIR)
+        from osc_rate_limit import parse_rate_limits
+
+        try:
+            parse_rate_limits(value)
+        except ValueError as error:
+            raise OSCConfigError("api-rate-limit: {}".format(error))
+
+        return value
+
+    @property
+    def resource_check_shards(self):
+        shards = self.charm_config.get("resource-check-shards") or 1
+        if shards < 1:
+            raise OSCConfigError(
+                "resource-check-shards does not support value `{}`".format(shards)
+            )
+        if shards > 1 and not self.is_inventory_snapshot_enabled:
+            # every shard would list the whole collection from the API
+            raise OSCConfigError("resource-check-shards requires inventory-snapshot")
+
+        return shards
+
+    @property
+    def allocations_placement_concurrency(self):
+        concurrency = self.charm_config.get("allocations-placement-concurrency") or 8
+        if concurrency < 1:
+            raise OSCConfigError(
+                "allocations-placement-concurrency does not support value `{}`".format(
+                    concurrency
+                )
+            )
+
+        return concurrency
+
+    @property
+    def allocations_interval(self):
+        """Get minutes between the starts of the allocations job.
+
+        The value 0 derives the interval from the longest of the recent runs.
+        """
+        interval = self.charm_config.get("allocations-interval", ALLOCATIONS_MIN_INTERVAL)
+        if interval < 0:
+            raise OSCConfigError(
+                "allocations-interval does not support value `{}`".format(interval)
+            )
+
+        if interval == 0:
+            interval = _derived_interval(ALLOCATIONS_RUNS_FILE)
+
+        return interval
+
+    @property
+    def inventory_snapshot_interval(self):
+        """Get minutes between the starts of the inventory snapshot job.
+
+        The value 0 derives the interval from the longest of the recent runs.
+        """
+        interval = self.charm_config.get("inventory-snapshot-interval", ALLOCATIONS_MIN_INTERVAL)
+        if interval < 0:
+            raise OSCConfigError(
+                "inventory-snapshot-interval does not support value `{}`".format(interval)
+            )
+
+        if interval == 0:
+            interval = _derived_interval(INVENTORY_SNAPSHOT_RUNS_FILE)
+
+        return interval
+
+    @property
+    def resource_check_max_critical(self):
+        max_critical = self.charm_config.get("resource-check-max-critical") or 0
+        if max_critical < 0:
+            raise OSCConfigError(
+                "resource-check-max-critical does not support value `{}`".format(max_critical)
+            )
+
+        return max_critical
+
+    @property
+    def api_max_concurrency(self):
+        value = self.charm_config.get("api-max-concurrency") or 0
+        if value < 0:
+            raise OSCConfigError("api-max-concurrency does not support value `{}`".format(value))
+
+        return value
+
     @property
     def is_rally_enabled(self):
         return self.charm_config["check-rally"]
@@ -288,6 +491,104 @@ class OSCHelper:
         charm_plugin_dir = os.path.join(hookenv.charm_dir(), "files", "plugins/")
         host.rsync(charm_plugin_dir, self.plugins_dir, options=["--executability"])
 
+    def _install_scripts_shared_modules(self):
+        """Install modules shared with plugins next to the scripts."""
+        for module in SCRIPTS_SHARED_MODULES:
+            module_path = os.path.join(hookenv.charm_dir(), "files", "plugins", module)
+            host.rsync(module_path, self.scripts_dir, options=["--executability"])
+
+    def _remove_checks_daemon(self):
+        if not os.path.exists(self.checks_daemon_service_file):
+            return
+
+        host.service_stop("osc-checkd")
+        host.service("disable", "osc-checkd")
+        os.remove(self.checks_daemon_service_file)
+        subprocess.check_call(["systemctl", "daemon-reload"])
+        hookenv.log("Removed osc-checkd service")
+
+    def _render_checks_daemon(self):
+        """Install the osc-checkd service running python plugins in-process.
+
+        The NRPE commands are not modified, the plugins forward their arguments
+        to the service if its socket exists.
+        """
+        if not self.is_checks_daemon_enabled:
+            self._remove_checks_daemon()
+            return
+
+        daemon_script = os.path.join(hookenv.charm_dir(), "files", "osc_checkd.py")
+        host.rsync(daemon_script, self.scripts_dir, options=["--executability"])
+        render(
+            source="osc-checkd.service",
+            target=self.checks_daemon_service_file,
+            context={
+                "script": os.path.join(self.scripts_dir, "osc_checkd.py"),
+                "plugins_dir": self.plugins_dir,
+                "socket": self.checks_daemon_socket,
+            },
+            perms=0o644,
+        )
+        subprocess.check_call(["systemctl", "daemon-reload"])
+        host.service("enable", "osc-checkd")
+        # restart to load updated plugins and credentials
+        host.service_restart("osc-checkd")
+        hookenv.log("Rendered osc-checkd service")
+
+    def _add_snapshot_collections(self, *collections):
+        """Add collections evaluated by a rendered check to the inventory snapshot."""
+        if self.is_inventory_snapshot_enabled:
+            self._snapshot_collections.update(collections)
+
+    def _render_inventory_snapshot(self):
+        """Install cron job collecting the inventory snapshot.
+
+        Only the collections evaluated by the rendered checks are listed.
+        """
+        if not self.is_inventory_snapshot_enabled or not self._snapshot_collections:
+            try:
+                os.remove(self.inventory_snapshot_cron_file)
+            except OSError:
+                pass
+            return
+
+        cron_script = os.path.join(hookenv.charm_dir(), "files", "run_inventory_snapshot.py")
+        host.rsync(cron_script, self.scripts_dir, options=["--executability"])
+        self._install_scripts_shared_modules()
+
+        cron_cmd = "{} --output {}".format(
+            os.path.join(self.scripts_dir, "run_inventory_snapshot.py"),
+            self.inventory_snapshot_file,
+        )
+        cron_cmd += "".join(
+            " --collection {}".format(collection)
+            for collection in sorted(self._snapshot_collections)
+        )
+        if "allocations" in self._snapshot_collections:
+            cron_cmd += " --placement-workers {}".format(self.allocations_placement_concurrency)
+        self._write_inventory_snapshot_cron(cron_cmd)
+
+    def _write_inventory_snapshot_cron(self, cron_cmd):
+        schedule, _ = _cron_schedule(self.inventory_snapshot_interval)
+        cron_line = "{} nagios {}".format(schedule, cron_cmd)
+        with open(self.inventory_snapshot_cron_file, "w") as fd:
+            fd.write("# Juju generated - DO NOT EDIT\n{}\n\n".format(cron_line))
+        hookenv.log("Rendered inventory snapshot cron job: {}".format(cron_line))
+
+    def update_inventory_snapshot_schedule(self):
+        """Adjust the interval of the inventory snapshot job to the duration of its runs."""
+        if self.charm_config.get("inventory-snapshot-interval") != 0:
+            return
+
+        try:
+            with open(self.inventory_snapshot_cron_file, "r") as fd:
+                cron_line = fd.read().splitlines()[1]
+        except (OSError, IndexError):
+            return  # the inventory snapshot is not enabled
+
+        # the command follows the 5 fields of the schedule and the user
+        self._write_inventory_snapshot_cron(cron_line.split(None, 6)[6])
+
     def _render_nova_checks(self, nrpe):
         """Nova services health."""
         nova_check_command = os.path.join(self.plugins_dir, "check_nova_services.py")
@@ -330,6 +631,8 @@ class OSCHelper:
             # cron job must run as frequent as possible, which is 1 min
             # max age depends on cron interval, make it slightly bigger than 1 min
             cron_cmd = "{} --auto-remediation --max-age 90".format(check_script)
+            cron_cmd += self.snapshot_check_args
+            self._add_snapshot_collections("ports")
             email_recipients = self.charm_config["email_recipients"]
             if email_recipients:
                 cron_cmd += " --email-recipients {}".format(email_recipients)
@@ -400,6 +703,10 @@ class OSCHelper:
             if check == "image":
                 check_cmd += " --amp-image-tag {}".format(self.octavia_amp_image_tag)
                 check_cmd += " --amp-image-days {}".format(self.octavia_amp_image_days)
+            else:
+                # vip ports of loadbalancers are looked up in the snapshot as well
+                check_cmd += self.snapshot_check_args
+                self._add_snapshot_collections("load_balancers", "pools", "ports")
             ignore = self.charm_config.get("octavia-%s-ignored" % check)
             if ignore:
                 check_cmd += " --ignored {}".format(ignore)
@@ -481,7 +788,7 @@ class OSCHelper:
     def _render_allocation_checks(self, nrpe):
         shortname = "allocations"
         check_script = os.path.join(self.plugins_dir, "check_allocations.py")
-        cron_file = "/etc/cron.d/osc_{}".format(shortname)
+        cron_file = ALLOCATIONS_CRON_FILE
 
         distrib_release = host.lsb_release()["DISTRIB_RELEASE"]
         if distrib_release < "20.04":
@@ -511,23 +818,47 @@ class OSCHelper:
         # NOTE: the actual check runs in cron to prevent NRPE timeouts on larger clouds
         cron_script = os.path.join(hookenv.charm_dir(), "files", "run_allocation_checks.py")
         host.rsync(cron_script, self.scripts_dir, options=["--executability"])
+        self._install_scripts_shared_modules()
+        self._add_snapshot_collections("servers", "resource_providers", "allocations")
+        self._write_allocation_checks_cron(self._allocation_checks_cron_cmd())
 
+    def _allocation_checks_cron_cmd(self):
         cron_cmd = os.path.join(self.scripts_dir, "run_allocation_checks.py")
-
+        cron_cmd += self.snapshot_check_args
+        cron_cmd += " --placement-workers {}".format(self.allocations_placement_concurrency)
+        full_sync_interval = self.charm_config.get("allocations-full-sync-interval")
+        if full_sync_interval and not self.is_inventory_snapshot_enabled:
+            cron_cmd += " --cache /var/lib/nagios/allocations.cache"
+            cron_cmd += " --full-sync-interval {}".format(full_sync_interval)
         ignored = self.charm_config.get("allocations-instances-ignored")
         if ignored:
             cron_cmd += " --ignored {}".format(ignored)
 
-        cron_line = "*/5 * * * * nagios {}".format(cron_cmd)
-        with open(cron_file, "w") as fd:
+        return cron_cmd
+
+    def _write_allocation_checks_cron(self, cron_cmd):
+        schedule, interval = _cron_schedule(self.allocations_interval)
+        # the job records its interval, check_allocations.py derives freshness from it
+        cron_line = "{} nagios {} --interval {}".format(schedule, cron_cmd, interval)
+        with open(ALLOCATIONS_CRON_FILE, "w") as fd:
             fd.write("# Juju generated - DO NOT EDIT\n{}\n\n".format(cron_line))
 
+    def update_allocation_checks_schedule(self):
+        """Adjust the interval of the allocations job to the duration of its runs."""
+        if self.charm_config.get("allocations-interval") != 0:
+            return
+
+        if not os.path.exists(ALLOCATIONS_CRON_FILE):
+            return  # the allocations check is not enabled
+
+        self._write_allocation_checks_cron(self._allocation_checks_cron_cmd())
+
     def _get_resource_ids(self, name):
         """Get list of ids separated by comma from config option."""
         ids = self.charm_config.get(name, "").split(",")
         return [id_.strip() for id_ in ids if id_]
 
-    def _get_resource_check_kwargs(self, resource, ids, skip_ids=None):
+    def _get_resource_check_kwargs(self, resource, ids, skip_ids=None, shard=None):
         """Generate shortname, CMD and description for check.
 
         :param resource: type of resource
@@ -536,26 +867,51 @@ class OSCHelper:
         :type ids: List[str]
         :param skip_ids: list of IDs to be skipped
         :type skip_ids: Optional[List[str]]
+        :param shard: shard index and number of shards checking all resources
+        :type shard: Optional[Tuple[int, int]]
         """
         skip_ids = skip_ids or []
         check_script = os.path.join(self.plugins_dir, "check_resources.py")
         cmd = "{} {}".format(check_script, resource)
+        shortname = "{}s".format(resource.replace("-", "_"))
 
         if "all" in ids:
             cmd += " --all"
             cmd += "".join([" --skip-id {}".format(id_) for id_ in skip_ids])
+            if self.resource_check_max_critical:
+                cmd += " --max-critical {}".format(self.resource_check_max_critical)
         else:
             cmd += "".join([" --id {}".format(id_) for id_ in ids])
+        if shard:
+            cmd += " --shard {}/{}".format(*shard)
+            shortname += "_{}".format(shard[0])
+        cmd += self.snapshot_check_args
+        if self.charm_config.get("resource-check-state"):
+            cmd += " --state-file /var/lib/nagios/check_{}.state".format(shortname)
 
         description = "Check {}s: {}".format(resource, ",".join(ids))
         description += " (skips: {})".format(",".join(skip_ids))
+        if shard:
+            description += " (shard: {}/{})".format(*shard)
 
         return {
-            "shortname": "{}s".format(resource.replace("-", "_")),
+            "shortname": shortname,
             "check_cmd": cmd,
             "description": description,
         }
 
+    def _get_stale_shard_checks(self, resource, shards):
+        """Get shortnames of resource checks rendered with different number of shards."""
+        shortname = "{}s".format(resource.replace("-", "_"))
+        stale = [shortname] if shards > 1 else []
+        pattern = os.path.join(NRPE.nrpe_confdir, "check_{}_*.cfg".format(shortname))
+        for path in glob.glob(pattern):
+            match = re.search(r"_(\d+)\.cfg$", path)
+            if match and (shards == 1 or int(match.group(1)) >= shards):
+                stale.append("{}_{}".format(shortname, match.group(1)))
+
+        return stale
+
     def _render_resource_check_by_existence(self, nrpe, resource):
         """Render NRPE check for OpenStack resource."""
         ids = self._get_resource_ids("check-{}s".format(resource))
@@ -565,25 +921,100 @@ class OSCHelper:
         check_kwargs = self._get_resource_check_kwargs(resource, ids)
         if self.charm_config.get("check-{}s".format(resource)):
             nrpe.add_check(**check_kwargs)
+            self._add_snapshot_collections(*RESOURCES_SNAPSHOT_COLLECTIONS[resource])
             hookenv.log("Added nrpe check {shortname}: {check_cmd}".format(**check_kwargs))
         else:
             nrpe.remove_check(**check_kwargs)
             hookenv.log("Removed nrpe check {shortname}: {check_cmd}".format(**check_kwargs))
 
     def _render_resources_check_by_status(self, nrpe, resource):
-        """Render NRPE check for OpenStack resource."""
+        """Render NRPE check for OpenStack resource.
+
+        Check of all resources is rendered as `resource-check-shards` checks, each
+        of them evaluating a part of the resources.
+        """
         ids = self._get_resource_ids("check-{}s".format(resource))
         skip_ids = self._get_resource_ids("skip-{}s".format(resource))
         if "all" not in ids and skip_ids:
             hookenv.log("skip-{}s will be omitted".format(resource), hookenv.WARNING)
 
-        check_kwargs = self._get_resource_check_kwargs(resource, ids, skip_ids)
-        if self.charm_config.get("check-{}s".format(resource)):
-            nrpe.add_check(**check_kwargs)
-            hookenv.log("Added nrpe check {shortname}: {check_cmd}".format(**check_kwargs))
+        shards = self.resource_check_shards if "all" in ids else 1
+        if shards > 1:
+            checks_kwargs = [
+                self._get_resource_check_kwargs(resource, ids, skip_ids, (index, shards))
+                for index in range(shards)
+            ]
         else:
-            nrpe.remove_check(**check_kwargs)
-            hookenv.log("Removed nrpe check {shortname}: {check_cmd}".format(**check_kwargs))
+            checks_kwargs = [self._get_resource_check_kwargs(resource, ids, skip_ids)]
+
+        for shortname in self._get_stale_shard_checks(resource, shards):
+            nrpe.remove_check(shortname=shortname)
+            hookenv.log("Removed nrpe check {}".format(shortname))
+
+        for check_kwargs in checks_kwargs:
+            if self.charm_config.get("check-{}s".format(resource)):
+                nrpe.add_check(**check_kwargs)
+                self._add_snapshot_collections(*RESOURCES_SNAPSHOT_COLLECTIONS[resource])
+                hookenv.log("Added nrpe check {shortname}: {check_cmd}".format(**check_kwargs))
+            else:
+                nrpe.remove_check(**check_kwargs)
+                hookenv.log("Removed nrpe check {shortname}: {check_cmd}".format(**check_kwargs))
+
+    def _get_resource_spec(self, resource):
+        """Get `type:option[,option...]` specification of resource in combined check.
+
+        :returns: specification or None if the resource is not checked
+        :rtype: Optional[str]
+        """
+        ids = self._get_resource_ids("check-{}s".format(resource))
+        if not ids:
+            return None
+        if "all" not in ids:
+            return "{}:{}".format(resource, ",".join("--id={}".format(id_) for id_ in ids))
+        if resource in RESOURCES_CHECKS_BY_EXISTENCE:
+            raise OSCConfigError("check-{}s does not support value " "`all`".format(resource))
+
+        skip_ids = self._get_resource_ids("skip-{}s".format(resource))
+        options = ["--all", *("--skip-id={}".format(id_) for id_ in skip_ids)]
+        if self.resource_check_max_critical:
+            options.append("--max-critical={}".format(self.resource_check_max_critical))
+        return "{}:{}".format(resource, ",".join(options))
+
+    def _render_resources_combined_check(self, nrpe):
+        """Render one NRPE check of all configured OpenStack resources.
+
+        The resources are checked by one run of check_resources.py with one connection
+        instead of a check per resource type, the checks per resource are removed.
+        """
+        specs = []
+        for resource in RESOURCES_CHECKS_BY_EXISTENCE + RESOURCES_CHECKS_WITH_STATUS:
+            spec = self._get_resource_spec(resource)
+            if spec:
+                specs.append(spec)
+                self._add_snapshot_collections(*RESOURCES_SNAPSHOT_COLLECTIONS[resource])
+
+            shortname = "{}s".format(resource.replace("-", "_"))
+            for stale in [shortname, *self._get_stale_shard_checks(resource, 1)]:
+                nrpe.remove_check(shortname=stale)
+
+        if not specs:
+            nrpe.remove_check(shortname="resources")
+            hookenv.log("Removed nrpe check resources, no resource is checked")
+            return
+
+        check_cmd = "{} {}".format(
+            os.path.join(self.plugins_dir, "check_resources.py"), " ".join(specs)
+        )
+        check_cmd += self.snapshot_check_args
+        if self.charm_config.get("resource-check-state"):
+            check_cmd += " --state-file /var/lib/nagios/check_resources.state"
+
+        nrpe.add_check(
+            shortname="resources",
+            description="Check resources: {}".format(" ".join(specs)),
+            check_cmd=check_cmd,
+        )
+        hookenv.log("Added nrpe check resources: {}".format(check_cmd))
 
     def render_horizon_checks(self, horizon_ip):
         """Render nrpe checks for horizon.
@@ -636,10 +1067,21 @@ class OSCHelper:
         nrpe.write()
 
     def render_checks(self, creds):
+        novarc_context = dict(
+            creds,
+            prometheus_textfile_dir=self.prometheus_textfile_dir,
+            api_rate_limit=self.api_rate_limit,
+            api_max_concurrency=self.api_max_concurrency,
+        )
+        if self.prometheus_textfile_dir and not os.path.isdir(self.prometheus_textfile_dir):
+            host.mkdir(self.prometheus_textfile_dir, owner="nagios", group="nagios", perms=0o755)
+        # state of the limiter of API requests shared by the checks
+        host.mkdir(self.api_limit_state_dir, owner="nagios", group="nagios", perms=0o750)
+
         render(
             source="nagios.novarc",
             target=self.novarc,
-            context=creds,
+            context=novarc_context,
             owner="nagios",
             group="nagios",
         )
@@ -649,6 +1091,8 @@ class OSCHelper:
             os.makedirs(self.plugins_dir)
 
         self.update_plugins()
+        self._render_checks_daemon()
+        self._snapshot_collections = set()
 
         # Initialize the keystone client for property use in render methods
         self.get_keystone_client(creds)
@@ -664,13 +1108,20 @@ class OSCHelper:
         self._render_allocation_checks(nrpe)
         self._render_mysql_innodb_cluster_checks(nrpe)
 
-        # render resource checks that are checked by existence
-        for resource in RESOURCES_CHECKS_BY_EXISTENCE:
-            self._render_resource_check_by_existence(nrpe, resource)
+        if self.charm_config.get("resource-check-combined"):
+            self._render_resources_combined_check(nrpe)
+        else:
+            nrpe.remove_check(shortname="resources")
+            # render resource checks that are checked by existence
+            for resource in RESOURCES_CHECKS_BY_EXISTENCE:
+                self._render_resource_check_by_existence(nrpe, resource)
+
+            # render resource checks that are checked by their status
+            for resource in RESOURCES_CHECKS_WITH_STATUS:
+                self._render_resources_check_by_status(nrpe, resource)
 
-        # render resource checks that are checked by their status
-        for resource in RESOURCES_CHECKS_WITH_STATUS:
-            self._render_resources_check_by_status(nrpe, resource)
+        # collect the snapshot evaluated by checks rendered above
+        self._render_inventory_snapshot()
 
         nrpe.write()
         self.create_endpoint_checks()
@@ -981,16 +1432,16 @@ class OSCHelper:
         if not os.path.exists(novarc):
             return False
 
-        output = subprocess.check_output(["/bin/bash", "-c", "source {} && env".format(novarc)])
-        i = 0
-        for line in output.decode("utf-8").splitlines():
-            if not line.startswith("OS_"):
-                continue
-            key, value = line.split("=")
-            os.environ[key] = value
-            i += 1
+        if CHARM_PLUGINS_DIR not in sys.path:
+            sys.path.append(CHARM_PLUGINS_DIR)
+        from osc_novarc import load_novarc
+
+        envvars = {
+            key: value for key, value in load_novarc(novarc).items() if key.startswith("OS_")
+        }
+        os.environ.update(envvars)
 
-        return i >= 3
+        return len(envvars) >= 3
 
     def _run_as(self, user, user_cmd):
         try:
@@ -1138,6 +1589,7 @@ class OSCHelper:
         # Copy run_rally.sh to /usr/local/bin
         rally_script = os.path.join(hookenv.charm_dir(), "files", "run_rally.py")
         host.rsync(rally_script, self.scripts_dir, options=["--executability"])
+        self._install_scripts_shared_modules()
 
         ostestsfile = os.path.join("/home", self._rallyuser, "ostests.txt")
         render(
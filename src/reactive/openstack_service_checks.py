@@ -290,6 +290,14 @@ def do_reconfigure_nrpe():
             helper.update_rally_checkfiles()
 
 
+@when("openstack-service-checks.configured")
+def update_allocation_checks_schedule():
+    """Adjust the interval of the cron jobs to the duration of their runs."""
+    if hookenv.hook_name() == "update-status":
+        helper.update_allocation_checks_schedule()
+        helper.update_inventory_snapshot_schedule()
+
+
 @when_not("nrpe-external-master.available")
 def missing_nrpe():
     """Set a blocked status if awaiting nrpe relation."""
@@ -0,0 +1,569 @@
+"""Local stand-in for the OpenStack APIs used by the checks.
+
+The server implements the subset of Keystone, Nova, Neutron, Placement, Octavia and
+Glance APIs called by the plugins, over a synthetic inventory of configurable size.
+Resources are generated from their index, so large inventories are cheap to serve,
+and every response can be delayed to emulate API latency. Requests and response
+bytes are counted per service.
+"""
+
+import bisect
+import collections
+import datetime
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+TOKEN = "fake-token"
+REGION = "RegionOne"
+PROJECT = {"id": "project-id", "name": "admin", "domain": {"id": "default", "name": "Default"}}
+USER = {"id": "user-id", "name": "nagios", "domain": {"id": "default", "name": "Default"}}
+# prefix of generated IDs, the index of resource is encoded in the last 12 digits
+ID_PREFIXES = {
+    "servers": 1,
+    "ports": 2,
+    "floatingips": 3,
+    "networks": 4,
+    "subnets": 5,
+    "security_groups": 6,
+    "loadbalancers": 7,
+    "pools": 8,
+    "resource_providers": 9,
+    "images": 10,
+}
+# query parameters filtering the list queries -> filtered attribute
+FILTERS = {
+    "ports": {key: key for key in ("device_owner", "status", "device_id", "network_id")},
+    "floatingips": {"status": "status", "fixed_ip_address": "fixed_ip_address"},
+    "servers": {"status": "status"},
+    "networks": {},
+    "subnets": {},
+    "security_groups": {},
+    "loadbalancers": {},
+    "pools": {"loadbalancer_id": "loadbalancer_id"},
+    "images": {"tag": "tags"},
+}
+# service type -> path prefix of the service
+SERVICES = {
+    "identity": "/identity",
+    "compute": "/compute",
+    "network": "/network",
+    "placement": "/placement",
+    "load-balancer": "/load-balancer",
+    "image": "/image",
+}
+
+
+def make_id(collection, index):
+    return "{:08x}-0000-4000-8000-{:012x}".format(ID_PREFIXES[collection], index)
+
+
+def parse_id(collection, id_):
+    if not re.match(
+        r"^{:08x}-0000-4000-8000-[0-9a-f]{{12}}$".format(ID_PREFIXES[collection]), id_
+    ):
+        return None
+    return int(id_[-12:], 16)
+
+
+class Inventory:
+    """Synthetic cloud inventory.
+
+    For `size` instances there is a port for each instance, a floating IP for every
+    10th instance, a load balancer (with one pool) for every 100th instance and
+    a hypervisor for every 50 instances. A few resources of each collection are in
+    a state reported by the checks (DOWN ports, SHUTOFF instances, misplaced
+    allocations, ports with port security and hardware offload).
+    """
+
+    def __init__(self, size):
+        """Initialize of Inventory."""
+        self.size = size
+        self.counts = {
+            "servers": size,
+            "ports": size,
+            "floatingips": max(1, size // 10),
+            "networks": max(1, size // 100),
+            "subnets": max(1, size // 100),
+            "security_groups": max(1, size // 100),
+            "loadbalancers": max(1, size // 100),
+            "pools": max(1, size // 100),
+            "resource_providers": max(1, size // 50),
+            "images": 1,
+        }
+        self._indexes = {}
+        for collection, keys in FILTERS.items():
+            if not keys:
+                continue
+
+            indexes = {key: collections.defaultdict(list) for key in keys}
+            for i in range(self.counts[collection]):
+                resource = self.get(collection, i)
+                for key, attribute in keys.items():
+                    value = resource[attribute]
+                    for item in value if isinstance(value, list) else [value]:
+                        indexes[key][item].append(i)
+
+            for key, index in indexes.items():
+                self._indexes[(collection, key)] = index
+
+    def hypervisor(self, index):
+        return "compute-{}".format(index % self.counts["resource_providers"])
+
+    def server(self, i):
+        shutoff = i % 100 == 0
+        return {
+            "id": make_id("servers", i),
+            "name": "server-{}".format(i),
+            "status": "SHUTOFF" if shutoff else "ACTIVE",
+            "tenant_id": PROJECT["id"],
+            "user_id": USER["id"],
+            "OS-EXT-SRV-ATTR:host": self.hypervisor(i),
+            "OS-EXT-SRV-ATTR:hypervisor_hostname": self.hypervisor(i),
+            "OS-EXT-STS:power_state": 4 if shutoff else 1,
+            "OS-EXT-STS:vm_state": "stopped" if shutoff else "active",
+            "flavor": {"original_name": "m1.small", "vcpus": 1, "ram": 2048, "disk": 20},
+            "image": {"id": make_id("images", 0)},
+            "addresses": {
+                "network-{}".format(i % self.counts["networks"]): [
+                    {"version": 4, "addr": "10.{}.{}.{}".format(i >> 16, (i >> 8) & 255, i & 255)}
+                ]
+            },
+            "metadata": {},
+            "created": "2024-01-01T00:00:00Z",
+            "updated": "2024-01-01T00:00:00Z",
+        }
+
+    def port(self, i):
+        offloaded = i % 1000 == 3
+        return {
+            "id": make_id("ports", i),
+            "name": "port-{}".format(i),
+            "network_id": make_id("networks", i % self.counts["networks"]),
+            "device_id": make_id("servers", i),
+            "device_owner": "network:dhcp" if i % 100 == 1 else "compute:nova",
+            "status": "DOWN" if i % 50 == 0 else "ACTIVE",
+            "admin_state_up": True,
+            "binding:host_id": self.hypervisor(i),
+            "binding:vif_type": "unbound" if i % 200 == 0 else "ovs",
+            "binding:vnic_type": "direct" if offloaded else "normal",
+            "binding:profile": {"capabilities": ["switchdev"]} if offloaded else {},
+            "port_security_enabled": True,
+            "security_groups": [make_id("security_groups", i % self.counts["security_groups"])],
+            "allowed_address_pairs": [],
+            "fixed_ips": [
+                {
+                    "subnet_id": make_id("subnets", i % self.counts["subnets"]),
+                    "ip_address": "10.{}.{}.{}".format(i >> 16, (i >> 8) & 255, i & 255),
+                }
+            ],
+            "mac_address": "fa:16:3e:{:02x}:{:02x}:{:02x}".format(
+                (i >> 16) & 255, (i >> 8) & 255, i & 255
+            ),
+            "project_id": PROJECT["id"],
+            "tenant_id": PROJECT["id"],
+            "tags": [],
+            "created_at": "2024-01-01T00:00:00Z",
+            "updated_at": "2024-01-01T00:00:00Z",
+            "revision_number": 1,
+        }
+
+    def floatingip(self, i):
+        unassigned = i % 20 == 0
+        return {
+            "id": make_id("floatingips", i),
+            "floating_ip_address": "172.16.{}.{}".format((i >> 8) & 255, i & 255),
+            "fixed_ip_address": None if unassigned else "10.0.0.{}".format(i & 255),
+            "port_id": None if unassigned else make_id("ports", i * 10),
+            "status": "DOWN" if unassigned else "ACTIVE",
+            "project_id": PROJECT["id"],
+        }
+
+    def simple(self, collection, i):
+        return {
+            "id": make_id(collection, i),
+            "name": "{}-{}".format(collection, i),
+            "status": "ACTIVE",
+            "project_id": PROJECT["id"],
+        }
+
+    def loadbalancer(self, i):
+        return {
+            "id": make_id("loadbalancers", i),
+            "name": "lb-{}".format(i),
+            "admin_state_up": True,
+            "provisioning_status": "ACTIVE",
+            "operating_status": "ERROR" if i % 50 == 0 else "ONLINE",
+            "vip_port_id": make_id("ports", i * 100 + 2),
+            "pools": [{"id": make_id("pools", i)}],
+            "project_id": PROJECT["id"],
+        }
+
+    def pool(self, i):
+        return {
+            "id": make_id("pools", i),
+            "name": "pool-{}".format(i),
+            "admin_state_up": True,
+            "provisioning_status": "ACTIVE",
+            "operating_status": "NO_MONITOR" if i % 10 == 0 else "ONLINE",
+            "healthmonitor_id": None if i % 10 == 0 else "hm-{}".format(i),
+            "loadbalancers": [{"id": make_id("loadbalancers", i)}],
+            "loadbalancer_id": make_id("loadbalancers", i),
+            "project_id": PROJECT["id"],
+        }
+
+    def image(self, i):
+        return {
+            "id": make_id("images", i),
+            "name": "amphora-{}".format(i),
+            "status": "active",
+            "tags": ["octavia-amphora"],
+            "updated_at": datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+
+    def get(self, collection, i):
+        if collection == "servers":
+            return self.server(i)
+        if collection == "ports":
+            return self.port(i)
+        if collection == "floatingips":
+            return self.floatingip(i)
+        if collection == "loadbalancers":
+            return self.loadbalancer(i)
+        if collection == "pools":
+            return self.pool(i)
+        if collection == "images":
+            return self.image(i)
+        return self.simple(collection, i)
+
+    def indices(self, collection, filters):
+        """Get sorted indices of resources matching all filters."""
+        result = None
+        for key, value in filters.items():
+            if key not in FILTERS[collection]:
+                continue
+            if key == "fixed_ip_address" and value == "":
+                value = None
+            matching = self._indexes[(collection, key)].get(value, [])
+            result = matching if result is None else sorted(set(result) & set(matching))
+        return range(self.counts[collection]) if result is None else result
+
+    def allocations(self, rp_index):
+        """Get instances with allocations against resource provider.
+
+        Every 500th instance has its allocation against the next hypervisor.
+        """
+        hypervisors = self.counts["resource_providers"]
+        instances = {}
+        for i in range(rp_index, self.size, hypervisors):
+            if i % 500 != 7:
+                instances[make_id("servers", i)] = {"resources": {"VCPU": 1}}
+        for i in range((rp_index - 1) % hypervisors, self.size, hypervisors):
+            if i % 500 == 7:
+                instances[make_id("servers", i)] = {"resources": {"VCPU": 1}}
+        return instances
+
+
+class FakeOpenStackHandler(BaseHTTPRequestHandler):
+    """Handle API requests of fake OpenStack."""
+
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, avoid waiting for delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        """Do not log requests to stderr."""
+
+    def _send(self, code, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        time.sleep(self.server.latency)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.record(self.path, len(body))
+
+    def _not_found(self):
+        self._send(404, {"itemNotFound": {"code": 404, "message": "Not found"}})
+
+    def _url(self, path):
+        return "http://{}:{}{}".format(*self.server.server_address, path)
+
+    def do_POST(self):  # noqa: N802
+        """Issue token."""
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if urlsplit(self.path).path.rstrip("/") != "/identity/v3/auth/tokens":
+            return self._not_found()
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        expires = now + datetime.timedelta(hours=1)
+        catalog = [
+            {
+                "id": service_type,
+                "type": service_type,
+                "name": service_type,
+                "endpoints": [
+                    {
+                        "id": "{}-{}".format(service_type, interface),
+                        "interface": interface,
+                        "region": REGION,
+                        "region_id": REGION,
+                        "url": self._url(self.server.endpoint(service_type)),
+                    }
+                    for interface in ("public", "internal", "admin")
+                ],
+            }
+            for service_type in SERVICES
+        ]
+        token = {
+            "token": {
+                "methods": ["password"],
+                "user": USER,
+                "project": PROJECT,
+                "roles": [{"id": "admin", "name": "admin"}],
+                "catalog": catalog,
+                "issued_at": now.strftime("%Y-%m-%dT%H:%M:%S.000000Z"),
+                "expires_at": expires.strftime("%Y-%m-%dT%H:%M:%S.000000Z"),
+            }
+        }
+        self._send(201, token, {"X-Subject-Token": TOKEN})
+
+    def do_GET(self):  # noqa: N802
+        """Handle version discovery, listings and resources."""
+        url = urlsplit(self.path)
+        path = url.path.rstrip("/")
+        pairs = parse_qsl(url.query, keep_blank_values=True)
+        query = dict(pairs)
+        # Neutron field projection and ID filter, both may be repeated
+        for name in ("fields", "id"):
+            values = [value for key, value in pairs if key == name]
+            if values:
+                query[name] = values
+
+        for service_type, prefix in SERVICES.items():
+            if path == prefix or path == self.server.endpoint(service_type):
+                return self._send(200, self.server.version_document(service_type, self._url))
+
+        for route, handler in self.server.routes:
+            match = route.match(path)
+            if match:
+                return handler(self, query, *match.groups())
+
+        return self._not_found()
+
+    def list_collection(self, query, collection, resources_key, next_link=False):
+        limit = min(int(query.get("limit", self.server.page_size)), self.server.page_size)
+        indices = self.server.inventory.indices(collection, query)
+        if "id" in query:
+            requested = {parse_id(collection, id_) for id_ in query["id"]}
+            indices = sorted(i for i in requested if i is not None and i in indices)
+        start = 0
+        if "marker" in query:
+            start = bisect.bisect_right(indices, parse_id(collection, query["marker"]))
+
+        end = start + limit
+        page = indices[start:end]
+        items = [self.server.inventory.get(collection, i) for i in page]
+        if "fields" in query:
+            items = [{key: item[key] for key in query["fields"] if key in item} for item in items]
+        data = {resources_key: items}
+        if end < len(indices):
+            next_query = dict(query, marker=make_id(collection, page[-1]), limit=limit)
+            href = self._url(
+                "{}?{}".format(urlsplit(self.path).path, urlencode(next_query, doseq=True))
+            )
+            if next_link:
+                data["next"] = href
+            else:
+                data["{}_links".format(resources_key)] = [{"rel": "next", "href": href}]
+        self._send(200, data)
+
+    def show_resource(self, query, collection, resource_key, id_):
+        index = parse_id(collection, id_)
+        if index is None or index >= self.server.inventory.counts[collection]:
+            return self._not_found()
+        self._send(200, {resource_key: self.server.inventory.get(collection, index)})
+
+    def resource_providers(self, query):
+        providers = [
+            {
+                "uuid": make_id("resource_providers", i),
+                "name": self.server.inventory.hypervisor(i),
+                "generation": 1,
+            }
+            for i in range(self.server.inventory.counts["resource_providers"])
+        ]
+        self._send(200, {"resource_providers": providers})
+
+    def allocations(self, query, uuid):
+        index = parse_id("resource_providers", uuid)
+        if index is None:
+            return self._not_found()
+        self._send(200, {"allocations": self.server.inventory.allocations(index)})
+
+
+def _routes():
+    def listing(collection, resources_key, next_link=False):
+        return lambda handler, query: handler.list_collection(
+            query, collection, resources_key, next_link
+        )
+
+    def showing(collection, resource_key):
+        return lambda handler, query, id_: handler.show_resource(
+            query, collection, resource_key, id_
+        )
+
+    return [
+        (r"^/compute/v2\.1/servers(?:/detail)?$", listing("servers", "servers")),
+        (r"^/compute/v2\.1/servers/([^/]+)$", showing("servers", "server")),
+        (r"^/network/v2\.0/ports$", listing("ports", "ports")),
+        (r"^/network/v2\.0/ports/([^/]+)$", showing("ports", "port")),
+        (r"^/network/v2\.0/floatingips$", listing("floatingips", "floatingips")),
+        (r"^/network/v2\.0/networks$", listing("networks", "networks")),
+        (r"^/network/v2\.0/subnets$", listing("subnets", "subnets")),
+        (r"^/network/v2\.0/security-groups$", listing("security_groups", "security_groups")),
+        (r"^/load-balancer/v2\.0/lbaas/loadbalancers$", listing("loadbalancers", "loadbalancers")),
+        (r"^/load-balancer/v2\.0/lbaas/pools$", listing("pools", "pools")),
+        (r"^/image/v2/images$", listing("images", "images", next_link=True)),
+        (r"^/placement/resource_providers$", FakeOpenStackHandler.resource_providers),
+        (
+            r"^/placement/resource_providers/([^/]+)/allocations$",
+            FakeOpenStackHandler.allocations,
+        ),
+    ]
+
+
+class FakeOpenStack(ThreadingHTTPServer):
+    """Fake OpenStack APIs serving synthetic inventory."""
+
+    daemon_threads = True
+
+    def __init__(self, inventory, latency=0.0, page_size=1000, address=("127.0.0.1", 0)):
+        """Initialize of FakeOpenStack.
+
+        :param inventory: served inventory
+        :type inventory: Inventory
+        :param latency: delay of every response in seconds
+        :type latency: float
+        :param page_size: maximum number of resources in one page of listing
+        :type page_size: int
+        """
+        super().__init__(address, FakeOpenStackHandler)
+        self.inventory = inventory
+        self.latency = latency
+        self.page_size = page_size
+        self.routes = [(re.compile(route), handler) for route, handler in _routes()]
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def auth_url(self):
+        return "http://{}:{}/identity/v3".format(*self.server_address)
+
+    def endpoint(self, service_type):
+        return {
+            "identity": "/identity/v3",
+            "compute": "/compute/v2.1",
+            "network": "/network",
+            "placement": "/placement",
+            "load-balancer": "/load-balancer",
+            "image": "/image",
+        }[service_type]
+
+    def version_document(self, service_type, url):
+        if service_type == "identity":
+            return {
+                "version": {
+                    "id": "v3.14",
+                    "status": "stable",
+                    "links": [{"rel": "self", "href": url("/identity/v3/")}],
+                }
+            }
+        if service_type == "compute":
+            return {
+                "version": {
+                    "id": "v2.1",
+                    "status": "CURRENT",
+                    "version": "2.79",
+                    "min_version": "2.1",
+                    "links": [{"rel": "self", "href": url("/compute/v2.1/")}],
+                }
+            }
+        if service_type == "placement":
+            return {
+                "versions": [
+                    {
+                        "id": "v1.0",
+                        "status": "CURRENT",
+                        "min_version": "1.0",
+                        "max_version": "1.36",
+                        "links": [{"rel": "self", "href": url("/placement/")}],
+                    }
+                ]
+            }
+
+        version = {
+            "network": ("v2.0", "/network/v2.0/"),
+            "load-balancer": ("v2.0", "/load-balancer/v2.0/"),
+            "image": ("v2.16", "/image/v2/"),
+        }[service_type]
+        return {
+            "versions": [
+                {
+                    "id": version[0],
+                    "status": "CURRENT",
+                    "links": [{"rel": "self", "href": url(version[1])}],
+                }
+            ]
+        }
+
+    def record(self, path, size):
+        service = path.split("/")[1]
+        with self._lock:
+            self.requests[service] += 1
+            self.bytes[service] += size
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests = collections.Counter()
+            self.bytes = collections.Counter()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": sum(self.requests.values()),
+                "bytes": sum(self.bytes.values()),
+                "requests_by_service": dict(self.requests),
+                "bytes_by_service": dict(self.bytes),
+            }
+
+    def environment(self):
+        """Get OS_* variables authenticating against this server."""
+        return {
+            "OS_AUTH_URL": self.auth_url,
+            "OS_AUTH_TYPE": "password",
+            "OS_USERNAME": USER["name"],
+            "OS_PASSWORD": "password",
+            "OS_PROJECT_NAME": PROJECT["name"],
+            "OS_USER_DOMAIN_NAME": "Default",
+            "OS_PROJECT_DOMAIN_NAME": "Default",
+            "OS_REGION_NAME": REGION,
+            "OS_IDENTITY_API_VERSION": "3",
+            "OS_INTERFACE": "public",
+        }
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""Scale benchmark of the list-heavy checks against the fake OpenStack APIs.
+
+Every scenario is run in a fresh interpreter against `fake_openstack.FakeOpenStack`
+serving a synthetic inventory of given size. For each scenario and size the wall
+time, number of API requests, transferred bytes and peak RSS are recorded, and the
+results are written as JSON so two commits can be compared:
+
+    ./scale.py run --sizes 10000,100000 --latency 0.005 -o before.json
+    git checkout <branch>
+    ./scale.py run --sizes 10000,100000 --latency 0.005 -o after.json
+    ./scale.py compare before.json after.json
+
+The `check_resources.results` scenario does not call the APIs, it only accumulates
+results of given number of resources, so its peak RSS shows the memory growing with
+the number of checked resources:
+
+    ./scale.py run --sizes 10000,100000,500000 --scenario check_resources.results
+"""
+
+import argparse
+import functools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+from fake_openstack import FakeOpenStack, Inventory, make_id
+
+TEST_DIR = dirname(abspath(__file__))
+FILES_DIR = join(dirname(dirname(TEST_DIR)), "src", "files")
+PLUGINS_DIR = join(FILES_DIR, "plugins")
+DEFAULT_SIZES = "10000,100000,500000"
+RESULTS_VERSION = 1
+METRICS = ["wall_s", "requests", "bytes", "peak_rss_kb"]
+# resources checked by ID, e.g. check-ports rendered with explicit IDs
+CHECKED_IDS = 20
+# size of the inventory passed to the scenarios which do not call the APIs
+SIZE_VARIABLE = "OSC_BENCHMARK_SIZE"
+OFFLINE_SCENARIOS = {"check_resources.results"}
+
+
+def _connect(cache_file):
+    import openstack
+    from osc_token_cache import attach_token_cache
+
+    return attach_token_cache(openstack.connect(cloud="envvars"), cache_file)
+
+
+def _check_resources(resource_type, collection=None):
+    """Check all resources or, if collection is given, `CHECKED_IDS` of them by ID."""
+
+    def _scenario(cache_file):
+        import check_resources
+        from nagios_plugin3 import CriticalError, UnknownError, WarnError
+
+        # keep the token cache of the benchmark out of /var/lib/nagios
+        check_resources.attach_token_cache = functools.partial(
+            check_resources.attach_token_cache, cache_file=cache_file
+        )
+        ids = set()
+        if collection:
+            ids = {make_id(collection, i * 13) for i in range(CHECKED_IDS)}
+        try:
+            check_resources.check(resource_type, ids, check_all=not ids)
+        except (CriticalError, WarnError, UnknownError) as error:
+            return str(error).splitlines()[0]
+
+        return "OK"
+
+    return _scenario
+
+
+def _check_resources_combined(cache_file):
+    """Check all ports, floating IPs and servers by one combined check."""
+    import check_resources
+    from nagios_plugin3 import CriticalError, UnknownError, WarnError
+
+    check_resources.attach_token_cache = functools.partial(
+        check_resources.attach_token_cache, cache_file=cache_file
+    )
+    specs = [
+        argparse.Namespace(
+            resource=resource,
+            all=True,
+            id=[],
+            skip_id=[],
+            select=[],
+            shard=None,
+            max_critical=None,
+        )
+        for resource in ("port", "floating-ip", "server")
+    ]
+    try:
+        check_resources.check_many(specs)
+    except (CriticalError, WarnError, UnknownError) as error:
+        return str(error).splitlines()[0][:80]
+
+    return "OK"
+
+
+def _check_resources_results(cache_file):
+    """Accumulate results of ports without listing them, 1 % of them DOWN."""
+    import check_resources
+    from nagios_plugin3 import CriticalError, UnknownError, WarnError
+
+    size = int(os.environ[SIZE_VARIABLE])
+    networks = max(1, size // 100)
+    results = check_resources.Results("network")
+    for i in range(size):
+        results.add_result(
+            "port",
+            make_id("ports", i),
+            "DOWN" if i % 100 == 0 else "ACTIVE",
+            output_group=make_id("networks", i % networks),
+        )
+    try:
+        check_resources.nagios_output("port", results)
+    except (CriticalError, WarnError, UnknownError) as error:
+        return str(error).splitlines()[0]
+
+    return "OK"
+
+
+def _check_octavia_loadbalancers(cache_file):
+    import check_octavia
+
+    return "{} alarms".format(len(check_octavia.check_loadbalancers(_connect(cache_file))))
+
+
+def _allocations_get_instances(cache_file):
+    import run_allocation_checks
+
+    connection = _connect(cache_file)
+    # the proxy of the connection provides the same `get` as make_rest_client("placement")
+    instances = run_allocation_checks.get_instances(connection, connection.placement)
+    return "{} instances".format(len(instances))
+
+
+def _port_security_get_bad_ports(cache_file):
+    import check_port_security
+
+    return "{} bad ports".format(len(check_port_security.get_bad_ports(_connect(cache_file))))
+
+
+SCENARIOS = {
+    "check_resources.port": _check_resources("port"),
+    "check_resources.server": _check_resources("server"),
+    "check_resources.floating-ip": _check_resources("floating-ip"),
+    "check_resources.port-ids": _check_resources("port", "ports"),
+    "check_resources.server-ids": _check_resources("server", "servers"),
+    "check_resources.combined": _check_resources_combined,
+    "check_resources.results": _check_resources_results,
+    "check_octavia.check_loadbalancers": _check_octavia_loadbalancers,
+    "run_allocation_checks.get_instances": _allocations_get_instances,
+    "check_port_security.get_bad_ports": _port_security_get_bad_ports,
+}
+
+
+def _peak_rss():
+    with open("/proc/self/status", "r") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+
+def run_scenario(name):
+    """Run scenario in this process and print its measurement as JSON."""
+    sys.path[:0] = [FILES_DIR, PLUGINS_DIR]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        result = SCENARIOS[name](join(tmp_dir, "token_cache.json"))
+        wall_s = time.perf_counter() - start
+
+    print(json.dumps({"wall_s": wall_s, "peak_rss_kb": _peak_rss(), "result": result}))
+
+
+def measure(server, scenario, timeout):
+    """Measure scenario in new interpreter.
+
+    :param server: running fake OpenStack
+    :type server: FakeOpenStack
+    :param scenario: name of scenario
+    :type scenario: str
+    :param timeout: timeout of scenario in seconds
+    :type timeout: int
+    :returns: measurements of scenario
+    :rtype: Dict[str, Any]
+    """
+    env = dict(os.environ, OSC_CHECKD_DISABLED="1", **server.environment())
+    env[SIZE_VARIABLE] = str(server.inventory.size)
+    server.reset_stats()
+    process = subprocess.run(
+        [sys.executable, abspath(__file__), "scenario", scenario],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env,
+        universal_newlines=True,
+        timeout=timeout,
+    )
+    if process.returncode != 0:
+        raise RuntimeError("scenario {} failed:\n{}".format(scenario, process.stderr))
+
+    measurement = json.loads(process.stdout.splitlines()[-1])
+    measurement.update(server.stats())
+    return measurement
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=TEST_DIR, universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, scenarios, latency, page_size, timeout):
+    """Run scenarios against inventories of every size.
+
+    :returns: results with configuration of the run
+    :rtype: Dict[str, Any]
+    """
+    results = []
+    for size in sizes:
+        server = FakeOpenStack(Inventory(size), latency=latency, page_size=page_size).start()
+        try:
+            for scenario in scenarios:
+                measurement = measure(server, scenario, timeout)
+                measurement.update(scenario=scenario, size=size)
+                print(
+                    "{scenario:<38} {size:>7} {wall_s:>9.2f} s {requests:>7} req "
+                    "{bytes:>12} B {peak_rss_kb:>8} kB  {result}".format(**measurement),
+                    flush=True,
+                )
+                results.append(measurement)
+        finally:
+            server.stop()
+
+    return {
+        "version": RESULTS_VERSION,
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "latency": latency,
+        "page_size": page_size,
+        "results": results,
+    }
+
+
+def compare(old, new, threshold):
+    """Print relative change of every metric, return number of regressions.
+
+    :param old: results of baseline
+    :type old: Dict[str, Any]
+    :param new: results to compare with baseline
+    :type new: Dict[str, Any]
+    :param threshold: relative increase of metric reported as regression
+    :type threshold: float
+    :rtype: int
+    """
+    baseline = {(result["scenario"], result["size"]): result for result in old["results"]}
+    regressions = 0
+    print("{} -> {}".format(old.get("commit"), new.get("commit")))
+    for result in new["results"]:
+        base = baseline.get((result["scenario"], result["size"]))
+        if base is None:
+            continue
+
+        changes = []
+        for metric in METRICS:
+            ratio = result[metric] / base[metric] if base[metric] else 1.0
+            regression = ratio > 1 + threshold
+            regressions += regression
+            changes.append("{} {:+.0%}{}".format(metric, ratio - 1, " !" if regression else ""))
+
+        print("{:<38} {:>7}  {}".format(result["scenario"], result["size"], ", ".join(changes)))
+
+    return regressions
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmark")
+    run_parser.add_argument(
+        "--sizes",
+        default=DEFAULT_SIZES,
+        type=lambda value: [int(size) for size in value.split(",")],
+        help="comma separated numbers of instances (default: %(default)s)",
+    )
+    run_parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="run only selected scenario, can be used multiple times",
+    )
+    run_parser.add_argument(
+        "--latency", type=float, default=0.0, help="latency of every API request in seconds"
+    )
+    run_parser.add_argument(
+        "--page-size", type=int, default=1000, help="maximum number of resources in one page"
+    )
+    run_parser.add_argument(
+        "--timeout", type=int, default=3600, help="timeout of one scenario in seconds"
+    )
+    run_parser.add_argument("-o", "--output", help="write results as JSON to file")
+
+    compare_parser = subparsers.add_parser("compare", help="compare results of two runs")
+    compare_parser.add_argument("old", help="results of baseline")
+    compare_parser.add_argument("new", help="results compared with baseline")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative increase reported as regression (default: %(default)s)",
+    )
+
+    scenario_parser = subparsers.add_parser("scenario", help="run one scenario (internal)")
+    scenario_parser.add_argument("name", choices=sorted(SCENARIOS))
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.command == "scenario":
+        run_scenario(args.name)
+    elif args.command == "run":
+        results = run(
+            args.sizes,
+            args.scenario or list(SCENARIOS),
+            args.latency,
+            args.page_size,
+            args.timeout,
+        )
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(results, file, indent=2)
+    else:
+        with open(args.old, "r") as old_file, open(args.new, "r") as new_file:
+            regressions = compare(json.load(old_file), json.load(new_file), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
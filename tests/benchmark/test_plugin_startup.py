@@ -0,0 +1,78 @@
+"""Cold-start time and peak RSS budgets of the python plugins.
+
+Every plugin is started `runs` times in a fresh interpreter with `--help` (or the
+configured arguments), which exercises everything done before the first API call.
+The fastest start-up and the highest peak RSS must stay within the budget from
+budgets.json.
+"""
+
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+from os.path import abspath, basename, dirname, join
+
+import pytest
+
+TEST_DIR = dirname(abspath(__file__))
+CHECKS_DIR = join(dirname(dirname(TEST_DIR)), "src", "files", "plugins")
+PLUGINS = sorted(basename(path) for path in glob.glob(join(CHECKS_DIR, "check_*.py")))
+
+with open(join(TEST_DIR, "budgets.json"), "r") as budgets_file:
+    BUDGETS = json.load(budgets_file)
+
+
+# VmHWM of the plugin process, the rusage of a forked child would include the RSS of pytest
+LAUNCHER = """
+import atexit, os, runpy, sys
+
+def report_peak_rss():
+    with open("/proc/self/status") as status:
+        sys.stderr.write("".join(line for line in status if line.startswith("VmHWM:")))
+
+atexit.register(report_peak_rss)
+sys.argv = sys.argv[1:]
+sys.path[0] = os.path.dirname(sys.argv[0])
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+def run_plugin(plugin, argv):
+    """Run plugin in new interpreter.
+
+    :returns: wall time in ms, peak RSS in kB and stderr
+    :rtype: Tuple[float, int, str]
+    """
+    env = dict(os.environ, OSC_CHECKD_DISABLED="1")
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-c", LAUNCHER, join(CHECKS_DIR, plugin), *argv],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        env=env,
+        universal_newlines=True,
+    )
+    elapsed = (time.perf_counter() - start) * 1000
+    stderr, _, peak_rss = process.stderr.rpartition("VmHWM:")
+    return elapsed, int(peak_rss.split()[0]), stderr
+
+
+@pytest.mark.parametrize("plugin", PLUGINS)
+def test_plugin_startup(plugin):
+    budget = dict(BUDGETS["default"], **BUDGETS["plugins"].get(plugin, {}))
+    argv = budget.get("argv", ["--help"])
+    startup, max_rss = float("inf"), 0
+    for _ in range(BUDGETS["runs"]):
+        elapsed, rss, stderr = run_plugin(plugin, argv)
+        assert "Traceback" not in stderr, stderr
+        startup, max_rss = min(startup, elapsed), max(max_rss, rss)
+
+    print("{}: start-up {:.0f} ms, peak RSS {} kB".format(plugin, startup, max_rss))
+    assert startup <= budget["startup_ms"], "{} start-up {:.0f} ms over budget {} ms".format(
+        plugin, startup, budget["startup_ms"]
+    )
+    assert max_rss <= budget["max_rss_kb"], "{} peak RSS {} kB over budget {} kB".format(
+        plugin, max_rss, budget["max_rss_kb"]
+    )
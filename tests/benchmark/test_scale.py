@@ -0,0 +1,50 @@
+"""Smoke test of the scale benchmark with a small inventory."""
+
+import json
+import subprocess
+import sys
+from os.path import abspath, dirname, join
+
+import fake_openstack
+import pytest
+import scale
+
+
+@pytest.fixture(scope="module")
+def results():
+    return scale.run([300], list(scale.SCENARIOS), latency=0.0, page_size=100, timeout=600)
+
+
+def test_fake_openstack_pagination():
+    inventory = fake_openstack.Inventory(300)
+    assert list(inventory.indices("ports", {"status": "DOWN"})) == list(range(0, 300, 50))
+    assert fake_openstack.parse_id("ports", fake_openstack.make_id("ports", 42)) == 42
+    assert fake_openstack.parse_id("servers", fake_openstack.make_id("ports", 42)) is None
+
+
+@pytest.mark.parametrize("scenario", sorted(scale.SCENARIOS))
+def test_scenario(results, scenario):
+    (result,) = [result for result in results["results"] if result["scenario"] == scenario]
+    assert result["size"] == 300
+    if scenario not in scale.OFFLINE_SCENARIOS:
+        assert result["requests"] > 0
+        assert result["bytes"] > 0
+    assert result["peak_rss_kb"] > 0
+    assert result["result"]
+
+
+def test_compare(results, tmp_path):
+    regressed = json.loads(json.dumps(results))
+    regressed["results"][0]["requests"] *= 2
+    for name, data in (("old.json", results), ("new.json", regressed)):
+        with open(tmp_path / name, "w") as file:
+            json.dump(data, file)
+
+    assert scale.compare(results, results, 0.1) == 0
+    assert scale.compare(results, regressed, 0.1) == 1
+    process = subprocess.run(
+        [sys.executable, join(dirname(abspath(__file__)), "scale.py"), "compare"]
+        + [str(tmp_path / "old.json"), str(tmp_path / "new.json")],
+        stdout=subprocess.PIPE,
+    )
+    assert process.returncode == 1
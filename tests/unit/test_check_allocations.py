@@ -3,10 +3,24 @@
 import json
 import unittest.mock as mock
 
+import check_allocations
+import osc_cron
+import osc_placement
+import osc_snapshot
 import pytest
 import run_allocation_checks
 
 
+def _response(data):
+    """Mock streamed response of placement API, received in small chunks."""
+    content = json.dumps(data).encode("utf-8")
+    response = mock.MagicMock()
+    response.iter_content.side_effect = lambda chunk_size: (
+        content[start:][:7] for start in range(0, len(content), 7)
+    )
+    return response
+
+
 @pytest.fixture
 def servers():
     return [
@@ -36,10 +50,8 @@ def test_correct_state(servers, rp):
     allocs = {"allocations": {servers[0].id: "", servers[1].id: "", servers[2].id: ""}}
 
     placement_client = mock.MagicMock()
-    allocations_resp = mock.MagicMock()
-    allocations_resp.content = json.dumps(allocs)
-    rps_resp = mock.MagicMock()
-    rps_resp.content = json.dumps(rps)
+    allocations_resp = _response(allocs)
+    rps_resp = _response(rps)
     placement_client.get.side_effect = [rps_resp, allocations_resp]
 
     alerts = run_allocation_checks.check_allocations(conn, placement_client)
@@ -68,10 +80,8 @@ def test_nova_instance_missing(servers, rp):
     }
 
     placement_client = mock.MagicMock()
-    allocations_resp = mock.MagicMock()
-    allocations_resp.content = json.dumps(allocs)
-    rps_resp = mock.MagicMock()
-    rps_resp.content = json.dumps(rps)
+    allocations_resp = _response(allocs)
+    rps_resp = _response(rps)
     placement_client.get.side_effect = [rps_resp, allocations_resp]
 
     alerts = run_allocation_checks.check_allocations(conn, placement_client)
@@ -100,10 +110,8 @@ def test_placement_allocation_missing(servers, rp):
     allocs = {"allocations": {servers[0].id: "", servers[2].id: ""}}
 
     placement_client = mock.MagicMock()
-    allocations_resp = mock.MagicMock()
-    allocations_resp.content = json.dumps(allocs)
-    rps_resp = mock.MagicMock()
-    rps_resp.content = json.dumps(rps)
+    allocations_resp = _response(allocs)
+    rps_resp = _response(rps)
     placement_client.get.side_effect = [rps_resp, allocations_resp]
 
     alerts = run_allocation_checks.check_allocations(conn, placement_client)
@@ -149,14 +157,15 @@ def test_multiple_placement_allocations_mismatch(servers, rp):
 
     placement_client = mock.MagicMock()
 
-    rps_resp = mock.MagicMock()
-    rps_resp.content = json.dumps(rps)
+    rps_resp = _response(rps)
 
-    placement_client.get.side_effect = [
-        rps_resp,
-        mock.MagicMock(content=json.dumps(allocs[0])),
-        mock.MagicMock(content=json.dumps(allocs[1])),
-    ]
+    responses = {
+        "/resource_providers": rps_resp,
+        # allocations of resource providers are requested concurrently
+        "/resource_providers/rp-0/allocations": _response(allocs[0]),
+        "/resource_providers/rp-1/allocations": _response(allocs[1]),
+    }
+    placement_client.get.side_effect = lambda path, **_: responses[path]
 
     alerts = run_allocation_checks.check_allocations(conn, placement_client)
     status_message = run_allocation_checks.nagios_exit(args, alerts)
@@ -187,10 +196,8 @@ def test_ignored(servers, rp):
     }
 
     placement_client = mock.MagicMock()
-    allocations_resp = mock.MagicMock()
-    allocations_resp.content = json.dumps(allocs)
-    rps_resp = mock.MagicMock()
-    rps_resp.content = json.dumps(rps)
+    allocations_resp = _response(allocs)
+    rps_resp = _response(rps)
     placement_client.get.side_effect = [rps_resp, allocations_resp]
 
     args.ignored = f"{servers[1].id},{servers[2].id}"
@@ -213,10 +220,8 @@ def test_no_instances(rp):
 
     placement_client = mock.MagicMock()
     rps = {"resource_providers": [{"name": rp[0].name, "uuid": rp[0].uuid}]}
-    rps_resp = mock.MagicMock()
-    rps_resp.content = json.dumps(rps)
-    allocations_resp = mock.MagicMock()
-    allocations_resp.content = b'{"allocations": {}}'
+    rps_resp = _response(rps)
+    allocations_resp = _response({"allocations": {}})
     placement_client.get.side_effect = [rps_resp, allocations_resp]
 
     alerts = run_allocation_checks.check_allocations(conn, placement_client)
@@ -227,3 +232,302 @@ def test_no_instances(rp):
         0,
         "OK: total_alarms[0], total_crit[0], total_ignored[0], ignoring r''\n",
     )
+
+
+def test_snapshot(tmp_path):
+    snapshot = str(tmp_path / "inventory_snapshot.json")
+    osc_snapshot.write_snapshot(
+        {
+            "servers": {
+                "items": [
+                    {"id": "vm-0", "compute_host": "host-0"},
+                    {"id": "vm-1", "compute_host": "host-1"},
+                ],
+                "latency": 1,
+            },
+            "resource_providers": {"items": [{"name": "host-0", "uuid": "rp-0"}], "latency": 1},
+            "allocations": {"items": {"rp-0": ["vm-0", "vm-1"]}, "latency": 1},
+        },
+        snapshot,
+    )
+    inventory = osc_snapshot.load_snapshot(snapshot)
+
+    alerts = run_allocation_checks.check_allocations(inventory, inventory.placement)
+
+    assert alerts == [
+        (
+            run_allocation_checks.NAGIOS_STATUS_WARNING,
+            "instance vm-1 is incorrect in placement: placement host: ['host-0'], "
+            "nova host: ['host-1']",
+        )
+    ]
+
+
+def test_snapshot_stale(tmp_path):
+    snapshot = str(tmp_path / "inventory_snapshot.json")
+    osc_snapshot.write_snapshot({}, snapshot)
+    argv = ["run_allocation_checks.py", "--snapshot", snapshot, "--snapshot-max-age", "-1"]
+
+    with mock.patch("sys.argv", argv), mock.patch.object(
+        run_allocation_checks, "save_status"
+    ) as save_status, mock.patch.multiple(
+        run_allocation_checks,
+        LOCK_FILE=str(tmp_path / "allocations.lock"),
+        RUNS_FILE=str(tmp_path / "allocations.runs"),
+    ):
+        run_allocation_checks.main()
+
+    status, message = save_status.call_args[0][:2]
+    assert status == run_allocation_checks.NAGIOS_STATUS_UNKNOWN
+    assert message.startswith("UNKNOWN: inventory snapshot")
+
+
+def test_get_instances_concurrent(servers):
+    conn = mock.MagicMock()
+    conn.compute.servers.return_value = servers
+    responses = {"/resource_providers": {"resource_providers": []}}
+    for i in range(3):
+        uuid = "rp-{}".format(i)
+        responses["/resource_providers"]["resource_providers"].append(
+            {"name": "host-{}".format(i), "uuid": uuid}
+        )
+        responses["/resource_providers/{}/allocations".format(uuid)] = {
+            "allocations": {servers[i].id: {}}
+        }
+    placement_client = mock.MagicMock()
+    placement_client.get.side_effect = lambda path, **_: _response(responses[path])
+    stats = {}
+
+    instances = run_allocation_checks.get_instances(
+        conn, placement_client, workers=3, timeout=5, retries=1, stats=stats
+    )
+
+    assert instances["vm-2"] == {"nova": {"host-0"}, "placement": {"host-2"}}
+    assert placement_client.get.call_count == 4
+    placement_client.get.assert_called_with(
+        mock.ANY,
+        timeout=5,
+        connect_retries=1,
+        status_code_retries=1,
+        retriable_status_codes=osc_placement.RETRIABLE_STATUS_CODES,
+        stream=True,
+    )
+    assert stats["resource_providers"] == 3
+    assert stats["slowest_provider"] in {"host-0", "host-1", "host-2"}
+    assert stats["placement_time"] >= stats["slowest_provider_time"]
+
+
+def test_save_status_placement(tmp_path):
+    output_file = str(tmp_path / "allocations.out")
+    placement = {"placement_time": 1.5, "slowest_provider": "host-1"}
+    with mock.patch.object(run_allocation_checks, "OUTPUT_FILE", output_file):
+        run_allocation_checks.save_status(0, "OK: total_alarms[0]", placement)
+
+    with open(output_file) as file:
+        saved_state = json.load(file)
+
+    assert saved_state.pop("peak_rss_kb") > 0
+    assert saved_state == {
+        "status": 0,
+        "message": "OK: total_alarms[0]",
+        "placement": placement,
+    }
+
+
+def test_get_instances_incremental(tmp_path):
+    """Test that only changed servers and allocations of their hosts are requested."""
+    cache_file = str(tmp_path / "allocations.cache")
+    conn = mock.MagicMock()
+    conn.compute.servers.return_value = [
+        mock.MagicMock(id="vm-0", compute_host="host-0", status="ACTIVE"),
+        mock.MagicMock(id="vm-1", compute_host="host-0", status="ACTIVE"),
+        mock.MagicMock(id="vm-2", compute_host="host-2", status="ACTIVE"),
+    ]
+    responses = {
+        "/resource_providers": {
+            "resource_providers": [
+                {"name": "host-{}".format(i), "uuid": "rp-{}".format(i)} for i in range(3)
+            ]
+        },
+        "/resource_providers/rp-0/allocations": {"allocations": {"vm-0": {}, "vm-1": {}}},
+        "/resource_providers/rp-1/allocations": {"allocations": {}},
+        "/resource_providers/rp-2/allocations": {"allocations": {"vm-2": {}}},
+    }
+    placement_client = mock.MagicMock()
+    placement_client.get.side_effect = lambda path, **_: _response(responses[path])
+    stats = {}
+
+    instances = run_allocation_checks.get_instances_incremental(
+        conn, placement_client, cache_file, stats=stats
+    )
+    assert stats["sync"] == "full"
+    assert instances["vm-1"] == {"nova": {"host-0"}, "placement": {"host-0"}}
+    with open(cache_file) as file:
+        assert json.load(file)["instances"]["hosts"] == ["host-0", "host-2"]
+
+    # vm-0 was deleted and vm-1 migrated to host-1, but its allocation was not moved
+    conn.compute.servers.reset_mock()
+    conn.compute.servers.return_value = [
+        mock.MagicMock(id="vm-0", compute_host="host-0", status="DELETED"),
+        mock.MagicMock(id="vm-1", compute_host="host-1", status="ACTIVE"),
+    ]
+    responses["/resource_providers/rp-0/allocations"] = {"allocations": {"vm-1": {}}}
+    placement_client.get.reset_mock()
+
+    instances = run_allocation_checks.get_instances_incremental(
+        conn, placement_client, cache_file, stats=stats
+    )
+    assert stats["sync"] == "incremental"
+    assert stats["changed_servers"] == 2
+    assert conn.compute.servers.call_args.kwargs["changes_since"].endswith("Z")
+    assert sorted(call.args[0] for call in placement_client.get.call_args_list) == [
+        "/resource_providers/rp-0/allocations",
+        "/resource_providers/rp-1/allocations",
+    ]
+    assert dict(instances) == {
+        "vm-1": {"nova": {"host-1"}, "placement": {"host-0"}},
+        "vm-2": {"nova": {"host-2"}, "placement": {"host-2"}},
+    }
+
+    # full synchronization lists all servers again
+    run_allocation_checks.get_instances_incremental(
+        conn, placement_client, cache_file, full_sync_interval=0, stats=stats
+    )
+    assert stats["sync"] == "full"
+    assert "changes_since" not in conn.compute.servers.call_args.kwargs
+
+
+@pytest.mark.parametrize(
+    "content", ["", '{"version": 0}', '{"version": 2, "instances": {"hosts": []}}']
+)
+def test_load_cache_invalid(tmp_path, content):
+    cache_file = tmp_path / "allocations.cache"
+    cache_file.write_text(content)
+
+    assert run_allocation_checks.load_cache(str(cache_file)) is None
+    assert run_allocation_checks.load_cache(str(tmp_path / "missing.cache")) is None
+
+
+def test_instance_hosts():
+    """Test that instances are mapped by UUID bytes to indexes of interned hosts."""
+    uuids = ["6f1c4b52-3a5e-4d47-9a0e-1c2b3d4e5f{:02d}".format(i) for i in range(4)]
+    instances = run_allocation_checks.InstanceHosts()
+    instances.add_nova(uuids[0], "host-0")
+    instances.add_nova(uuids[1], "host-0")
+    instances.add_nova(uuids[2], "host-1")
+    instances.add_placement(uuids[0], "host-0")
+    instances.add_placement(uuids[1], "host-0")
+    instances.add_placement(uuids[1], "host-1")
+    instances.add_placement(uuids[1], "host-1")
+    instances.add_placement(uuids[3], "host-1")
+
+    assert instances.hosts == ["host-0", "host-1"]
+    assert all(isinstance(key, bytes) and len(key) == 16 for key in instances.nova)
+    assert instances.nova[bytes.fromhex(uuids[2].replace("-", ""))] == 1
+    assert len(instances) == 4
+    assert list(instances.keys()) == uuids
+    assert instances[uuids[1]] == {"nova": {"host-0"}, "placement": {"host-0", "host-1"}}
+    assert instances[uuids[3]] == {"placement": {"host-1"}}
+    with pytest.raises(KeyError):
+        instances["vm-0"]
+
+    assert list(instances.mismatches()) == [
+        (uuids[1], {"host-0", "host-1"}, {"host-0"}),
+        (uuids[2], set(), {"host-1"}),
+        (uuids[3], {"host-1"}, set()),
+    ]
+
+
+def test_instance_hosts_cache():
+    """Test that the cached mapping keeps host indexes and forgets removed hosts."""
+    uuids = ["6f1c4b52-3a5e-4d47-9a0e-1c2b3d4e5f{:02d}".format(i) for i in range(3)]
+    instances = run_allocation_checks.InstanceHosts()
+    instances.add_nova(uuids[0], "host-0")
+    instances.add_nova("vm-1", "host-1")
+    instances.add_placement(uuids[0], "host-0")
+    instances.add_placement(uuids[0], "host-1")
+    instances.add_placement(uuids[1], "host-1")
+    instances.add_placement(uuids[2], "host-0")
+    instances.add_placement(uuids[2], "host-1")
+    instances.add_placement(uuids[2], "host-2")
+
+    data = json.loads(json.dumps(instances.to_cache()))
+    assert data == {
+        "hosts": ["host-0", "host-1", "host-2"],
+        "nova": {uuids[0].replace("-", ""): 0, "vm-1": 1},
+        "placement": {
+            uuids[0].replace("-", ""): [0, 1],
+            uuids[1].replace("-", ""): 1,
+            uuids[2].replace("-", ""): [0, 1, 2],
+        },
+    }
+
+    loaded = run_allocation_checks.InstanceHosts.from_cache(data)
+    assert loaded.nova == instances.nova and loaded.placement == instances.placement
+    assert loaded["vm-1"] == {"nova": {"host-1"}}
+
+    assert loaded.remove_nova("vm-1") == "host-1"
+    assert loaded.remove_nova("vm-1") is None
+    loaded.remove_placement({"host-1", "unknown"})
+    loaded.add_placement(uuids[0], "host-2")
+    assert dict(loaded) == {
+        uuids[0]: {"nova": {"host-0"}, "placement": {"host-0", "host-2"}},
+        uuids[2]: {"placement": {"host-0", "host-2"}},
+    }
+
+
+def test_main_overlap(tmp_path):
+    """Test that start overlapping the run in progress is skipped and recorded."""
+    argv = ["run_allocation_checks.py", "--interval", "10"]
+    lock_file = str(tmp_path / "allocations.lock")
+    runs_file = str(tmp_path / "allocations.runs")
+
+    with mock.patch("sys.argv", argv), mock.patch.object(
+        run_allocation_checks, "save_status"
+    ) as save_status, mock.patch.multiple(
+        run_allocation_checks, LOCK_FILE=lock_file, RUNS_FILE=runs_file
+    ):
+        with run_allocation_checks.exclusive_run(lock_file) as acquired:
+            assert acquired
+            run_allocation_checks.main()
+            save_status.assert_not_called()
+
+        # run started before the skipped start
+        with mock.patch.object(
+            run_allocation_checks, "run_check", return_value=(0, "OK", {})
+        ), mock.patch("time.time", side_effect=[0, 42.5]):
+            run_allocation_checks.main()
+
+    run = save_status.call_args[0][3]
+    assert run == {"interval": 600, "duration": 42.5, "skipped_starts": 1}
+    with open(runs_file) as file:
+        runs = json.load(file)
+    assert len(runs["skipped"]) == 1
+    assert runs["runs"] == [{"start": 0, "duration": 42.5}]
+
+
+def test_record_run_kept(tmp_path):
+    runs_file = str(tmp_path / "allocations.runs")
+    with open(runs_file, "w") as file:
+        file.write("[]")
+
+    for start in range(osc_cron.RUNS_KEPT + 2):
+        runs = run_allocation_checks.record_run(runs_file, run={"start": start, "duration": 1})
+
+    assert runs["skipped"] == []
+    assert [run["start"] for run in runs["runs"]] == list(range(2, 14))
+    with open(runs_file) as file:
+        assert json.load(file) == runs
+
+
+@pytest.mark.parametrize(
+    "saved_state, exp_max_age",
+    [
+        (None, 600),
+        ({"status": 0, "message": "OK"}, 600),
+        ({"run": {"interval": 300, "duration": 12.5}}, 612),
+        ({"run": {"interval": 1800, "duration": 1500}}, 5100),
+    ],
+)
+def test_status_max_age(saved_state, exp_max_age):
+    assert check_allocations.max_age(saved_state) == exp_max_age
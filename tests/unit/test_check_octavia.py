@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from uuid import uuid4
 
 import check_octavia
+import osc_snapshot
 import pytest
 
 LB_CRITICAL_MESSAGE = """
@@ -209,3 +210,51 @@ def test_lb_operating_status(connect, operating_status, monitor_id, nagios_messa
         assert message in nagios_message.format(lb_uuid, operating_status)
 
     assert status == nagios_status
+
+
+@mock.patch("check_octavia.openstack.connect")
+def test_loadbalancers_snapshot(connect, tmp_path):
+    """Test loadbalancers check evaluating inventory snapshot."""
+    snapshot = str(tmp_path / "inventory_snapshot.json")
+    lb = {
+        "id": "lb-0",
+        "is_admin_state_up": True,
+        "provisioning_status": "ACTIVE",
+        "operating_status": "OFFLINE",
+        "vip_port_id": "port-1",
+    }
+    pool = {"id": "pool-0", "loadbalancers": [{"id": "lb-0"}], "health_monitor_id": "hm-0"}
+    osc_snapshot.write_snapshot(
+        {
+            "load_balancers": {"items": [lb], "latency": 1},
+            "pools": {"items": [pool], "latency": 1},
+            "ports": {"items": [{"id": "port-0"}], "latency": 1},
+        },
+        snapshot,
+    )
+    args = mock.MagicMock()
+    args.ignored = r""
+    args.check = "loadbalancers"
+
+    status, message = check_octavia.process_checks(args, osc_snapshot.load_snapshot(snapshot))
+
+    connect.assert_not_called()
+    assert status == check_octavia.NAGIOS_STATUS_CRITICAL
+    assert "loadbalancer lb-0 operating_status is OFFLINE" in message
+    assert "vip port port-1 for loadbalancer lb-0 not found" in message
+
+
+def test_filter_checks_output_budget():
+    """Test that the output keeps the critical alarms when it exceeds the budget."""
+    alarms = [(1, "loadbalancer lb-{:04d} is degraded".format(i)) for i in range(500)]
+    alarms.append((2, "loadbalancer lb-down operating_status is OFFLINE"))
+
+    status, message = check_octavia.filter_checks(alarms)
+
+    assert status == 2
+    lines = message.splitlines()
+    omitted = 501 - len(lines) + 2  # header and summary
+    assert lines[0] == "total_alarms[501], total_crit[1], total_ignored[0], ignoring r''"
+    assert lines[-2] == "loadbalancer lb-down operating_status is OFFLINE"
+    assert lines[-1] == "{0} more lines omitted ({0} WARNING)".format(omitted)
+    assert len(message) < 4200
@@ -2,8 +2,10 @@
 
 import tempfile
 import time
+from unittest import mock
 
 import check_port_security
+import osc_snapshot
 
 
 def test_output_not_exist():
@@ -38,3 +40,52 @@ def test_output_healthy():
     status, message = check_port_security.nagios_check(output.name, 3)
     assert status == check_port_security.NAGIOS_STATUS_OK
     assert "healthy" in message
+
+
+def test_output_unknown():
+    """Test for auto remediation which was not run."""
+    output = tempfile.NamedTemporaryFile(mode="w")
+    output.write("UNKNOWN: inventory snapshot is 1000 seconds old")
+    output.flush()
+    status, message = check_port_security.nagios_check(output.name, 3)
+    assert status == check_port_security.NAGIOS_STATUS_UNKNOWN
+    assert message == "auto remediation not run: inventory snapshot is 1000 seconds old"
+
+
+def test_output_perfdata():
+    """Test that API call statistics of auto remediation are passed to nagios."""
+    output = tempfile.NamedTemporaryFile(mode="w")
+    output.write("all ports are healthy | api_calls=2 api_time=0.100s")
+    output.flush()
+    status, message = check_port_security.nagios_check(output.name, 3)
+    assert status == check_port_security.NAGIOS_STATUS_OK
+    assert message == "auto remediation output file is healthy | api_calls=2 api_time=0.100s"
+
+
+def test_auto_remediation_snapshot(tmp_path):
+    """Test that bad ports from snapshot are checked again before remediation."""
+    snapshot = str(tmp_path / "inventory_snapshot.json")
+    bad_port = {
+        "id": "port-0",
+        "is_port_security_enabled": True,
+        "binding_vnic_type": "direct",
+        "binding_profile": {"capabilities": ["switchdev"]},
+    }
+    ports = [bad_port, dict(bad_port, id="port-1"), dict(bad_port, id="port-2")]
+    ports.append({"id": "port-3", "is_port_security_enabled": False})
+    osc_snapshot.write_snapshot({"ports": {"items": ports, "latency": 1}}, snapshot)
+    conn = mock.MagicMock()
+    conn.network.find_port.side_effect = [
+        osc_snapshot.SnapshotResource(bad_port),
+        # port-1 was fixed and port-2 deleted after the snapshot was taken
+        osc_snapshot.SnapshotResource(dict(bad_port, id="port-1", is_port_security_enabled=False)),
+        None,
+    ]
+
+    lines = check_port_security.auto_remediation(
+        conn, snapshot=osc_snapshot.load_snapshot(snapshot)
+    )
+
+    assert lines == ["port-0 FIXED"]
+    conn.network.ports.assert_not_called()
+    conn.network.update_port.assert_called_once_with("port-0", port_security_enabled=False)
@@ -1,14 +1,25 @@
 """Test resources nagios check script."""
 
 import os
+import re
+import sqlite3
 import sys
 import tempfile
 from unittest import mock
 from unittest.mock import MagicMock
 
+import openstack.exceptions
+import osc_snapshot
 import pytest
-from check_resources import Results, check, parse_arguments, set_openstack_credentials
-from nagios_plugin3 import CriticalError, WarnError
+from check_resources import (
+    Results,
+    check,
+    check_many,
+    parse_arguments,
+    set_openstack_credentials,
+)
+from nagios_plugin3 import CriticalError, UnknownError, WarnError
+from osc_output import OUTPUT_BUDGET
 
 
 class FakeResource:
@@ -110,6 +121,12 @@ def test_parse_arguments(cli_args, exp_output, monkeypatch):
         ("security-group", ["--all"]),
         ("subnet", ["--all"]),
         ("network", ["--skip-id", "1"]),
+        ("server", ["-i", "1", "--shard", "0/2"]),
+        ("server", ["--all", "--shard", "2/2"]),
+        ("server", ["--all", "--shard", "1"]),
+        ("server", ["--all", "--shard", "0/2"]),
+        ("server", ["-i", "1", "--max-critical", "5"]),
+        ("port", ["--all", "--max-critical", "0"]),
     ],
 )
 def test_parse_arguments_error(resource, args, monkeypatch):
@@ -120,6 +137,26 @@ def test_parse_arguments_error(resource, args, monkeypatch):
         parse_arguments()
 
 
+def test_parse_arguments_shard(monkeypatch):
+    argv = ["", "port", "--all", "--shard", "1/4", "--snapshot", "/tmp/snapshot.json"]
+    monkeypatch.setattr(sys, "argv", argv)
+    assert parse_arguments().shard == (1, 4)
+
+    argv = ["", "port:--all,--shard=1/4", "--snapshot", "/tmp/snapshot.json"]
+    monkeypatch.setattr(sys, "argv", argv)
+    assert parse_arguments().specs[0].shard == (1, 4)
+
+
+def conn_compute_get_server(servers):
+    def _conn_compute_get_server(server_id):
+        for server in servers:
+            if server.id == server_id:
+                return server
+        raise openstack.exceptions.ResourceNotFound(server_id)
+
+    return _conn_compute_get_server
+
+
 @pytest.mark.parametrize(
     "servers, check_kwargs, exp_ids",
     [
@@ -144,15 +181,20 @@ def test_parse_arguments_error(resource, args, monkeypatch):
 def test_check_passed(servers, check_kwargs, exp_ids):
     """Test NRPE check for OpenStack servers that passed."""
     servers = [FakeResource("server", **server) for server in servers]
-    with mock.patch("check_resources.openstack") as openstack:
-        openstack.connect.return_value = mock_conn = MagicMock()
+    with mock.patch("check_resources.openstack") as mock_openstack:
+        mock_openstack.exceptions = openstack.exceptions
+        mock_openstack.connect.return_value = mock_conn = MagicMock()
         mock_conn.compute.servers.return_value = servers
+        mock_conn.compute.get_server.side_effect = conn_compute_get_server(servers)
         with mock.patch("check_resources.print") as mock_print:
             check("server", **check_kwargs)
             messages = os.linesep.join(
                 "server '{}' is in ACTIVE status" "".format(_id) for _id in exp_ids
             )
-            output = "servers {0}/{0} passed{1}{2}" "".format(len(exp_ids), os.linesep, messages)
+            # servers requested by ID are not listed
+            output = "servers {0}/{0} passed{1}{2} | listings={3}" "".format(
+                len(exp_ids), os.linesep, messages, int(check_kwargs["check_all"])
+            )
             mock_print.assert_called_once_with("OK: ", output)
 
 
@@ -172,7 +214,9 @@ def test_check_passed_by_existence(subnets, ids):
         with mock.patch("check_resources.print") as mock_print:
             check("subnet", ids=ids)
             messages = os.linesep.join("subnet '{}' exists".format(_id) for _id in ids)
-            output = "subnets {0}/{0} passed{1}{2}" "".format(len(ids), os.linesep, messages)
+            output = "subnets {0}/{0} passed{1}{2} | listings=1" "".format(
+                len(ids), os.linesep, messages
+            )
             mock_print.assert_called_once_with("OK: ", output)
 
 
@@ -192,6 +236,8 @@ def conn_network_ips_returns(ips):
         for ip in ips:
             check = True
             for k, v in kwargs.items():
+                if k == "fields" or (isinstance(v, list) and getattr(ip, k) in v):
+                    continue
                 if not getattr(ip, k) == v:
                     check = False
                     break
@@ -341,9 +387,10 @@ def test_check_unknown_warning(ports, exp_out):
 def test_check_critical_error(servers, ids, exp_out):
     """Test NRPE check for OpenStack servers with critical output."""
     servers = [FakeResource("server", **server) for server in servers]
-    with mock.patch("check_resources.openstack") as openstack:
-        openstack.connect.return_value = mock_conn = MagicMock()
-        mock_conn.compute.servers.return_value = servers
+    with mock.patch("check_resources.openstack") as mock_openstack:
+        mock_openstack.exceptions = openstack.exceptions
+        mock_openstack.connect.return_value = mock_conn = MagicMock()
+        mock_conn.compute.get_server.side_effect = conn_compute_get_server(servers)
         with pytest.raises(CriticalError) as error:
             check("server", ids=ids)
 
@@ -456,20 +503,490 @@ def test_results_add_result(args, exp_args):
     mock_add_result = MagicMock()
     results._add_result = mock_add_result
 
-    # Change group to mock object
-    for group in ["ok", "warning", "critical", "not_found", "skipped"]:
-        setattr(results, group, MagicMock())
-    exp_args[1] = getattr(results, exp_args[1])
-
     results.add_result(**args)
-    mock_add_result.assert_called_once_with(*exp_args)
+    mock_add_result.assert_called_once()
+    id_, state, exit_code, msg, output_group = mock_add_result.call_args[0]
+    assert [id_, state, exit_code, msg()] == exp_args
+    assert output_group is None
 
 
 def test_result__add_result():
     results = Results()
-    group = []
 
-    results._add_result("123", group, 1, "msg123")
+    results._add_result("123", "warning", 1, lambda: "msg123")
     assert results.exit_code == 1
-    assert results._messages == [(1, "msg123")]
-    assert group == ["123"]
+    assert results.messages == ["msg123"]
+    assert results.count == 1
+    assert results.counts == {"warning": 1}
+
+
+def test_check_snapshot(tmp_path):
+    """Test NRPE check evaluating inventory snapshot instead of the API."""
+    snapshot = str(tmp_path / "inventory_snapshot.json")
+    ports = [
+        {"id": "port-0", "status": "ACTIVE"},
+        {"id": "port-1", "status": "DOWN", "device_id": "vm-1"},
+        {"id": "port-2", "status": "DOWN", "binding_vif_type": "unbound"},
+        {"id": "port-3", "status": "ACTIVE", "device_owner": "network:dhcp"},
+    ]
+    servers = [{"id": "vm-1", "status": "SHUTOFF", "power_state": 4}]
+    osc_snapshot.write_snapshot(
+        {"ports": {"items": ports, "latency": 1}, "servers": {"items": servers, "latency": 1}},
+        snapshot,
+    )
+
+    with mock.patch("check_resources.openstack.connect") as connect:
+        with pytest.raises(WarnError) as error:
+            check("port", set(), check_all=True, snapshot=snapshot)
+
+        connect.assert_not_called()
+
+    assert "port 'port-1' is in SHUTOFF status" in str(error.value)
+    assert "port-2" not in str(error.value)
+    assert "port-3" not in str(error.value)
+
+
+def test_check_snapshot_select_not_stored(tmp_path):
+    """Test that select by attribute which is not in snapshot is UNKNOWN."""
+    snapshot = str(tmp_path / "inventory_snapshot.json")
+    fields = ["id", "status", "binding_vif_type", "device_owner", "network_id"]
+    ports = {"items": [{"id": "port-0", "status": "ACTIVE"}], "fields": fields}
+    osc_snapshot.write_snapshot({"ports": dict(ports, latency=1)}, snapshot)
+
+    with pytest.raises(UnknownError, match="attribute description is not in"):
+        check("port", set(), select={"description": "x"}, check_all=True, snapshot=snapshot)
+
+
+def test_check_snapshot_servers_scope(tmp_path):
+    """Test that API and snapshot modes check servers of the same project."""
+    servers = [
+        {"id": "vm-0", "status": "ACTIVE", "project_id": "admin"},
+        {"id": "vm-1", "status": "ERROR", "project_id": "tenant"},
+    ]
+
+    def compute_servers(all_projects=False, **query):
+        return [
+            FakeResource("server", id_=server["id"], status=server["status"])
+            for server in servers
+            if all_projects or server["project_id"] == "admin"
+        ]
+
+    snapshot = str(tmp_path / "inventory_snapshot.json")
+    osc_snapshot.write_snapshot(
+        {"servers": {"items": servers, "latency": 1}}, snapshot, project_id="admin"
+    )
+    with mock.patch("check_resources.print") as mock_print:
+        check("server", set(), check_all=True, snapshot=snapshot)
+        snapshot_output = mock_print.call_args
+
+    with mock.patch("check_resources.openstack") as mock_openstack:
+        mock_openstack.connect.return_value = mock_conn = MagicMock()
+        mock_conn.compute.servers.side_effect = compute_servers
+        with mock.patch("check_resources.print") as mock_print:
+            check("server", set(), check_all=True)
+            api_output = mock_print.call_args
+
+    assert "vm-1" not in str(api_output)
+    assert api_output == snapshot_output
+
+
+def test_check_snapshot_select_api_filter(tmp_path):
+    """Test that API filter of select is evaluated by snapshot attribute."""
+    snapshot = str(tmp_path / "inventory_snapshot.json")
+    ports = [
+        {"id": "port-0", "status": "DOWN", "binding_host_id": "host-0"},
+        {"id": "port-1", "status": "ACTIVE", "binding_host_id": "host-1"},
+    ]
+    osc_snapshot.write_snapshot({"ports": {"items": ports, "latency": 1}}, snapshot)
+
+    with pytest.raises(CriticalError) as error:
+        check(
+            "port",
+            set(),
+            select={"binding:host_id": "host-0"},
+            check_all=True,
+            snapshot=snapshot,
+        )
+
+    assert "port 'port-0' is in DOWN status" in str(error.value)
+    assert "port-1" not in str(error.value)
+
+
+def test_check_snapshot_stale(tmp_path):
+    """Test NRPE check evaluating stale inventory snapshot."""
+    snapshot = str(tmp_path / "inventory_snapshot.json")
+    osc_snapshot.write_snapshot({"ports": {"items": [], "latency": 1}}, snapshot)
+
+    with pytest.raises(UnknownError, match="seconds old"):
+        check("port", set(), check_all=True, snapshot=snapshot, snapshot_max_age=-1)
+
+
+@pytest.mark.parametrize(
+    "select, exp_query",
+    [
+        (
+            None,
+            {
+                "fields": [
+                    "id",
+                    "status",
+                    "device_id",
+                    "device_owner",
+                    "binding:vif_type",
+                    "network_id",
+                ]
+            },
+        ),
+        (
+            {"network_id": "net-1", "subnet_id": "subnet-1"},
+            {
+                "network_id": "net-1",
+                "subnet_id": "subnet-1",
+                "fields": [
+                    "id",
+                    "status",
+                    "device_id",
+                    "device_owner",
+                    "binding:vif_type",
+                    "network_id",
+                ],
+            },
+        ),
+        ({"network_id": "net-1", "description": "port-1"}, {"network_id": "net-1"}),
+    ],
+)
+def test_check_list_fields(select, exp_query):
+    """Test that ports are listed once, filtered by the API and only with fields read."""
+    ports = [FakePortResource("port", "1", status="ACTIVE", network_id="net-1")]
+    with mock.patch("check_resources.openstack.connect") as connect:
+        connect.return_value = mock_conn = MagicMock()
+        mock_conn.network.ports.side_effect = conn_network_port_returns(ports)
+        with mock.patch("check_resources.print"):
+            check("port", set(), select=select, check_all=True)
+
+    mock_conn.network.ports.assert_called_once_with(**exp_query)
+
+
+@pytest.mark.parametrize(
+    "select, exp_ids",
+    [
+        ({"description": "port-1"}, ["1"]),
+        ({"description": "port-1", "device_owner": "compute:nova"}, ["1"]),
+        ({"description": "port-1", "mac_address": "fa:16:3e:00:00:02"}, []),
+        ({"description": "port-3"}, []),
+    ],
+)
+def test_check_select(select, exp_ids, capsys):
+    """Test that resources must match all `--select` values filtered by the check."""
+    ports = [
+        FakePortResource("port", "1", status="ACTIVE", description="port-1"),
+        FakePortResource("port", "2", status="ACTIVE", description="port-2"),
+    ]
+    with mock.patch("check_resources.openstack.connect") as connect:
+        connect.return_value = mock_conn = MagicMock()
+        # the API filters are applied by the API, here by the mock
+        mock_conn.network.ports.side_effect = lambda **query: [
+            port for port in ports if "mac_address" not in query
+        ]
+        check("port", set(), select=select, check_all=True)
+
+    assert re.findall(r"port '(\d+)'", capsys.readouterr().out) == exp_ids
+
+
+def test_check_port_shutoff_servers():
+    """Test that power state of servers is looked up by one listing."""
+    ports = [
+        FakePortResource("port", "1", status="DOWN", device_id="vm-1"),
+        FakePortResource("port", "2", status="DOWN", device_id="vm-2"),
+        FakePortResource("port", "3", status="ACTIVE", device_id="vm-3"),
+    ]
+    servers = [FakeResource("server", "vm-1", status="SHUTOFF", power_state=4)]
+    with mock.patch("check_resources.openstack.connect") as connect:
+        connect.return_value = mock_conn = MagicMock()
+        mock_conn.network.ports.side_effect = conn_network_port_returns(ports)
+        mock_conn.compute.servers.return_value = servers
+        with pytest.raises(CriticalError) as error:
+            check("port", set(), check_all=True)
+
+    mock_conn.compute.servers.assert_called_once_with(
+        details=True, all_projects=True, status="SHUTOFF"
+    )
+    mock_conn.compute.get_server.assert_not_called()
+    assert "port '1' is in SHUTOFF status" in str(error.value)
+    assert "port '2' is in DOWN status" in str(error.value)
+    assert "| listings=2" in str(error.value)
+
+
+def test_check_ids_filter():
+    """Test that only the requested Neutron resources are listed."""
+    ids = {"port-{:03d}".format(i) for i in range(150)}
+    ports = [FakePortResource("port", id_, status="ACTIVE") for id_ in sorted(ids)]
+    with mock.patch("check_resources.openstack.connect") as connect:
+        connect.return_value = mock_conn = MagicMock()
+        mock_conn.network.ports.side_effect = lambda id, fields: [
+            port for port in ports if port.id in id
+        ]
+        with pytest.raises(CriticalError) as error:
+            check("port", ids | {"missing"}, check_all=False)
+
+    fields = ["id", "status", "device_id", "device_owner", "binding:vif_type", "network_id"]
+    assert mock_conn.network.ports.call_args_list == [
+        mock.call(id=sorted(ids | {"missing"})[:100], fields=fields),
+        mock.call(id=sorted(ids | {"missing"})[100:], fields=fields),
+    ]
+    assert str(error.value).startswith("CRITICAL: ports 1/151 were not found, 150/151 passed")
+    assert "| listings=2" in str(error.value)
+
+
+def test_check_ids_get_servers():
+    """Test that servers requested by ID are fetched concurrently."""
+    servers = [FakeResource("server", "vm-{}".format(i), status="ACTIVE") for i in range(20)]
+    with mock.patch("check_resources.openstack.connect") as connect:
+        connect.return_value = mock_conn = MagicMock()
+        mock_conn.compute.get_server.side_effect = conn_compute_get_server(servers)
+        with pytest.raises(CriticalError) as error:
+            check("server", {server.id for server in servers} | {"missing"})
+
+    mock_conn.compute.servers.assert_not_called()
+    assert mock_conn.compute.get_server.call_count == 21
+    assert str(error.value).startswith("CRITICAL: servers 1/21 were not found, 20/21 passed")
+    assert "| listings=0" in str(error.value)
+
+
+def test_check_shards(capsys):
+    """Test that every resource is checked by exactly one shard."""
+    ports = [FakePortResource("port", "port-{}".format(i), status="ACTIVE") for i in range(50)]
+    checked = []
+    with mock.patch("check_resources.openstack.connect") as connect:
+        connect.return_value = mock_conn = MagicMock()
+        mock_conn.network.ports.return_value = ports
+        for index in range(3):
+            check("port", set(), check_all=True, shard=(index, 3))
+            output = capsys.readouterr().out
+            assert output.startswith("OK:  ports (shard {}/3) ".format(index))
+            checked += re.findall(r"port '(port-\d+)'", output)
+
+    assert sorted(checked) == sorted(port.id for port in ports)
+
+
+def test_check_output_budget(tmp_path):
+    """Test that output keeps the most severe messages and the detail file all of them."""
+    ports = [
+        FakePortResource("port", "port-{:04d}".format(i), status="ACTIVE", network_id="net-1")
+        for i in range(1000)
+    ]
+    ports.append(FakePortResource("port", "port-down", status="DOWN", network_id="net-2"))
+    detail_file = str(tmp_path / "ports.out")
+    with mock.patch("check_resources.openstack.connect") as connect:
+        connect.return_value = mock_conn = MagicMock()
+        mock_conn.network.ports.return_value = ports
+        with pytest.raises(CriticalError) as error:
+            check("port", set(), check_all=True, output_detail=detail_file)
+
+    output = str(error.value)
+    assert output.startswith("CRITICAL: ports 1/1001 are DOWN, 1000/1001 passed")
+    assert "port 'port-down' is in DOWN status" in output
+    assert "more lines omitted (" in output
+    assert "OK), by network: net-1 (" in output
+    assert len(output.encode("utf-8")) <= OUTPUT_BUDGET
+    with open(detail_file) as file:
+        assert len(file.read().splitlines()) == 1001
+
+
+def test_check_state_file(tmp_path):
+    """Test that checks with state file report transitions since the previous run."""
+    state_file = str(tmp_path / "check_ports.state")
+    runs = [
+        {"port-1": "ACTIVE", "port-2": "DOWN", "port-3": "ACTIVE"},
+        {"port-1": "DOWN", "port-2": "DOWN", "port-3": "ACTIVE"},
+        {"port-1": "ACTIVE", "port-2": "DOWN", "port-3": "ACTIVE"},
+    ]
+    outputs = []
+    with mock.patch("check_resources.openstack.connect") as connect, mock.patch(
+        "osc_state.time.time", side_effect=[1000, 8500, 8560]
+    ):
+        connect.return_value = mock_conn = MagicMock()
+        for statuses in runs:
+            mock_conn.network.ports.return_value = [
+                FakePortResource("port", id_, status=status) for id_, status in statuses.items()
+            ]
+            with pytest.raises(CriticalError) as error:
+                check("port", set(), check_all=True, state_file=state_file)
+
+            outputs.append(str(error.value).partition(" | ")[0])
+
+    assert outputs[0].splitlines() == [
+        "CRITICAL: ports 1/3 are DOWN, 2/3 passed",
+        "port 'port-2' is in DOWN status",
+        "port 'port-3' is in ACTIVE status",
+        "port 'port-1' is in ACTIVE status",
+    ]
+    assert outputs[1].splitlines() == [
+        "CRITICAL: ports 2/3 are DOWN, 1/3 passed, since last run: 1 went DOWN",
+        "port 'port-2' is in DOWN status for 2h05m",
+        "port 'port-1' is in DOWN status (new)",
+    ]
+    assert outputs[2].splitlines() == [
+        "CRITICAL: ports 1/3 are DOWN, 2/3 passed, since last run: 1 recovered",
+        "port 'port-2' is in DOWN status for 2h06m",
+        "port 'port-1' is in ACTIVE status",
+    ]
+
+
+def test_check_state_file_output_detail(tmp_path):
+    """Test that the detail file has all resources, including those which stay OK."""
+    state_file = str(tmp_path / "check_ports.state")
+    detail_file = str(tmp_path / "check_ports.out")
+    ports = [
+        FakePortResource("port", "port-1", status="DOWN"),
+        FakePortResource("port", "port-2", status="ACTIVE"),
+    ]
+    with mock.patch("check_resources.openstack.connect") as connect, mock.patch(
+        "osc_state.time.time", side_effect=[1000, 1060]
+    ):
+        connect.return_value.network.ports.return_value = ports
+        for _ in range(2):
+            with pytest.raises(CriticalError) as error:
+                check(
+                    "port",
+                    set(),
+                    check_all=True,
+                    output_detail=detail_file,
+                    state_file=state_file,
+                )
+
+    assert "port-2" not in str(error.value)
+    with open(detail_file) as file:
+        assert file.read().splitlines() == [
+            "port 'port-1' is in DOWN status for 1m",
+            "port 'port-2' is in ACTIVE status",
+        ]
+
+
+def test_check_max_critical(tmp_path):
+    """Test that the check stops listing after the number of DOWN resources."""
+    listed = []
+
+    def ports(**_):
+        for i in range(1000):
+            listed.append(i)
+            yield FakePortResource(
+                "port", "port-{:04d}".format(i), status="DOWN" if i % 10 == 0 else "ACTIVE"
+            )
+
+    state_file = str(tmp_path / "check_ports.state")
+    with mock.patch("check_resources.openstack.connect") as connect, mock.patch(
+        "osc_state.time.time", side_effect=[1000, 1060]
+    ):
+        connect.return_value = mock_conn = MagicMock()
+        mock_conn.network.ports.side_effect = ports
+        with pytest.raises(CriticalError) as error:
+            check("port", set(), check_all=True, state_file=state_file)
+        listed.clear()
+        with pytest.raises(CriticalError) as error:
+            check("port", set(), check_all=True, state_file=state_file, max_critical=5)
+
+    assert len(listed) == 41
+    output = str(error.value).partition(" | ")[0].splitlines()
+    assert output[0] == "CRITICAL: ports >=5 are DOWN (scan stopped early after 41 resources)"
+    assert output[1:] == [
+        "port 'port-0040' is in DOWN status for 1m",
+        "port 'port-0030' is in DOWN status for 1m",
+        "port 'port-0020' is in DOWN status for 1m",
+        "port 'port-0010' is in DOWN status for 1m",
+        "port 'port-0000' is in DOWN status for 1m",
+    ]
+    # the states of resources which were not evaluated are kept
+    with sqlite3.connect(state_file) as db:
+        assert db.execute("SELECT COUNT(*) FROM states").fetchone() == (1000,)
+
+
+def test_check_state_file_error(tmp_path):
+    with mock.patch("check_resources.openstack.connect"):
+        with pytest.raises(UnknownError, match="state file"):
+            check("port", set(), check_all=True, state_file=str(tmp_path / "a" / "b.state"))
+
+
+def test_parse_arguments_specs(monkeypatch):
+    """Test parsing of several resource specifications."""
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["", "port:--all,--skip-id=1,--select=network_id=net-1", "network:--id=2,--id=3"],
+    )
+    args = parse_arguments()
+
+    assert [spec.resource for spec in args.specs] == ["port", "network"]
+    assert args.specs[0].all and args.specs[0].skip_id == ["1"]
+    assert args.specs[0].select == ["network_id=net-1"]
+    assert args.specs[1].id == ["2", "3"]
+
+
+@pytest.mark.parametrize(
+    "cli_args",
+    [
+        ["port:--all", "--all"],
+        ["port:--all", "network:--all"],
+        ["port:--id=1,--shard=0/2"],
+        ["port:--all,--shard=0/2"],
+    ],
+)
+def test_parse_arguments_specs_error(cli_args, monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["", *cli_args])
+    with pytest.raises(SystemExit):
+        parse_arguments()
+
+
+def test_check_many():
+    """Test that several resources are checked over one connection."""
+    argv = ["", "port:--all", "floating-ip:--all", "network:--id=net-1,--id=net-2"]
+    with mock.patch.object(sys, "argv", argv):
+        specs = parse_arguments().specs
+
+    with mock.patch("check_resources.openstack.connect") as connect:
+        connect.return_value = mock_conn = MagicMock()
+        mock_conn.network.ports.return_value = [
+            FakePortResource("port", "port-1", status="DOWN"),
+            FakePortResource("port", "port-2", status="ACTIVE"),
+        ]
+        mock_conn.network.ips.return_value = [FakeResource("floating-ip", "ip-1", "ACTIVE")]
+        mock_conn.network.networks.return_value = [FakeResource("network", "net-1")]
+        with pytest.raises(CriticalError) as error:
+            check_many(specs)
+
+    connect.assert_called_once()
+    output, _, perfdata = str(error.value).partition(" | ")
+    assert output.splitlines() == [
+        "CRITICAL: ports 1/2 are DOWN, 1/2 passed; floating-ips 1/1 passed; "
+        "networks 1/2 were not found, 1/2 passed",
+        "ports 1/2 are DOWN, 1/2 passed",
+        "port 'port-1' is in DOWN status",
+        "port 'port-2' is in ACTIVE status",
+        "floating-ips 1/1 passed",
+        "floating-ip 'ip-1' is in ACTIVE status",
+        "networks 1/2 were not found, 1/2 passed",
+        "network 'net-2' was not found",
+        "network 'net-1' exists",
+    ]
+    assert perfdata.startswith("listings=4")
+
+
+def test_check_many_output_budget():
+    """Test that the sections with their titles and perfdata fit the output budget."""
+    with mock.patch.object(sys, "argv", ["", "port:--all", "floating-ip:--all"]):
+        specs = parse_arguments().specs
+
+    with mock.patch("check_resources.openstack.connect") as connect:
+        connect.return_value = mock_conn = MagicMock()
+        mock_conn.network.ports.return_value = [
+            FakePortResource("port", "port-{:04d}".format(i), status="DOWN") for i in range(1000)
+        ]
+        mock_conn.network.ips.return_value = [
+            FakeResource("floating-ip", "ip-{:04d}".format(i), "ACTIVE") for i in range(1000)
+        ]
+        with pytest.raises(CriticalError) as error:
+            check_many(specs)
+
+    output = str(error.value)
+    assert "more lines omitted (" in output
+    assert len(output.encode("utf-8")) <= OUTPUT_BUDGET
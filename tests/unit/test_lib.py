@@ -1,10 +1,12 @@
 """Test helper library functions."""
 
 import base64
+import json
 from unittest import mock
 from unittest.mock import ANY, MagicMock, mock_open
 
 import keystoneauth1
+import lib_openstack_service_checks
 import pytest
 from charmhelpers.core import hookenv
 from lib_openstack_service_checks import (
@@ -23,6 +25,7 @@ def test_openstackservicechecks_common_properties(openstackservicechecks):
     assert openstackservicechecks.contrail_analytics_vip == ""
     assert openstackservicechecks.is_neutron_agents_check_enabled
     assert not openstackservicechecks.is_rally_enabled
+    assert openstackservicechecks.api_limit_state_dir == "/var/lib/nagios/osc-api-limit"
     assert openstackservicechecks.novarc == "/var/lib/nagios/nagios.novarc"
     assert openstackservicechecks.nova_crit == 1
     assert openstackservicechecks.nova_warn == 2
@@ -187,6 +190,35 @@ def test_helper_get_resource_check_kwargs(resource, ids, skip_ids, exp_kwargs):
         assert kwargs == exp_kwargs
 
 
+def test_helper_get_resource_check_kwargs_state():
+    """Test that checks record resource states when enabled."""
+    with mock.patch("charmhelpers.core.hookenv.config") as mock_config:
+        mock_config.return_value = {"resource-check-state": True}
+        kwargs = OSCHelper()._get_resource_check_kwargs("port", ["all"], shard=(1, 2))
+
+    assert kwargs["check_cmd"] == (
+        "/usr/local/lib/nagios/plugins/check_resources.py port --all --shard 1/2"
+        " --state-file /var/lib/nagios/check_ports_1.state"
+    )
+
+
+def test_helper_get_resource_check_kwargs_max_critical():
+    """Test that checks of all resources stop after the number of DOWN resources."""
+    with mock.patch("charmhelpers.core.hookenv.config") as mock_config:
+        mock_config.return_value = {"check-ports": "all", "resource-check-max-critical": 500}
+        helper = OSCHelper()
+        kwargs = helper._get_resource_check_kwargs("port", ["all"], ["1"])
+        kwargs_ids = helper._get_resource_check_kwargs("port", ["1"])
+        spec = helper._get_resource_spec("port")
+
+    assert kwargs["check_cmd"] == (
+        "/usr/local/lib/nagios/plugins/check_resources.py port --all --skip-id 1"
+        " --max-critical 500"
+    )
+    assert kwargs_ids["check_cmd"] == "/usr/local/lib/nagios/plugins/check_resources.py port --id 1"
+    assert spec == "port:--all,--max-critical=500"
+
+
 @mock.patch("charmhelpers.core.hookenv.config")
 def test_render_resource_check_by_existence(mock_config):
     """Test rendering NRPE check for OpenStack resource."""
@@ -214,6 +246,126 @@ def test_render_resource_check_by_existence(mock_config):
     nrpe.reset_mock()
 
 
+@mock.patch("charmhelpers.core.hookenv.config")
+def test_render_resources_check_by_status_shards(mock_config, tmp_path):
+    """Test rendering NRPE checks for shards of OpenStack resources."""
+    nrpe = MagicMock()
+    for name in ("check_ports_0.cfg", "check_ports_3.cfg", "check_ports_10.cfg"):
+        (tmp_path / name).touch()
+
+    mock_config.return_value = {
+        "check-ports": "all",
+        "resource-check-shards": 2,
+        "inventory-snapshot": True,
+        "inventory-snapshot-max-age": 900,
+    }
+    with mock.patch("lib_openstack_service_checks.NRPE.nrpe_confdir", str(tmp_path)):
+        OSCHelper()._render_resources_check_by_status(nrpe, "port")
+
+    assert [call.kwargs["shortname"] for call in nrpe.add_check.call_args_list] == [
+        "ports_0",
+        "ports_1",
+    ]
+    assert nrpe.add_check.call_args_list[1].kwargs["check_cmd"] == (
+        "/usr/local/lib/nagios/plugins/check_resources.py port --all --shard 1/2 "
+        "--snapshot /var/lib/nagios/inventory_snapshot.json --snapshot-max-age 900"
+    )
+    assert sorted(call.kwargs["shortname"] for call in nrpe.remove_check.call_args_list) == [
+        "ports",
+        "ports_10",
+        "ports_3",
+    ]
+
+    # explicit IDs are never sharded
+    nrpe.reset_mock()
+    mock_config.return_value = {"check-ports": "1,2", "resource-check-shards": 2}
+    with mock.patch("lib_openstack_service_checks.NRPE.nrpe_confdir", str(tmp_path)):
+        OSCHelper()._render_resources_check_by_status(nrpe, "port")
+
+    nrpe.add_check.assert_called_once()
+    assert nrpe.add_check.call_args.kwargs["shortname"] == "ports"
+    assert nrpe.remove_check.call_count == 3
+
+
+@mock.patch("charmhelpers.core.hookenv.config")
+def test_render_resources_combined_check(mock_config, tmp_path):
+    """Test rendering one NRPE check of all OpenStack resources."""
+    nrpe = MagicMock()
+    (tmp_path / "check_ports_1.cfg").touch()
+    mock_config.return_value = {
+        "check-networks": "net-1,net-2",
+        "check-ports": "all",
+        "skip-ports": "port-1",
+        "check-servers": "vm-1",
+    }
+    with mock.patch("lib_openstack_service_checks.NRPE.nrpe_confdir", str(tmp_path)):
+        OSCHelper()._render_resources_combined_check(nrpe)
+
+    nrpe.add_check.assert_called_once_with(
+        shortname="resources",
+        description=(
+            "Check resources: network:--id=net-1,--id=net-2 server:--id=vm-1 "
+            "port:--all,--skip-id=port-1"
+        ),
+        check_cmd=(
+            "/usr/local/lib/nagios/plugins/check_resources.py network:--id=net-1,--id=net-2 "
+            "server:--id=vm-1 port:--all,--skip-id=port-1"
+        ),
+    )
+    removed = [call.kwargs["shortname"] for call in nrpe.remove_check.call_args_list]
+    assert sorted(removed) == [
+        "floating_ips",
+        "networks",
+        "ports",
+        "ports_1",
+        "security_groups",
+        "servers",
+        "subnets",
+    ]
+
+    mock_config.return_value = {"check-networks": "all"}
+    with pytest.raises(OSCConfigError):
+        OSCHelper()._render_resources_combined_check(nrpe)
+
+
+@mock.patch("charmhelpers.core.hookenv.config")
+def test_resource_check_shards_exception(mock_config):
+    mock_config.return_value = {"resource-check-shards": 0}
+    assert OSCHelper().resource_check_shards == 1
+
+    mock_config.return_value = {"resource-check-shards": -1}
+    with pytest.raises(OSCConfigError):
+        OSCHelper().resource_check_shards
+
+    # every shard would list the whole collection from the API
+    mock_config.return_value = {"resource-check-shards": 2}
+    with pytest.raises(OSCConfigError, match="requires inventory-snapshot"):
+        OSCHelper().resource_check_shards
+
+    mock_config.return_value = {"resource-check-shards": 2, "inventory-snapshot": True}
+    assert OSCHelper().resource_check_shards == 2
+
+
+@mock.patch("charmhelpers.core.hookenv.config")
+def test_allocations_placement_concurrency_exception(mock_config):
+    mock_config.return_value = {"allocations-placement-concurrency": 16}
+    assert OSCHelper().allocations_placement_concurrency == 16
+
+    mock_config.return_value = {"allocations-placement-concurrency": -1}
+    with pytest.raises(OSCConfigError):
+        OSCHelper().allocations_placement_concurrency
+
+
+@mock.patch("charmhelpers.core.hookenv.config")
+def test_resource_check_max_critical_exception(mock_config):
+    mock_config.return_value = {}
+    assert OSCHelper().resource_check_max_critical == 0
+
+    mock_config.return_value = {"resource-check-max-critical": -1}
+    with pytest.raises(OSCConfigError):
+        OSCHelper().resource_check_max_critical
+
+
 @mock.patch("charmhelpers.core.hookenv.config")
 def test_render_resources_check_by_status(mock_config):
     """Test rendering NRPE check for OpenStack resource."""
@@ -465,6 +617,41 @@ def test__configure_check_ssl_cert_options_exception(mock_config, ignore_ocsp, m
         OSCHelper()._configure_check_ssl_cert_options()
 
 
+@pytest.mark.parametrize(
+    "rate_limit, max_concurrency, exp_rate_limit",
+    [
+        ("", 0, ""),
+        ("neutron=5, nova=10.5, *=20", 4, "neutron=5,nova=10.5,*=20"),
+    ],
+)
+@mock.patch("charmhelpers.core.hookenv.config")
+def test_api_limits(mock_config, rate_limit, max_concurrency, exp_rate_limit):
+    """Test validation of API request limits."""
+    mock_config.return_value = {
+        "api-rate-limit": rate_limit,
+        "api-max-concurrency": max_concurrency,
+    }
+    assert OSCHelper().api_rate_limit == exp_rate_limit
+    assert OSCHelper().api_max_concurrency == max_concurrency
+
+
+@pytest.mark.parametrize(
+    "option, value",
+    [
+        ("api-rate-limit", "neutron"),
+        ("api-rate-limit", "neutron=0"),
+        ("api-rate-limit", "neutron=fast"),
+        ("api-max-concurrency", -1),
+    ],
+)
+@mock.patch("charmhelpers.core.hookenv.config")
+def test_api_limits_exception(mock_config, option, value):
+    """Test validation of API request limits raising exception."""
+    mock_config.return_value = {option: value}
+    with pytest.raises(OSCConfigError):
+        getattr(OSCHelper(), option.replace("-", "_"))
+
+
 @pytest.mark.parametrize(
     "distrib_release,render_check",
     [("18.04", False), ("20.04", True), ("22.04", True)],
@@ -505,6 +692,210 @@ def test__render_allocation_checks(
         nrpe.add_check.assert_not_called()
 
 
+@mock.patch("lib_openstack_service_checks.OSCHelper._install_scripts_shared_modules")
+@mock.patch("builtins.open", new_callable=mock_open)
+@mock.patch("lib_openstack_service_checks.OSCHelper.endpoint_service_names")
+@mock.patch("charmhelpers.core.hookenv.config")
+@mock.patch("charmhelpers.core.host.lsb_release", return_value={"DISTRIB_RELEASE": "22.04"})
+@mock.patch("charmhelpers.core.host.rsync")
+@mock.patch("charmhelpers.core.hookenv.charm_dir", return_value="/mock/charm/dir")
+def test__render_allocation_checks_incremental(
+    mock_charm_dir,
+    mock_rsync,
+    mock_lsb_release,
+    mock_config,
+    mock_endpoint_service_names,
+    mock_open_call,
+    mock_install_modules,
+):
+    """Test that the cron job keeps a cache with full synchronization interval."""
+    mock_config.return_value = {
+        "check-allocations": True,
+        "allocations-full-sync-interval": 3600,
+    }
+    mock_endpoint_service_names.values.return_value = ["placement"]
+
+    OSCHelper()._render_allocation_checks(MagicMock())
+
+    cron = "".join(call.args[0] for call in mock_open_call().write.call_args_list)
+    assert cron.split("\n")[1].startswith("*/5 * * * * nagios ")
+    assert cron.split("\n")[1].endswith(
+        "run_allocation_checks.py --placement-workers 8"
+        " --cache /var/lib/nagios/allocations.cache --full-sync-interval 3600 --interval 5"
+    )
+
+
+@pytest.mark.parametrize(
+    "minutes, exp_schedule",
+    [
+        (1, ("*/5 * * * *", 5)),
+        (11, ("*/15 * * * *", 15)),
+        (60, ("0 * * * *", 60)),
+        (61, ("0 */2 * * *", 120)),
+        (5000, ("0 0 * * *", 1440)),
+    ],
+)
+def test_cron_schedule(minutes, exp_schedule):
+    assert lib_openstack_service_checks._cron_schedule(minutes) == exp_schedule
+
+
+@pytest.mark.parametrize(
+    "interval, runs, exp_interval",
+    [
+        (10, None, 10),
+        (0, None, 5),
+        (0, "invalid", 5),
+        (0, {"runs": [{"start": 0, "duration": 60}], "skipped": []}, 5),
+        (0, {"runs": [{"start": 0, "duration": 400}, {"start": 1, "duration": 61}]}, 14),
+    ],
+)
+@mock.patch("charmhelpers.core.hookenv.config")
+def test_allocations_interval(mock_config, tmp_path, interval, runs, exp_interval):
+    """Test that interval 0 is derived from the longest recent run with headroom."""
+    runs_file = tmp_path / "allocations.runs"
+    if runs is not None:
+        runs_file.write_text(json.dumps(runs))
+    mock_config.return_value = {"allocations-interval": interval}
+
+    with mock.patch.object(lib_openstack_service_checks, "ALLOCATIONS_RUNS_FILE", str(runs_file)):
+        assert OSCHelper().allocations_interval == exp_interval
+
+
+@mock.patch("charmhelpers.core.hookenv.config")
+def test_allocations_interval_exception(mock_config):
+    mock_config.return_value = {"allocations-interval": -1}
+    with pytest.raises(OSCConfigError):
+        OSCHelper().allocations_interval
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+@mock.patch("lib_openstack_service_checks.os.remove")
+@mock.patch("lib_openstack_service_checks.os.path.exists", return_value=True)
+@mock.patch("lib_openstack_service_checks.subprocess.check_call")
+@mock.patch("lib_openstack_service_checks.render")
+@mock.patch("charmhelpers.core.hookenv.charm_dir", return_value="/mock/charm/dir")
+@mock.patch("charmhelpers.core.hookenv.config")
+@mock.patch("charmhelpers.core.host.service")
+@mock.patch("charmhelpers.core.host.rsync")
+@mock.patch("charmhelpers.core.hookenv.log")
+def test__render_checks_daemon(
+    mock_log,
+    mock_rsync,
+    mock_service,
+    mock_config,
+    mock_charm_dir,
+    mock_render,
+    mock_check_call,
+    mock_exists,
+    mock_remove,
+    enabled,
+):
+    mock_config.return_value = {"checks-daemon": enabled}
+
+    OSCHelper()._render_checks_daemon()
+
+    if enabled:
+        mock_rsync.assert_called_once_with(
+            "/mock/charm/dir/files/osc_checkd.py",
+            "/usr/local/bin/",
+            options=["--executability"],
+        )
+        mock_render.assert_called_once_with(
+            source="osc-checkd.service",
+            target="/etc/systemd/system/osc-checkd.service",
+            context={
+                "script": "/usr/local/bin/osc_checkd.py",
+                "plugins_dir": "/usr/local/lib/nagios/plugins/",
+                "socket": "/run/nagios/osc-checkd.sock",
+            },
+            perms=0o644,
+        )
+        mock_service.assert_any_call("enable", "osc-checkd")
+        mock_service.assert_any_call("restart", "osc-checkd")
+        mock_remove.assert_not_called()
+    else:
+        mock_render.assert_not_called()
+        mock_service.assert_any_call("stop", "osc-checkd")
+        mock_service.assert_any_call("disable", "osc-checkd")
+        mock_remove.assert_called_once_with("/etc/systemd/system/osc-checkd.service")
+
+    mock_check_call.assert_called_once_with(["systemctl", "daemon-reload"])
+
+
+@mock.patch("builtins.open", new_callable=mock_open)
+@mock.patch("charmhelpers.core.hookenv.charm_dir", return_value="/mock/charm/dir")
+@mock.patch("charmhelpers.core.hookenv.config")
+@mock.patch("charmhelpers.core.host.rsync")
+@mock.patch("charmhelpers.core.hookenv.log")
+def test__render_inventory_snapshot(mock_log, mock_rsync, mock_config, mock_charm_dir, mock_file):
+    mock_config.return_value = {
+        "inventory-snapshot": True,
+        "inventory-snapshot-max-age": 900,
+        "check-ports": "all",
+    }
+    helper = OSCHelper()
+    nrpe = MagicMock()
+
+    helper._render_resources_check_by_status(nrpe, "port")
+    helper._render_inventory_snapshot()
+
+    assert nrpe.add_check.call_args[1]["check_cmd"].endswith(
+        "port --all --snapshot /var/lib/nagios/inventory_snapshot.json --snapshot-max-age 900"
+    )
+    mock_rsync.assert_any_call(
+        "/mock/charm/dir/files/run_inventory_snapshot.py",
+        "/usr/local/bin/",
+        options=["--executability"],
+    )
+    mock_file.assert_called_once_with("/etc/cron.d/osc_inventory_snapshot", "w")
+    mock_file().write.assert_called_once_with(
+        "# Juju generated - DO NOT EDIT\n*/5 * * * * nagios /usr/local/bin/run_inventory_snapshot.py "
+        "--output /var/lib/nagios/inventory_snapshot.json --collection ports --collection servers"
+        "\n\n"
+    )
+
+
+@mock.patch("charmhelpers.core.hookenv.log")
+@mock.patch("charmhelpers.core.hookenv.config")
+def test_update_inventory_snapshot_schedule(mock_config, mock_log, tmp_path):
+    """Test that interval 0 is derived from the longest recent run of the snapshot job."""
+    cron_file = tmp_path / "osc_inventory_snapshot"
+    cron_file.write_text(
+        "# Juju generated - DO NOT EDIT\n*/5 * * * * nagios /usr/local/bin/"
+        "run_inventory_snapshot.py --collection allocations --placement-workers 8\n\n"
+    )
+    runs_file = tmp_path / "inventory_snapshot.runs"
+    runs_file.write_text(json.dumps({"runs": [{"start": 0, "duration": 400}]}))
+    mock_config.return_value = {"inventory-snapshot-interval": 0}
+
+    with mock.patch.object(
+        lib_openstack_service_checks, "INVENTORY_SNAPSHOT_RUNS_FILE", str(runs_file)
+    ), mock.patch.object(OSCHelper, "inventory_snapshot_cron_file", new=str(cron_file)):
+        OSCHelper().update_inventory_snapshot_schedule()
+
+    assert cron_file.read_text() == (
+        "# Juju generated - DO NOT EDIT\n*/15 * * * * nagios /usr/local/bin/"
+        "run_inventory_snapshot.py --collection allocations --placement-workers 8\n\n"
+    )
+
+
+@mock.patch("charmhelpers.core.hookenv.config")
+def test_inventory_snapshot_interval_exception(mock_config):
+    mock_config.return_value = {"inventory-snapshot-interval": -1}
+    with pytest.raises(OSCConfigError):
+        OSCHelper().inventory_snapshot_interval
+
+
+@mock.patch("lib_openstack_service_checks.os.remove")
+@mock.patch("charmhelpers.core.hookenv.config", return_value={"inventory-snapshot": False})
+@mock.patch("charmhelpers.core.host.rsync")
+def test__render_inventory_snapshot_disabled(mock_rsync, mock_config, mock_remove):
+    OSCHelper()._render_inventory_snapshot()
+
+    mock_rsync.assert_not_called()
+    mock_remove.assert_called_once_with("/etc/cron.d/osc_inventory_snapshot")
+
+
 @pytest.mark.parametrize("v3_interface", ["admin", "internal", "public"])
 def test__normalize_endpoint_attr(v3_interface):
     """Test normalize the attributes in service catalog endpoint between v2 and v3."""
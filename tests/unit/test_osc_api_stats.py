@@ -0,0 +1,199 @@
+"""Test OpenStack API call statistics."""
+
+from unittest import mock
+
+import osc_api_stats
+import osc_rate_limit
+import pytest
+
+
+class FakeResponse:
+    """Helper object representing the requests response."""
+
+    def __init__(self, content=b"", headers=None):
+        """Initialize of FakeResponse."""
+        self.content = content
+        self.headers = headers or {}
+
+
+class FakeSession:
+    """Helper object representing the keystoneauth session."""
+
+    def __init__(self, response=None):
+        """Initialize of FakeSession."""
+        self.response = response or FakeResponse(b"{}")
+        self.requests = []
+
+    def request(self, url, method, **kwargs):
+        self.requests.append((url, method))
+        if isinstance(self.response, Exception):
+            raise self.response
+
+        return self.response
+
+    def get(self, url, **kwargs):
+        return self.request(url, "GET", **kwargs)
+
+
+def fake_client(session):
+    client = mock.MagicMock()
+    client.session = session
+    return client
+
+
+@pytest.mark.parametrize(
+    "url, endpoint_filter, exp_service",
+    [
+        ("https://neutron:9696/v2.0/ports", {"service_type": "network"}, "neutron"),
+        ("https://nova:8774/v2.1/servers", {"service_type": "compute"}, "nova"),
+        ("https://cinder:8776/v3/os-services", {"service_type": "volumev3"}, "cinder"),
+        ("https://example:1234/", {"service_type": "key-manager"}, "key_manager"),
+        ("https://keystone:5000/v3/auth/tokens", None, "keystone"),
+        ("https://neutron:9696/", None, "discovery"),
+    ],
+)
+def test_attach_api_stats(url, endpoint_filter, exp_service):
+    stats = osc_api_stats.ApiStats()
+    session = FakeSession(FakeResponse(b"x" * 10))
+    osc_api_stats.attach_api_stats(fake_client(session), stats)
+
+    session.request(url, "GET", endpoint_filter=endpoint_filter)
+    session.get(url, endpoint_filter=endpoint_filter)
+
+    assert session.requests == [(url, "GET"), (url, "GET")]
+    ((service, (calls, _, _, size)),) = stats.services().items()
+    assert (service, calls, size) == (exp_service, 2, 20)
+
+
+def test_attach_api_stats_stream():
+    stats = osc_api_stats.ApiStats()
+    session = FakeSession(FakeResponse(None, {"Content-Length": "42"}))
+    osc_api_stats.attach_api_stats(fake_client(session), stats)
+
+    session.request("https://glance/v2/images/1/file", "GET", stream=True)
+
+    assert stats.services()["discovery"][3] == 42
+
+
+def test_attach_api_stats_error():
+    """Test that failed requests are counted too."""
+    stats = osc_api_stats.ApiStats()
+    session = FakeSession(ConnectionError("refused"))
+    osc_api_stats.attach_api_stats(fake_client(session), stats)
+
+    with pytest.raises(ConnectionError):
+        session.request(
+            "https://nova/v2.1/servers", "GET", endpoint_filter={"service_type": "compute"}
+        )
+
+    assert stats.services()["nova"][0] == 1
+
+
+def test_attach_api_stats_twice():
+    session = FakeSession()
+    client = fake_client(session)
+    osc_api_stats.attach_api_stats(client, osc_api_stats.ApiStats())
+    request = session.request
+    osc_api_stats.attach_api_stats(client, osc_api_stats.ApiStats())
+
+    assert session.request is request
+
+
+def test_perfdata():
+    stats = osc_api_stats.ApiStats()
+    stats.record("neutron", 1.5, 1000)
+    stats.record("neutron", 0.4, 24)
+    stats.record("keystone", 0.5, 100)
+
+    assert stats.perfdata() == (
+        "api_calls=3 api_time=2.400s api_max_time=1.500s api_bytes=1124B "
+        "keystone_calls=1 keystone_time=0.500s keystone_max_time=0.500s keystone_bytes=100B "
+        "neutron_calls=2 neutron_time=1.900s neutron_max_time=1.500s neutron_bytes=1024B"
+    )
+
+
+def test_with_perfdata():
+    stats = osc_api_stats.ApiStats()
+    assert osc_api_stats.with_perfdata("OK: all good\n", stats) == "OK: all good\n"
+
+    stats.record("nova", 0.25, 10)
+    assert osc_api_stats.with_perfdata("CRITICAL: 1/2 DOWN\nserver-1\n", stats) == (
+        "CRITICAL: 1/2 DOWN\nserver-1 | api_calls=1 api_time=0.250s api_max_time=0.250s "
+        "api_bytes=10B nova_calls=1 nova_time=0.250s nova_max_time=0.250s nova_bytes=10B"
+    )
+
+    stats.reset()
+    assert stats.perfdata() == ""
+
+
+def test_attach_api_stats_limited(tmp_path, monkeypatch):
+    """Test that time spent waiting for the limiter is recorded."""
+    monkeypatch.setenv("OSC_API_RATE_LIMIT", "nova=100")
+    stats = osc_api_stats.ApiStats()
+    session = FakeSession()
+    limiter = osc_rate_limit.ApiLimiter(str(tmp_path))
+    osc_api_stats.attach_api_stats(fake_client(session), stats, limiter)
+
+    session.request(
+        "https://nova/v2.1/servers", "GET", endpoint_filter={"service_type": "compute"}
+    )
+
+    assert list(stats.waits()) == ["nova"]
+    assert "api_wait=" in stats.perfdata()
+    assert "nova_wait=" in stats.perfdata()
+
+
+class AuthenticatingSession(FakeSession):
+    """Helper session authenticating through its own request, like keystoneauth."""
+
+    def request(self, url, method, **kwargs):
+        if kwargs.get("endpoint_filter"):
+            self.request("https://keystone:5000/v3/auth/tokens", "POST")
+
+        return super().request(url, method, **kwargs)
+
+
+def test_attach_api_stats_nested_not_limited(tmp_path, monkeypatch):
+    """Test that nested authentication request does not wait for the outer one's slot."""
+    monkeypatch.setenv("OSC_API_MAX_CONCURRENCY", "1")
+    monkeypatch.setattr(osc_rate_limit, "MAX_WAIT", 5)
+    stats = osc_api_stats.ApiStats()
+    session = AuthenticatingSession()
+    limiter = osc_rate_limit.ApiLimiter(str(tmp_path))
+    osc_api_stats.attach_api_stats(fake_client(session), stats, limiter)
+
+    with mock.patch("osc_rate_limit.time.sleep") as sleep:
+        session.request(
+            "https://nova/v2.1/servers", "GET", endpoint_filter={"service_type": "compute"}
+        )
+
+    sleep.assert_not_called()
+    assert [url for url, _ in session.requests] == [
+        "https://keystone:5000/v3/auth/tokens",
+        "https://nova/v2.1/servers",
+    ]
+    assert sorted(stats.services()) == ["keystone", "nova"]
+    assert list(stats.waits()) == ["nova"]
+
+
+def test_perfdata_wait():
+    stats = osc_api_stats.ApiStats()
+    stats.record("nova", 0.25, 10)
+    stats.record_wait("nova", 1.5)
+
+    assert stats.perfdata() == (
+        "api_calls=1 api_time=0.250s api_max_time=0.250s api_bytes=10B api_wait=1.500s "
+        "nova_calls=1 nova_time=0.250s nova_max_time=0.250s nova_bytes=10B nova_wait=1.500s"
+    )
+
+
+def test_with_perfdata_of_plugin():
+    stats = osc_api_stats.ApiStats()
+    assert osc_api_stats.with_perfdata("OK: all good\n", stats, {"listings": 1}) == (
+        "OK: all good | listings=1"
+    )
+
+    stats.record("nova", 0.25, 10)
+    assert osc_api_stats.with_perfdata("OK: all good", stats, {"listings": 2}).startswith(
+        "OK: all good | listings=2 api_calls=1 "
+    )
@@ -0,0 +1,186 @@
+"""Test osc-checkd daemon and its client."""
+
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import osc_checkd
+import osc_checkd_client
+import pytest
+
+PLUGIN = """
+import sys
+print("OK: {}".format(" ".join(sys.argv[1:])))
+sys.exit(int(sys.argv[1]))
+"""
+SLOW_PLUGIN = """
+import sys
+import time
+time.sleep(float(sys.argv[1]))
+open(sys.argv[2], "w").close()
+print("OK: slept")
+"""
+
+
+@pytest.fixture
+def plugins_dir(tmp_path):
+    (tmp_path / "check_fake.py").write_text(PLUGIN)
+    (tmp_path / "check_broken.py").write_text("raise ValueError('broken')\n")
+    (tmp_path / "check_slow.py").write_text(SLOW_PLUGIN)
+    (tmp_path / "not_a_check.py").write_text(PLUGIN)
+    return str(tmp_path)
+
+
+@pytest.fixture
+def server(plugins_dir):
+    # unix socket path length is limited, so do not use pytest tmp_path
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "osc-checkd.sock")
+        server = osc_checkd.CheckServer(socket_path, plugins_dir)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize("status", [0, 1, 2, 3])
+def test_run_plugin(plugins_dir, status):
+    output, exit_code = osc_checkd.run_plugin(plugins_dir, "check_fake.py", [str(status), "a"])
+
+    assert output == "OK: {} a\n".format(status)
+    assert exit_code == status
+
+
+def test_run_plugin_exception(plugins_dir):
+    output, exit_code = osc_checkd.run_plugin(plugins_dir, "check_broken.py", [])
+
+    assert output == "UNKNOWN: check_broken.py failed in osc-checkd: broken\n"
+    assert exit_code == osc_checkd.NAGIOS_STATUS_UNKNOWN
+
+
+def test_server_plugins(server):
+    assert server.plugins == {"check_fake.py", "check_broken.py", "check_slow.py"}
+
+
+def test_delegate_to_daemon(server, capsys):
+    with pytest.raises(SystemExit) as error:
+        osc_checkd_client.delegate_to_daemon(
+            ["/plugins/check_fake.py", "2", "b"], socket_path=server.server_address
+        )
+
+    assert error.value.code == 2
+    assert capsys.readouterr().out == "OK: 2 b\n"
+
+
+def test_delegate_to_daemon_not_served(server):
+    """Plugins which are not served by daemon run locally."""
+    assert (
+        osc_checkd_client.delegate_to_daemon(
+            ["/plugins/not_a_check.py", "0"], socket_path=server.server_address
+        )
+        is None
+    )
+
+
+def test_delegate_to_daemon_no_socket():
+    assert osc_checkd_client.delegate_to_daemon(["check_fake.py"], "/not/exists") is None
+
+
+def test_delegate_to_daemon_in_daemon(server):
+    with mock.patch.object(osc_checkd_client, "IN_DAEMON", True):
+        assert (
+            osc_checkd_client.delegate_to_daemon(
+                ["/plugins/check_fake.py", "0"], socket_path=server.server_address
+            )
+            is None
+        )
+
+
+def test_session_cache(monkeypatch):
+    factory = mock.MagicMock(side_effect=lambda *args, **kwargs: object())
+    cache = osc_checkd.SessionCache(max_age=60)
+    cached_factory = cache.wrap("connect", factory)
+
+    monkeypatch.setenv("OS_USERNAME", "nagios")
+    session = cached_factory(cloud="envvars")
+    assert cached_factory(cloud="envvars") is session
+    factory.assert_called_once_with(cloud="envvars")
+
+    # different credentials must not share a session
+    monkeypatch.setenv("OS_USERNAME", "admin")
+    assert cached_factory(cloud="envvars") is not session
+
+    cache.clear()
+    assert factory.call_count == 2
+    cached_factory(cloud="envvars")
+    assert factory.call_count == 3
+
+
+def test_session_cache_expired(monkeypatch):
+    factory = mock.MagicMock(side_effect=lambda *args, **kwargs: object())
+    cache = osc_checkd.SessionCache(max_age=60)
+    cached_factory = cache.wrap("connect", factory)
+
+    with mock.patch.object(osc_checkd.time, "monotonic", side_effect=[0, 30, 100, 100]):
+        session = cached_factory()
+        assert cached_factory() is session
+        assert cached_factory() is not session
+
+
+def test_run_plugin_restores_argv(plugins_dir):
+    argv = list(sys.argv)
+    osc_checkd.run_plugin(plugins_dir, "check_fake.py", ["0"])
+    assert sys.argv == argv
+
+
+def test_delegate_to_daemon_busy(server):
+    """Test that the check runs locally if another check is in progress."""
+    server.queue_timeout = 0.1
+    with server.lock:
+        assert (
+            osc_checkd_client.delegate_to_daemon(
+                ["/plugins/check_fake.py", "0"], socket_path=server.server_address
+            )
+            is None
+        )
+
+
+def test_delegate_to_daemon_timeout(server, tmp_path):
+    """Test that the check runs locally if the daemon does not finish it in time."""
+    marker = str(tmp_path / "finished")
+    started = time.monotonic()
+    assert (
+        osc_checkd_client.delegate_to_daemon(
+            ["/plugins/check_slow.py", "0.5", marker],
+            socket_path=server.server_address,
+            timeout=0.1,
+        )
+        is None
+    )
+    assert time.monotonic() - started < 0.5
+
+    # the check finishes in the background and releases the daemon
+    assert server.lock.acquire(timeout=5)
+    server.lock.release()
+    assert os.path.exists(marker)
+
+
+def test_disconnected_client_dropped(server, tmp_path):
+    marker = str(tmp_path / "finished")
+    request = {"plugin": "check_slow.py", "argv": ["0", marker]}
+    with server.lock:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(server.server_address)
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        time.sleep(0.1)
+
+    time.sleep(0.2)
+    assert server.lock.acquire(timeout=5)
+    server.lock.release()
+    assert not os.path.exists(marker)
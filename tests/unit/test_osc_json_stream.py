@@ -0,0 +1,74 @@
+"""Test incremental decoding of JSON responses."""
+
+import json
+import unittest.mock as mock
+
+import osc_json_stream
+import pytest
+
+
+def _chunks(text, size):
+    data = text.encode("utf-8")
+    return [data[start:][:size] for start in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_iter_members_object(size):
+    text = json.dumps(
+        {
+            "resource_provider_generation": 12345,
+            "allocations": {
+                "vm-0": {"resources": {"VCPU": 2, "MEMORY_MB": 2048}},
+                "vm-é": {"resources": {"DISK_GB": 10.5}},
+            },
+            "links": [],
+        },
+        indent=1,
+        ensure_ascii=False,
+    )
+
+    assert list(osc_json_stream.iter_members(_chunks(text, size), "allocations")) == [
+        ("vm-0", {"resources": {"VCPU": 2, "MEMORY_MB": 2048}}),
+        ("vm-é", {"resources": {"DISK_GB": 10.5}}),
+    ]
+
+
+@pytest.mark.parametrize("size", [1, 4, 1000])
+def test_iter_members_array(size):
+    text = '{"resource_providers": [{"name": "host-0", "uuid": "rp-0"}, 1234, null]}'
+
+    assert list(osc_json_stream.iter_members(_chunks(text, size), "resource_providers")) == [
+        {"name": "host-0", "uuid": "rp-0"},
+        1234,
+        None,
+    ]
+
+
+@pytest.mark.parametrize("text", ['{"allocations": {}}', '{"allocations": [ ]}'])
+def test_iter_members_empty(text):
+    assert list(osc_json_stream.iter_members(_chunks(text, 2), "allocations")) == []
+
+
+@pytest.mark.parametrize(
+    "text, error",
+    [
+        ("{}", KeyError),
+        ('{"links": []}', KeyError),
+        ('{"allocations": {"vm-0": {}', json.JSONDecodeError),
+        ('{"allocations": {"vm-0" {}}}', json.JSONDecodeError),
+        ("<html>", json.JSONDecodeError),
+        ("", json.JSONDecodeError),
+    ],
+)
+def test_iter_members_error(text, error):
+    with pytest.raises(error):
+        list(osc_json_stream.iter_members(_chunks(text, 3), "allocations"))
+
+
+def test_iter_response_closed():
+    response = mock.MagicMock()
+    response.iter_content.return_value = [b'{"allocations": {"vm-0": {}}}']
+
+    assert list(osc_json_stream.iter_response(response, "allocations")) == [("vm-0", {})]
+    response.iter_content.assert_called_once_with(osc_json_stream.CHUNK_SIZE)
+    response.close.assert_called_once_with()
@@ -0,0 +1,27 @@
+"""Test lazy import of heavy modules."""
+
+import importlib.util
+import sys
+from unittest import mock
+
+import osc_lazy
+import pytest
+
+
+def test_lazy_import(tmp_path, monkeypatch):
+    (tmp_path / "heavy_module.py").write_text("LOADED = True\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    with mock.patch.dict(sys.modules):
+        module = osc_lazy.lazy_import("heavy_module")
+        assert isinstance(module, importlib.util._LazyModule)
+        assert module.LOADED is True
+        assert not isinstance(module, importlib.util._LazyModule)
+
+
+def test_lazy_import_already_imported():
+    assert osc_lazy.lazy_import("json") is sys.modules["json"]
+
+
+def test_lazy_import_not_installed():
+    with pytest.raises(ModuleNotFoundError):
+        osc_lazy.lazy_import("not_installed_module")
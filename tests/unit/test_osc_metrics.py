@@ -0,0 +1,103 @@
+"""Test check results exported for the node-exporter textfile collector."""
+
+import os
+import stat
+
+import osc_api_stats
+import osc_metrics
+import pytest
+
+
+@pytest.fixture
+def textfile_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv(osc_metrics.TEXTFILE_DIR_ENV, str(tmp_path))
+    osc_api_stats.reset()
+    yield tmp_path
+    osc_api_stats.reset()
+
+
+def test_format_metrics():
+    metrics = osc_metrics.format_metrics(
+        "resources_port", 2, {"down": 3, "ok": 10}, 1.23456, {"neutron": (2, 0.5, 0.4, 100)}
+    )
+
+    lines = metrics.splitlines()
+    assert "# TYPE openstack_service_checks_status gauge" in lines
+    assert 'openstack_service_checks_status{check="resources_port"} 2' in lines
+    assert 'openstack_service_checks_resources{check="resources_port",state="down"} 3' in lines
+    assert 'openstack_service_checks_resources{check="resources_port",state="ok"} 10' in lines
+    assert 'openstack_service_checks_duration_seconds{check="resources_port"} 1.235' in lines
+    assert (
+        'openstack_service_checks_api_calls{check="resources_port",service="neutron"} 2' in lines
+    )
+    assert (
+        'openstack_service_checks_api_time_seconds{check="resources_port",service="neutron"} 0.5'
+        in lines
+    )
+    assert (
+        'openstack_service_checks_api_bytes{check="resources_port",service="neutron"} 100' in lines
+    )
+
+
+def test_format_metrics_without_api_calls():
+    metrics = osc_metrics.format_metrics("masakari", 0, {}, 0.1, {})
+
+    assert "api_calls" not in metrics
+    assert "api_wait_seconds" not in metrics
+    assert "openstack_service_checks_resources" not in metrics
+
+
+def test_format_metrics_api_waits():
+    metrics = osc_metrics.format_metrics(
+        "resources_port", 0, {}, 0.1, {"neutron": (1, 0.5, 0.5, 10)}, {"neutron": 1.5}
+    )
+
+    assert (
+        'openstack_service_checks_api_wait_seconds{check="resources_port",service="neutron"} 1.5'
+        in metrics.splitlines()
+    )
+
+
+def test_report(textfile_dir):
+    osc_api_stats.STATS.record("nova", 0.25, 10)
+
+    output = osc_metrics.report("nova_services", "WARNING: Host a disabled", resources={"up": 1})
+
+    assert output.startswith("WARNING: Host a disabled | api_calls=1")
+    path = textfile_dir / "osc_nova_services.prom"
+    assert stat.S_IMODE(os.stat(str(path)).st_mode) == 0o644
+    metrics = path.read_text()
+    assert 'openstack_service_checks_status{check="nova_services"} 1' in metrics
+    assert 'openstack_service_checks_resources{check="nova_services",state="up"} 1' in metrics
+    assert 'openstack_service_checks_api_calls{check="nova_services",service="nova"} 1' in metrics
+    assert os.listdir(str(textfile_dir)) == ["osc_nova_services.prom"]
+
+
+@pytest.mark.parametrize(
+    "message, status, exp_status",
+    [
+        ("OK: all good", None, 0),
+        ("CRITICAL: ports 1/2 are DOWN", None, 2),
+        ("auto remediation output file is healthy", None, 3),
+        ("all ports are healthy", 0, 0),
+    ],
+)
+def test_report_status(textfile_dir, message, status, exp_status):
+    osc_metrics.report("resources_floating-ip", message, status)
+
+    metrics = (textfile_dir / "osc_resources_floating_ip.prom").read_text()
+    assert 'status{{check="resources_floating_ip"}} {}'.format(exp_status) in metrics
+
+
+def test_report_disabled(tmp_path, monkeypatch):
+    monkeypatch.delenv(osc_metrics.TEXTFILE_DIR_ENV, raising=False)
+
+    assert osc_metrics.report("masakari", "OK") == "OK"
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_report_not_writable(tmp_path, monkeypatch):
+    """Test that the check result is not changed if metrics can not be written."""
+    monkeypatch.setenv(osc_metrics.TEXTFILE_DIR_ENV, str(tmp_path / "missing"))
+
+    assert osc_metrics.report("masakari", "OK") == "OK"
@@ -0,0 +1,97 @@
+"""Test loading of novarc file."""
+
+import os
+from unittest import mock
+
+import osc_novarc
+import pytest
+
+NOVARC = """\
+export OS_AUTH_URL=https://keystone.example.com:5000/v3
+export OS_USERNAME="nagios"
+export OS_PASSWORD='pa$$word'
+export OS_PROJECT_NAME=services  # inline comment
+# export OS_REGION_NAME=Region0
+export OS_REGION_NAME=RegionOne
+export OS_CACERT=/etc/nagios/ssl/ca.pem
+export REQUESTS_CA_BUNDLE=$OS_CACERT
+export OS_CA=${OS_CACERT}
+NO_EXPORT="$OS_USERNAME@$OS_REGION_NAME"
+not a variable line
+"""
+
+
+@pytest.fixture
+def novarc(tmp_path):
+    path = tmp_path / "nagios.novarc"
+    path.write_text(NOVARC)
+    return str(path)
+
+
+def test_parse_novarc():
+    assert osc_novarc.parse_novarc(NOVARC) == {
+        "OS_AUTH_URL": "https://keystone.example.com:5000/v3",
+        "OS_USERNAME": "nagios",
+        "OS_PASSWORD": "pa$$word",
+        "OS_PROJECT_NAME": "services",
+        "OS_REGION_NAME": "RegionOne",
+        "OS_CACERT": "/etc/nagios/ssl/ca.pem",
+        "REQUESTS_CA_BUNDLE": "/etc/nagios/ssl/ca.pem",
+        "OS_CA": "/etc/nagios/ssl/ca.pem",
+        "NO_EXPORT": "nagios@RegionOne",
+    }
+
+
+@pytest.mark.parametrize(
+    "content, exp_value",
+    [
+        ("export VALUE=$HOME/.config", "/home/nagios/.config"),
+        ("export VALUE=$NOT_DEFINED", ""),
+        ("export VALUE=''", ""),
+        ("export VALUE=", ""),
+    ],
+)
+def test_parse_novarc_expansion(content, exp_value):
+    with mock.patch.dict(os.environ, {"HOME": "/home/nagios"}):
+        os.environ.pop("NOT_DEFINED", None)
+        assert osc_novarc.parse_novarc(content) == {"VALUE": exp_value}
+
+
+@pytest.mark.parametrize(
+    "content, exp_value",
+    [
+        ("export VALUE=abc#def", "abc#def"),
+        ("export VALUE=abc #def", "abc"),
+        ('export VALUE="a b" # comment', "a b"),
+        ("export VALUE='a#b'  # comment", "a#b"),
+        ('export VALUE=x"y z"w', "xy zw"),
+        ("export VALUE=x'$HOME'\"$HOME\"", "x$HOME/home/nagios"),
+        ('export VALUE="\\$HOME"', "$HOME"),
+    ],
+)
+def test_parse_novarc_words(content, exp_value):
+    """Test that value is parsed as the first word of bash."""
+    with mock.patch.dict(os.environ, {"HOME": "/home/nagios"}):
+        assert osc_novarc.parse_novarc(content) == {"VALUE": exp_value}
+
+
+def test_load_novarc_cached(novarc):
+    with mock.patch.object(osc_novarc, "parse_novarc", wraps=osc_novarc.parse_novarc) as parse:
+        env = osc_novarc.load_novarc(novarc)
+        env["OS_USERNAME"] = "modified"
+        assert osc_novarc.load_novarc(novarc)["OS_USERNAME"] == "nagios"
+        parse.assert_called_once()
+
+        # re-rendered novarc is parsed again
+        with open(novarc, "a") as file:
+            file.write("export OS_INTERFACE=internal\n")
+
+        assert osc_novarc.load_novarc(novarc)["OS_INTERFACE"] == "internal"
+        assert parse.call_count == 2
+
+
+def test_set_openstack_credentials(novarc):
+    with mock.patch.dict(os.environ, {}):
+        osc_novarc.set_openstack_credentials(novarc)
+        assert os.environ["OS_USERNAME"] == "nagios"
+        assert os.environ["REQUESTS_CA_BUNDLE"] == "/etc/nagios/ssl/ca.pem"
@@ -0,0 +1,170 @@
+"""Test plugin output kept within a byte budget."""
+
+import os
+
+import osc_output
+import pytest
+
+
+def test_lines_within_budget():
+    output = osc_output.BudgetedOutput()
+    output.add(0, "port 'b' is in ACTIVE status")
+    output.add(2, "port 'a' is in DOWN status")
+    output.add(0, "port 'a' is in ACTIVE status")
+
+    assert output.count == 3
+    assert output.omitted == 0
+    assert output.summary() == ""
+    assert output.lines() == [
+        "port 'a' is in DOWN status",
+        "port 'b' is in ACTIVE status",
+        "port 'a' is in ACTIVE status",
+    ]
+    assert output.lines(reverse=False) == [
+        "port 'a' is in ACTIVE status",
+        "port 'b' is in ACTIVE status",
+        "port 'a' is in DOWN status",
+    ]
+
+
+@pytest.mark.parametrize("reverse_input", [False, True])
+def test_most_severe_lines_retained(reverse_input):
+    """Test that the retained lines do not depend on the order of added lines."""
+    lines = [(0, "ok-{:04d}".format(i), "net-{}".format(i // 500)) for i in range(1000)]
+    lines += [(1, "warning-{}".format(i), "net-2") for i in range(3)]
+    lines += [(2, "critical-{}".format(i), "net-3") for i in range(2)]
+    output = osc_output.BudgetedOutput(budget=100)
+    for severity, line, group in reversed(lines) if reverse_input else lines:
+        output.add(severity, line, group)
+
+    assert output.count == 1005
+    assert output.omitted == 994
+    assert output.lines() == [
+        "critical-1",
+        "critical-0",
+        "warning-2",
+        "warning-1",
+        "warning-0",
+        *("ok-{:04d}".format(i) for i in range(999, 993, -1)),
+        "994 more lines omitted (994 OK), by group: net-0 (500), net-1 (494)",
+    ]
+
+
+def test_summary_states_and_groups():
+    output = osc_output.BudgetedOutput(budget=10, group_name="network")
+    for i in range(8):
+        output.add(2 if i < 2 else 0, "port-{}".format(i), "net-{}".format(i % 3))
+
+    assert output.lines() == [
+        "port-1",
+        "7 more lines omitted (1 CRITICAL, 6 OK), by network: net-0 (3), net-2 (2), net-1 (2)",
+    ]
+
+
+def test_reserve():
+    """Test that the lines and the summary fit the budget left after reserving."""
+    output = osc_output.BudgetedOutput(budget=100)
+    for i in range(8):
+        output.add(2 if i < 2 else 0, "port-{}".format(i))
+    assert output.omitted == 0
+
+    output.reserve(55)
+    assert output.lines() == [
+        "port-1",
+        "port-0",
+        "6 more lines omitted (6 OK)",
+    ]
+    assert sum(len(line) + 1 for line in output.lines()) <= 45
+
+    # the reserved bytes do not count as retained lines
+    output.reserve(0)
+    assert output.omitted == 6
+
+
+def test_order():
+    """Test that lines can be retained and ordered by other key than the line."""
+    output = osc_output.BudgetedOutput(budget=15)
+    output.add(1, "c-old", order=1)
+    output.add(2, "b-new", order=0)
+    output.add(1, "a-new", order=2)
+    output.add(1, "d-oldest", order=0)
+
+    assert output.lines(reverse=False, by_severity=False) == [
+        "b-new",
+        "a-new",
+        "2 more lines omitted (2 WARNING)",
+    ]
+    assert output.lines(reverse=False) == [
+        "a-new",
+        "b-new",
+        "2 more lines omitted (2 WARNING)",
+    ]
+    assert output.lines(reverse=False, by_severity=False, by_line=True) == [
+        "a-new",
+        "b-new",
+        "2 more lines omitted (2 WARNING)",
+    ]
+
+
+def test_detail_file(tmp_path):
+    path = str(tmp_path / "detail.out")
+    output = osc_output.BudgetedOutput(budget=10, detail_file=path)
+    for i in range(5):
+        output.add(0, "line-{}".format(i))
+
+    assert not os.path.exists(path)
+    output.close()
+    output.close()
+
+    with open(path) as detail_file:
+        assert detail_file.read() == "".join("line-{}\n".format(i) for i in range(5))
+    assert os.listdir(str(tmp_path)) == ["detail.out"]
+    assert len(output.lines()) == 2
+
+
+def test_detail_file_only(tmp_path):
+    path = str(tmp_path / "detail.out")
+    output = osc_output.BudgetedOutput(detail_file=path)
+    output.add(0, "line-0")
+    assert output.add_detail(lambda: "line-1") == "line-1"
+    output.close()
+
+    with open(path) as detail_file:
+        assert detail_file.read() == "line-0\nline-1\n"
+    assert output.count == 1
+    assert output.lines() == ["line-0"]
+
+
+def test_detail_file_empty(tmp_path):
+    path = str(tmp_path / "detail.out")
+    with open(path, "w") as detail_file:
+        detail_file.write("stale\n")
+
+    osc_output.BudgetedOutput(detail_file=path).close()
+
+    with open(path) as detail_file:
+        assert detail_file.read() == ""
+
+
+def test_lines_formatted_lazily():
+    """Test that only the retained lines are formatted."""
+    formatted = []
+
+    def line(i):
+        formatted.append(i)
+        return "line-{:04d}".format(i)
+
+    output = osc_output.BudgetedOutput(budget=50)
+    for i in range(1000):
+        output.add(2 if i % 100 == 0 else 0, lambda i=i: line(i), order=-i)
+
+    assert output.lines() == [
+        "line-0000",
+        "line-0100",
+        "line-0200",
+        "line-0300",
+        "line-0400",
+        "995 more lines omitted (5 CRITICAL, 990 OK)",
+    ]
+    # lines ordered below the retained ones are omitted without being formatted
+    assert sorted(formatted) == [0, 1, 2, 3, 4, 5, 100, 200, 300, 400, 500]
@@ -0,0 +1,111 @@
+"""Test host-wide limiter of OpenStack API requests."""
+
+import os
+from unittest import mock
+
+import osc_rate_limit
+import pytest
+
+
+@pytest.fixture
+def limiter(tmp_path, monkeypatch):
+    monkeypatch.delenv(osc_rate_limit.RATE_LIMIT_ENV, raising=False)
+    monkeypatch.delenv(osc_rate_limit.MAX_CONCURRENCY_ENV, raising=False)
+    return osc_rate_limit.ApiLimiter(str(tmp_path))
+
+
+@pytest.mark.parametrize(
+    "value, exp_limits",
+    [
+        ("", {}),
+        ("neutron=5", {"neutron": 5.0}),
+        (" neutron=5, nova=0.5,*=20,", {"neutron": 5.0, "nova": 0.5, "*": 20.0}),
+    ],
+)
+def test_parse_rate_limits(value, exp_limits):
+    assert osc_rate_limit.parse_rate_limits(value) == exp_limits
+
+
+@pytest.mark.parametrize("value", ["neutron", "=5", "neutron=fast", "nova=0", "n-ova=5"])
+def test_parse_rate_limits_error(value):
+    with pytest.raises(ValueError):
+        osc_rate_limit.parse_rate_limits(value)
+
+
+def test_limit_disabled(limiter, tmp_path):
+    with limiter.limit("neutron") as waited:
+        assert waited is None
+
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_limit_rate(limiter, monkeypatch):
+    """Test that the requests after burst of one second worth of requests are delayed."""
+    monkeypatch.setenv(osc_rate_limit.RATE_LIMIT_ENV, "neutron=2,*=1")
+    with mock.patch("osc_rate_limit.time.time", return_value=1000.0):
+        delays = [limiter._reserve("neutron", 2) for _ in range(4)]
+        # other limiter on the host shares the state
+        other = osc_rate_limit.ApiLimiter(limiter.state_dir)
+        delays.append(other._reserve("neutron", 2))
+        delays.append(limiter._reserve("nova", 1))
+
+    assert delays == [0.0, 0.0, 0.5, 1.0, 1.5, 0.0]
+
+
+def test_limit_rate_max_wait(limiter, monkeypatch):
+    """Test that the request is not delayed longer than MAX_WAIT."""
+    monkeypatch.setattr(osc_rate_limit, "MAX_WAIT", 1)
+    with mock.patch("osc_rate_limit.time.time", return_value=1000.0):
+        delays = [limiter._reserve("neutron", 1) for _ in range(4)]
+
+    # the ignored request does not delay the following ones
+    assert delays == [0.0, 1.0, 0.0, 0.0]
+
+
+def test_limit_state_file_mode(limiter, tmp_path):
+    limiter._reserve("neutron", 1)
+
+    mode = os.stat(str(tmp_path / "osc-api-rate-neutron")).st_mode
+    assert mode & 0o777 == 0o600
+
+
+def test_limit_rate_sleep(limiter, monkeypatch):
+    monkeypatch.setenv(osc_rate_limit.RATE_LIMIT_ENV, "*=1")
+    with mock.patch.object(limiter, "_reserve", return_value=0.5) as reserve:
+        with mock.patch("osc_rate_limit.time.sleep") as sleep:
+            with limiter.limit("octavia") as waited:
+                assert waited is not None
+
+    reserve.assert_called_once_with("octavia", 1.0)
+    sleep.assert_called_once_with(0.5)
+
+
+def test_limit_concurrency(limiter, monkeypatch):
+    monkeypatch.setenv(osc_rate_limit.MAX_CONCURRENCY_ENV, "1")
+    monkeypatch.setattr(osc_rate_limit, "MAX_WAIT", 0.1)
+    with limiter.limit("neutron"):
+        # the only slot is held, the second request gives up waiting
+        assert limiter._acquire_slot(1) is None
+        slot = limiter._acquire_slot(2)
+        assert slot is not None
+        os.close(slot)
+
+    slot = limiter._acquire_slot(1)
+    assert slot is not None
+    os.close(slot)
+
+
+def test_limit_state_dir_error(limiter, tmp_path, monkeypatch):
+    """Test that requests are not limited if the state directory is not accessible."""
+    monkeypatch.setenv(osc_rate_limit.RATE_LIMIT_ENV, "*=1")
+    monkeypatch.setenv(osc_rate_limit.MAX_CONCURRENCY_ENV, "1")
+    limiter.state_dir = str(tmp_path / "missing")
+    with limiter.limit("neutron") as waited:
+        assert waited >= 0
+
+
+def test_limit_invalid_env(limiter, monkeypatch):
+    monkeypatch.setenv(osc_rate_limit.RATE_LIMIT_ENV, "neutron")
+    monkeypatch.setenv(osc_rate_limit.MAX_CONCURRENCY_ENV, "many")
+    with limiter.limit("neutron") as waited:
+        assert waited is None
@@ -0,0 +1,196 @@
+"""Test cloud inventory snapshot."""
+
+import json
+import os
+import stat
+import time
+from unittest import mock
+
+import openstack
+import osc_snapshot
+import pytest
+
+COLLECTIONS = {
+    "ports": {
+        "items": [
+            {
+                "id": "port-0",
+                "status": "ACTIVE",
+                "device_owner": "network:dhcp",
+                "fixed_ips": [{"subnet_id": "subnet-0", "ip_address": "10.0.0.2"}],
+            },
+            {
+                "id": "port-1",
+                "status": "DOWN",
+                "device_owner": "compute:nova",
+                "fixed_ips": [{"subnet_id": "subnet-1", "ip_address": "10.0.1.5"}],
+            },
+        ],
+        "latency": 0.5,
+    },
+    "floating_ips": {
+        "items": [
+            {"id": "fip-0", "status": "DOWN", "fixed_ip_address": None},
+            {"id": "fip-1", "status": "ACTIVE", "fixed_ip_address": "10.0.0.1"},
+        ],
+        "latency": 0.1,
+    },
+    "pools": {
+        "items": [
+            {"id": "pool-0", "loadbalancers": [{"id": "lb-0"}]},
+            {"id": "pool-1", "loadbalancers": [{"id": "lb-1"}]},
+        ],
+        "latency": 0.1,
+    },
+    "servers": {"error": "service unavailable", "latency": 0.1},
+    "resource_providers": {"items": [{"name": "host-0", "uuid": "rp-0"}], "latency": 0.1},
+    "allocations": {"items": {"rp-0": ["vm-0", "vm-1"]}, "latency": 0.2},
+}
+
+
+@pytest.fixture
+def snapshot_file(tmp_path):
+    path = str(tmp_path / "inventory_snapshot.json")
+    osc_snapshot.write_snapshot(COLLECTIONS, path)
+    return path
+
+
+def test_write_snapshot(snapshot_file):
+    with open(snapshot_file) as file:
+        data = json.load(file)
+
+    assert data["version"] == osc_snapshot.SNAPSHOT_VERSION
+    assert data["timestamp"] == pytest.approx(time.time(), abs=5)
+    assert data["collections"]["ports"] == {"latency": 0.5}
+    assert data["collections"]["servers"] == COLLECTIONS["servers"]
+    ports_file = osc_snapshot.collection_path(snapshot_file, "ports")
+    with open(ports_file) as file:
+        assert json.load(file) == COLLECTIONS["ports"]["items"]
+    assert stat.S_IMODE(os.stat(snapshot_file).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(ports_file).st_mode) == 0o600
+    assert sorted(os.listdir(os.path.dirname(snapshot_file))) == [
+        "inventory_snapshot.allocations.json",
+        "inventory_snapshot.floating_ips.json",
+        "inventory_snapshot.json",
+        "inventory_snapshot.pools.json",
+        "inventory_snapshot.ports.json",
+        "inventory_snapshot.resource_providers.json",
+    ]
+
+
+def test_load_snapshot_only_read_collections(snapshot_file):
+    """Test that only the collections read by the check are loaded."""
+    with open(osc_snapshot.collection_path(snapshot_file, "pools"), "w") as file:
+        file.write("invalid")
+    snapshot = osc_snapshot.load_snapshot(snapshot_file)
+
+    assert [port.id for port in snapshot.network.ports()] == ["port-0", "port-1"]
+    with pytest.raises(osc_snapshot.SnapshotError, match="can not be loaded"):
+        snapshot.load_balancer.pools()
+
+
+def test_load_snapshot_fields(tmp_path):
+    """Test that attributes which are not stored are not silently None."""
+    path = str(tmp_path / "inventory_snapshot.json")
+    ports = {"items": [{"id": "port-0", "status": "DOWN"}], "fields": ["id", "status"]}
+    osc_snapshot.write_snapshot({"ports": dict(ports, latency=1)}, path)
+    snapshot = osc_snapshot.load_snapshot(path)
+
+    assert snapshot.network.get_port("port-0").status == "DOWN"
+    with pytest.raises(osc_snapshot.SnapshotError, match="attribute name"):
+        snapshot.network.get_port("port-0").name
+    with pytest.raises(osc_snapshot.SnapshotError, match="attribute device_owner"):
+        snapshot.network.ports(device_owner="compute:nova")
+
+
+def test_load_snapshot_resources(snapshot_file):
+    snapshot = osc_snapshot.load_snapshot(snapshot_file)
+
+    assert [port.id for port in snapshot.network.ports()] == ["port-0", "port-1"]
+    assert [port.id for port in snapshot.network.ports(device_owner="network:dhcp")] == ["port-0"]
+    assert [port.id for port in snapshot.network.ports(id=["port-1", "port-9"])] == ["port-1"]
+    assert [port.id for port in snapshot.network.ports(subnet_id="subnet-1")] == ["port-1"]
+    assert [ip.id for ip in snapshot.network.ips(fixed_ip_address=None, status="DOWN")] == [
+        "fip-0"
+    ]
+    assert [pool.id for pool in snapshot.load_balancer.pools(loadbalancer_id="lb-1")] == ["pool-1"]
+    port = snapshot.network.get_port("port-1")
+    assert port.status == "DOWN"
+    assert port.binding_vif_type is None
+    assert getattr(port, "status", "UNKNOWN") == "DOWN"
+
+
+def test_load_snapshot_servers_project(tmp_path):
+    """Test that servers are scoped to the project of the credentials like the API."""
+    path = str(tmp_path / "inventory_snapshot.json")
+    servers = [{"id": "vm-0", "project_id": "admin"}, {"id": "vm-1", "project_id": "tenant"}]
+    osc_snapshot.write_snapshot({"servers": {"items": servers, "latency": 1}}, path, "admin")
+    snapshot = osc_snapshot.load_snapshot(path)
+
+    assert [server.id for server in snapshot.compute.servers()] == ["vm-0"]
+    assert [server.id for server in snapshot.compute.servers(all_projects=True)] == [
+        "vm-0",
+        "vm-1",
+    ]
+    assert snapshot.compute.get_server("vm-1").project_id == "tenant"
+
+
+def test_load_snapshot_servers_project_unknown(tmp_path):
+    path = str(tmp_path / "inventory_snapshot.json")
+    osc_snapshot.write_snapshot({"servers": {"items": [], "latency": 1}}, path)
+    snapshot = osc_snapshot.load_snapshot(path)
+
+    assert snapshot.compute.servers(all_projects=True) == []
+    with pytest.raises(osc_snapshot.SnapshotError, match="project"):
+        snapshot.compute.servers()
+
+
+def test_load_snapshot_resource_not_found(snapshot_file):
+    snapshot = osc_snapshot.load_snapshot(snapshot_file)
+
+    with pytest.raises(openstack.exceptions.ResourceNotFound):
+        snapshot.network.get_port("port-2")
+
+
+def test_load_snapshot_missing_collection(snapshot_file):
+    snapshot = osc_snapshot.load_snapshot(snapshot_file)
+
+    with pytest.raises(osc_snapshot.SnapshotError, match="service unavailable"):
+        snapshot.compute.servers()
+
+    with pytest.raises(osc_snapshot.SnapshotError, match="not collected"):
+        snapshot.network.networks()
+
+
+def test_load_snapshot_placement(snapshot_file):
+    placement = osc_snapshot.load_snapshot(snapshot_file).placement
+
+    resource_providers = json.loads(placement.get("/resource_providers").content)
+    allocations = json.loads(placement.get("/resource_providers/rp-0/allocations").content)
+
+    assert resource_providers == {"resource_providers": [{"name": "host-0", "uuid": "rp-0"}]}
+    assert allocations == {"allocations": {"vm-0": {}, "vm-1": {}}}
+
+
+def test_load_snapshot_stale(tmp_path):
+    path = str(tmp_path / "inventory_snapshot.json")
+    with mock.patch.object(osc_snapshot.time, "time", return_value=time.time() - 1000):
+        osc_snapshot.write_snapshot(COLLECTIONS, path)
+
+    assert osc_snapshot.load_snapshot(path, max_age=1200).age == pytest.approx(1000, abs=5)
+    with pytest.raises(osc_snapshot.SnapshotError, match="seconds old"):
+        osc_snapshot.load_snapshot(path, max_age=900)
+
+
+@pytest.mark.parametrize("content", ["", '{"version": 0, "timestamp": 0, "collections": {}}'])
+def test_load_snapshot_invalid(tmp_path, content):
+    path = tmp_path / "inventory_snapshot.json"
+    path.write_text(content)
+
+    with pytest.raises(osc_snapshot.SnapshotError):
+        osc_snapshot.load_snapshot(str(path))
+
+
+def test_load_snapshot_not_exists(tmp_path):
+    with pytest.raises(osc_snapshot.SnapshotError, match="can not be loaded"):
+        osc_snapshot.load_snapshot(str(tmp_path / "inventory_snapshot.json"))
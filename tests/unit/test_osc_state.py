@@ -0,0 +1,65 @@
+"""Test states of resources persisted between check runs."""
+
+import sqlite3
+
+import osc_state
+import pytest
+
+
+@pytest.mark.parametrize(
+    "seconds, exp_duration",
+    [(-1, "0s"), (45, "45s"), (720, "12m"), (7500, "2h05m"), (273600, "3d04h")],
+)
+def test_format_duration(seconds, exp_duration):
+    assert osc_state.format_duration(seconds) == exp_duration
+
+
+def test_resource_states(tmp_path):
+    path = str(tmp_path / "check_ports.state")
+
+    states = osc_state.ResourceStates(path, now=100)
+    assert states.initial
+    assert states.update("port-1", "ok") == (None, 100)
+    assert states.update("port-2", "critical") == (None, 100)
+    assert states.update("port-3", "ok") == (None, 100)
+    states.close()
+
+    states = osc_state.ResourceStates(path, now=200)
+    assert not states.initial
+    assert states.update("port-1", "critical") == ("ok", 200)
+    assert states.update("port-2", "critical") == ("critical", 100)
+    assert states.update("port-4", "ok") == (None, 200)
+    states.close()
+
+    with sqlite3.connect(path) as db:
+        rows = db.execute("SELECT * FROM states ORDER BY id").fetchall()
+
+    # port-3 was not checked in the last run
+    assert rows == [
+        ("port-1", "critical", 200),
+        ("port-2", "critical", 100),
+        ("port-4", "ok", 200),
+    ]
+
+
+def test_resource_states_error(tmp_path):
+    with pytest.raises(osc_state.StateError, match="state file"):
+        osc_state.ResourceStates(str(tmp_path / "missing" / "check_ports.state"))
+
+
+def test_resource_states_keep_unseen(tmp_path):
+    path = str(tmp_path / "check_ports.state")
+    states = osc_state.ResourceStates(path, now=100)
+    states.update("port-1", "ok")
+    states.update("port-2", "critical")
+    states.close()
+
+    states = osc_state.ResourceStates(path, now=200)
+    assert states.update("port-1", "critical") == ("ok", 200)
+    states.close(forget=False)
+
+    with sqlite3.connect(path) as db:
+        rows = db.execute("SELECT * FROM states ORDER BY id").fetchall()
+
+    # port-2 was not evaluated by the stopped run
+    assert rows == [("port-1", "critical", 200), ("port-2", "critical", 100)]
@@ -0,0 +1,150 @@
+"""Test shared Keystone token cache."""
+
+import datetime
+import json
+import os
+import stat
+from unittest import mock
+
+import osc_token_cache
+import pytest
+
+
+class FakeAuthRef:
+    """Helper object representing the keystoneauth AccessInfo."""
+
+    def __init__(self, token, expires_in=3600):
+        """Initialize of FakeAuthRef."""
+        self.token = token
+        self.expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+            seconds=expires_in
+        )
+
+
+class FakeAuth:
+    """Helper object representing the keystoneauth identity plugin."""
+
+    def __init__(self, cache_id="cache-id", expires_in=3600):
+        """Initialize of FakeAuth."""
+        self.auth_ref = None
+        self.cache_id = cache_id
+        self.expires_in = expires_in
+        self.authentications = 0
+
+    def get_cache_id(self):
+        return self.cache_id
+
+    def get_auth_state(self):
+        return json.dumps({"token": self.auth_ref.token, "expires_in": self.expires_in})
+
+    def set_auth_state(self, data):
+        state = json.loads(data)
+        self.auth_ref = FakeAuthRef(state["token"], state["expires_in"])
+
+    def get_access(self, session, **kwargs):
+        if self.auth_ref is None:
+            self.authentications += 1
+            self.auth_ref = FakeAuthRef("token-{}".format(self.authentications), self.expires_in)
+
+        return self.auth_ref
+
+
+def fake_client(auth):
+    client = mock.MagicMock()
+    client.session.auth = auth
+    return client
+
+
+@pytest.fixture
+def cache_file(tmp_path):
+    return str(tmp_path / "token_cache.json")
+
+
+def test_attach_token_cache(cache_file):
+    first = FakeAuth()
+    osc_token_cache.attach_token_cache(fake_client(first), cache_file)
+    assert first.get_access(None).token == "token-1"
+    assert first.authentications == 1
+
+    second = FakeAuth()
+    osc_token_cache.attach_token_cache(fake_client(second), cache_file)
+    assert second.get_access(None).token == "token-1"
+    assert second.authentications == 0
+
+    assert stat.S_IMODE(os.stat(cache_file).st_mode) == 0o600
+    with open(cache_file) as file:
+        stats = list(json.load(file)["stats"].values())
+
+    assert stats == [{"auth_requests": 1, "cache_hits": 1}]
+
+
+def test_attach_token_cache_different_credentials(cache_file):
+    osc_token_cache.attach_token_cache(fake_client(FakeAuth("admin")), cache_file)
+    auth = FakeAuth("nagios")
+    osc_token_cache.attach_token_cache(fake_client(auth), cache_file)
+
+    auth.get_access(None)
+    assert auth.authentications == 1
+
+
+def test_attach_token_cache_expiring_token(cache_file):
+    first = FakeAuth(expires_in=osc_token_cache.EXPIRY_MARGIN - 10)
+    osc_token_cache.attach_token_cache(fake_client(first), cache_file)
+    first.get_access(None)
+
+    second = FakeAuth()
+    osc_token_cache.attach_token_cache(fake_client(second), cache_file)
+    second.get_access(None)
+    assert second.authentications == 1
+
+
+def test_attach_token_cache_restore_once(cache_file):
+    """Test that invalidated token is not loaded from cache again."""
+    first = FakeAuth()
+    osc_token_cache.attach_token_cache(fake_client(first), cache_file)
+    first.get_access(None)
+
+    auth = FakeAuth()
+    osc_token_cache.attach_token_cache(fake_client(auth), cache_file)
+    auth.get_access(None)
+    assert auth.authentications == 0
+
+    # keystoneauth invalidates the token after 401 response
+    auth.auth_ref = None
+    assert auth.get_access(None).token == "token-1"
+    assert auth.authentications == 1
+
+
+def test_attach_token_cache_twice(cache_file):
+    auth = FakeAuth()
+    client = fake_client(auth)
+    osc_token_cache.attach_token_cache(client, cache_file)
+    get_access = auth.get_access
+    osc_token_cache.attach_token_cache(client, cache_file)
+
+    assert auth.get_access is get_access
+
+
+def test_attach_token_cache_not_writable(tmp_path):
+    """Test that check works if the cache can not be used."""
+    auth = FakeAuth()
+    osc_token_cache.attach_token_cache(fake_client(auth), str(tmp_path / "missing" / "cache"))
+
+    assert auth.get_access(None).token == "token-1"
+
+
+def test_stats_trimmed(cache_file):
+    with open(cache_file, "w") as file:
+        stats = {"2000-01-01T{:02}:00".format(hour): {"auth_requests": 1} for hour in range(24)}
+        stats.update(
+            {"2000-01-02T{:02}:00".format(hour): {"auth_requests": 1} for hour in range(24)}
+        )
+        json.dump({"tokens": {}, "stats": stats}, file)
+
+    osc_token_cache._update(cache_file, "cache_hits")
+
+    with open(cache_file) as file:
+        stats = json.load(file)["stats"]
+
+    assert len(stats) == osc_token_cache.STATS_HOURS
+    assert "2000-01-01T00:00" not in stats
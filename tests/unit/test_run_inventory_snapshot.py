@@ -0,0 +1,112 @@
+"""Test inventory snapshot collector."""
+
+import json
+from unittest import mock
+
+import osc_placement
+import pytest
+import run_inventory_snapshot
+
+
+@pytest.fixture(autouse=True)
+def job_files(tmp_path):
+    with mock.patch.multiple(
+        run_inventory_snapshot,
+        LOCK_FILE=str(tmp_path / "inventory_snapshot.lock"),
+        RUNS_FILE=str(tmp_path / "inventory_snapshot.runs"),
+    ):
+        yield
+
+
+def fake_response(data):
+    """Mock streamed response of placement API."""
+    response = mock.MagicMock()
+    response.iter_content.return_value = [json.dumps(data).encode("utf-8")]
+    return response
+
+
+def test_collect():
+    connection = mock.MagicMock()
+    port = mock.MagicMock()
+    port.to_dict.return_value = {
+        "id": "port-0",
+        "status": "ACTIVE",
+        "binding_vif_type": "ovs",
+        "description": "not read by the checks",
+        "device_id": None,
+    }
+    connection.network.ports.return_value = [port]
+    connection.load_balancer.load_balancers.side_effect = Exception("endpoint not found")
+    placement_client = mock.MagicMock()
+    placement_client.get.side_effect = lambda path, **_: {
+        "/resource_providers": fake_response(
+            {"resource_providers": [{"name": "host-0", "uuid": "rp-0", "generation": 1}]}
+        ),
+        "/resource_providers/rp-0/allocations": fake_response(
+            {"allocations": {"vm-1": {}, "vm-0": {}}}
+        ),
+    }[path]
+
+    collections = run_inventory_snapshot.collect(
+        connection, placement_client, ["ports", "load_balancers", "allocations"], 2
+    )
+
+    port.to_dict.assert_called_once_with(computed=False)
+    assert "binding:vif_type" in connection.network.ports.call_args.kwargs["fields"]
+    assert collections["ports"]["items"] == [
+        {"id": "port-0", "status": "ACTIVE", "binding_vif_type": "ovs"}
+    ]
+    assert collections["ports"]["fields"] == run_inventory_snapshot.FIELDS["ports"]
+    assert collections["load_balancers"]["error"] == "endpoint not found"
+    assert "items" not in collections["load_balancers"]
+    assert collections["allocations"]["items"] == {"rp-0": ["vm-0", "vm-1"]}
+    # allocations are requested with timeout and retries like in the allocations check
+    placement_client.get.assert_called_with(
+        "/resource_providers/rp-0/allocations",
+        timeout=osc_placement.PLACEMENT_TIMEOUT,
+        connect_retries=osc_placement.PLACEMENT_RETRIES,
+        status_code_retries=osc_placement.PLACEMENT_RETRIES,
+        retriable_status_codes=osc_placement.RETRIABLE_STATUS_CODES,
+        stream=True,
+    )
+    assert all(collection["latency"] >= 0 for collection in collections.values())
+
+
+def test_collect_servers_all_projects():
+    connection = mock.MagicMock()
+
+    run_inventory_snapshot.collect(connection, None, ["servers"])
+
+    connection.compute.servers.assert_called_once_with(details=True, all_projects=True)
+
+
+def test_main_project_id(tmp_path, monkeypatch):
+    """Test that the project of the credentials scoping the servers is recorded."""
+    output = str(tmp_path / "inventory_snapshot.json")
+    monkeypatch.setattr("sys.argv", ["run_inventory_snapshot.py", "-c", "servers", "-o", output])
+    with mock.patch("run_inventory_snapshot.set_openstack_credentials"), mock.patch(
+        "run_inventory_snapshot.openstack.connect"
+    ) as connect:
+        connect.return_value.current_project_id = "admin"
+        connect.return_value.compute.servers.return_value = []
+        run_inventory_snapshot.main()
+
+    with open(output) as file:
+        assert json.load(file)["project_id"] == "admin"
+
+
+def test_main_overlap(tmp_path, monkeypatch):
+    """Test that start overlapping the run in progress is skipped and recorded."""
+    monkeypatch.setattr("sys.argv", ["run_inventory_snapshot.py"])
+    with mock.patch.object(run_inventory_snapshot, "run_collector") as run_collector:
+        with run_inventory_snapshot.exclusive_run(run_inventory_snapshot.LOCK_FILE):
+            run_inventory_snapshot.main()
+
+        run_collector.assert_not_called()
+        run_inventory_snapshot.main()
+
+    run_collector.assert_called_once()
+    with open(run_inventory_snapshot.RUNS_FILE) as file:
+        runs = json.load(file)
+    assert len(runs["skipped"]) == 1
+    assert len(runs["runs"]) == 1